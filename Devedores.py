@@ -1,28 +1,67 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import io
-from datetime import datetime, date
+from datetime import datetime
 
 st.set_page_config(page_title="Sistema de Devedores",
                    page_icon="📋",
                    layout="wide",
                    initial_sidebar_state="expanded")
 
-from database import init_db, get_session, Devedor, StatusDevedor
+from database import init_db, versao_tabelas, Devedor, StatusDevedor
+from carteira import ORDEM_PADRAO, CarteiraCompartilhada, FiltroCarteira
+from estatisticas import catalogo_estatisticas
+from inicializacao import exibir_perfil_inicializacao, medir
 from devedores_service import (load_devedores_from_db, add_devedor_to_db,
                                remover_devedor_from_db, import_excel_to_db,
-                               export_devedores_to_excel, update_devedor_in_db)
-
-@st.cache_data(show_spinner=False)
-def cached_load_devedores(_engine):
-    return load_devedores_from_db(_engine)
+                               export_devedores_to_excel, update_devedor_in_db,
+                               normalizar_telefones_existentes, ConflitoVersao,
+                               ResultadoIncerto, export_rejeitadas_to_excel)
+from fila_trabalho import garantir_fila_do_dia
+from conciliacao import conciliar_arquivo_pagamentos
+
+ORDENACOES_LISTA = {
+    "Atraso e valor": ORDEM_PADRAO,
+    "Valor": "valortotal",
+    "Nome": "nome",
+}
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def carteira_compartilhada(_engine, versao: int) -> CarteiraCompartilhada:
+    """
+    Uma carteira por versão da tabela de devedores no banco, compartilhada
+    por todas as sessões.
+    """
+    with medir('carga dos devedores'):
+        return CarteiraCompartilhada(
+            load_devedores_from_db(_engine, compacto=True), versao)
+
+
+def obter_carteira() -> CarteiraCompartilhada:
+    with medir('fila do dia'):
+        garantir_fila_do_dia(st.session_state.db_engine)
+    # Só escritas em devedores (de qualquer processo) trocam a carteira; a
+    # fila, a conciliação e o histórico não a recarregam.
+    versao, = versao_tabelas(st.session_state.db_engine,
+                             Devedor.__tablename__)
+    return carteira_compartilhada(st.session_state.db_engine, versao)
+
+
+@st.cache_resource(show_spinner=False)
+def preparar_banco():
+    """Engine do processo, com os telefones antigos já normalizados."""
+    engine = init_db()
+    with medir('normalização de telefones'):
+        normalizar_telefones_existentes(engine)
+    return engine
 
 def initialize_session_state():
     defaults = {
-        'df': None,
-        'filtered_df': None,
-        'edited_df_state': None,
+        'filtro_carteira': None,
+        'ordem_carteira': ORDEM_PADRAO,
+        'indices_filtrados': None,
+        'chave_indices': None,
         'page_number': 1,
         'items_per_page': 25,
         'search_term_state': "",
@@ -37,10 +76,42 @@ def initialize_session_state():
             st.session_state[key] = value
 
     if 'db_engine' not in st.session_state:
-        st.session_state.db_engine = init_db()
+        st.session_state.db_engine = preparar_banco()
 
 initialize_session_state()
 
+def botao_exportacao(gerar_df, assinatura, rotulo: str, nome_arquivo: str,
+                     chave: str):
+    """
+    Gera o Excel só quando o usuário pede. Gerar as planilhas a cada execução
+    da página custava segundos em toda interação. O arquivo gerado vale
+    enquanto a `assinatura` (versão dos dados, filtro, ordem) não mudar.
+    """
+    chave_estado = f"exportacao_{chave}"
+    gerado = st.session_state.get(chave_estado)
+    if gerado is not None and gerado[0] != assinatura:
+        gerado = st.session_state[chave_estado] = None
+
+    if gerado is None:
+        if st.button(rotulo, key=f"preparar_{chave}",
+                     use_container_width=True):
+            excel_data, mensagem = export_devedores_to_excel(gerar_df())
+            if excel_data:
+                st.session_state[chave_estado] = (assinatura, excel_data)
+                st.rerun()
+            st.error(mensagem)
+        return
+
+    st.download_button(
+        label="⬇️ Baixar planilha gerada",
+        data=gerado[1],
+        file_name=nome_arquivo,
+        mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        key=f"baixar_{chave}",
+        on_click="ignore",
+        use_container_width=True)
+
+
 def validate_excel_columns(df: pd.DataFrame, required_cols: list) -> tuple:
     missing = [col for col in required_cols if col not in df.columns]
     if missing:
@@ -48,7 +119,7 @@ def validate_excel_columns(df: pd.DataFrame, required_cols: list) -> tuple:
     return True, ""
 
 
-def sidebar_content():
+def sidebar_content(carteira: CarteiraCompartilhada):
     filters = {}
     with st.sidebar:
         st.header("📂 Gerenciar Dados")
@@ -56,66 +127,122 @@ def sidebar_content():
         st.subheader("⬆️ Importar de Excel")
         uploaded_file = st.file_uploader("Selecione o arquivo Excel",
                                          type=["xlsx", "xls"])
-        if uploaded_file:
+        # O arquivo continua no uploader nas execuções seguintes: cada
+        # arquivo é importado uma vez só.
+        if uploaded_file and st.session_state.get(
+                'arquivo_importado') != uploaded_file.file_id:
             st.info("Processando importacao...")
-            success, message = import_excel_to_db(st.session_state.db_engine,
-                                                  uploaded_file)
+            resultado = import_excel_to_db(st.session_state.db_engine,
+                                           uploaded_file)
+            st.session_state.arquivo_importado = uploaded_file.file_id
+            st.session_state.resultado_importacao = (
+                resultado[0], resultado[1],
+                export_rejeitadas_to_excel(resultado.rejeitadas)
+                if len(resultado.rejeitadas) else None)
+            # None: interrompida depois de gravar parte dos lotes.
+            if resultado[0] is not False:
+                st.session_state.should_reload_df = True
+                st.rerun()
+
+        if uploaded_file and st.session_state.get('resultado_importacao'):
+            success, message, rejeitadas = st.session_state.resultado_importacao
             if success:
                 st.success(message)
+            elif success is None:
+                st.warning(message)
+            else:
+                st.error(message)
+            if rejeitadas:
+                st.download_button(
+                    label="⬇️ Baixar linhas rejeitadas",
+                    data=rejeitadas,
+                    file_name="importacao_rejeitadas.xlsx",
+                    mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                    key="baixar_rejeitadas",
+                    on_click="ignore",
+                    use_container_width=True)
+
+        st.subheader("💳 Conciliar Pagamentos")
+        arquivo_pagamentos = st.file_uploader(
+            "Arquivo de pagamentos (pessoa, valor, data_pagamento)",
+            type=["csv", "xlsx"],
+            key="arquivo_pagamentos")
+        if arquivo_pagamentos and st.session_state.get(
+                'arquivo_conciliado') != arquivo_pagamentos.file_id:
+            with st.spinner("Conciliando pagamentos..."):
+                resultado = conciliar_arquivo_pagamentos(
+                    st.session_state.db_engine, arquivo_pagamentos)
+            st.session_state.arquivo_conciliado = arquivo_pagamentos.file_id
+            st.session_state.resultado_conciliacao = (
+                resultado[0], resultado[1],
+                export_rejeitadas_to_excel(resultado.nao_conciliados)
+                if len(resultado.nao_conciliados) else None)
+            if resultado[0] is not False:
                 st.session_state.should_reload_df = True
                 st.rerun()
+
+        if arquivo_pagamentos and st.session_state.get(
+                'resultado_conciliacao'):
+            success, message, nao_conciliados = st.session_state.resultado_conciliacao
+            if success:
+                st.success(message)
+            elif success is None:
+                st.warning(message)
             else:
                 st.error(message)
+            if nao_conciliados:
+                st.download_button(
+                    label="⬇️ Baixar pagamentos não conciliados",
+                    data=nao_conciliados,
+                    file_name="conciliacao_nao_conciliados.xlsx",
+                    mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                    key="baixar_nao_conciliados",
+                    on_click="ignore",
+                    use_container_width=True)
 
         st.subheader("🔽️ Exportar Dados")
-        if st.session_state.df is not None and not st.session_state.df.empty:
-            excel_data, export_message = export_devedores_to_excel(
-                st.session_state.df)
-            if excel_data:
-                st.download_button(
-                    label="Baixar Todos os Dados",
-                    data=excel_data,
-                    file_name="devedores_completo.xlsx",
-                    mime=
-                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
+        if len(carteira):
+            botao_exportacao(lambda: carteira.df, carteira.versao,
+                             "Baixar Todos os Dados",
+                             "devedores_completo.xlsx", "completo")
         else:
             st.info("Nenhum dado para exportar.")
 
     st.header("🔍 Filtros Avançados")
 
     filters['search_term'] = st.text_input(
-        "Buscar por Nome ou ID",
+        "Buscar por Nome, ID ou Telefone",
         value=st.session_state.search_term_state,
-        placeholder="Digite o nome ou ID...",
+        placeholder="Digite o nome, ID ou telefone...",
         key="search_term_input")
     st.session_state.search_term_state = filters['search_term']
 
-    if st.session_state.df is None or st.session_state.df.empty:
+    if not len(carteira):
         filters['original_valor_min'], filters[
             'original_valor_max'] = 0.0, 10000.0
         filters['original_dias_min'], filters['original_dias_max'] = 0, 365
     else:
-        valortotal_col = st.session_state.df['valortotal'].dropna()
-        atraso_col = st.session_state.df['atraso'].dropna()
+        catalogo = catalogo_estatisticas(st.session_state.db_engine)
+        faixa_valor = catalogo.faixa('valortotal')
+        faixa_atraso = catalogo.faixa('atraso')
 
-        if valortotal_col.empty:
+        if faixa_valor is None:
             filters['original_valor_min'] = 0.0
             filters['original_valor_max'] = 100.0
         else:
-            filters['original_valor_min'] = float(valortotal_col.min())
-            filters['original_valor_max'] = float(valortotal_col.max())
+            filters['original_valor_min'] = float(faixa_valor[0])
+            filters['original_valor_max'] = float(faixa_valor[1])
         if filters['original_valor_min'] == filters['original_valor_max']:
             filters[
                 'original_valor_max'] += 1.0  
 
    
-        if atraso_col.empty:
+        if faixa_atraso is None:
             filters['original_dias_min'] = 0
             filters['original_dias_max'] = 100
         else:
-            filters['original_dias_min'] = int(atraso_col.min())
-            filters['original_dias_max'] = int(atraso_col.max())
+            filters['original_dias_min'] = int(faixa_atraso[0])
+            filters['original_dias_max'] = int(faixa_atraso[1])
         if filters['original_dias_min'] == filters['original_dias_max']:
             filters['original_dias_max'] += 1 
     
@@ -138,39 +265,30 @@ def sidebar_content():
     return filters
 
 
-def apply_filters(df, filters):
-    if df is None or df.empty:
-        return pd.DataFrame()
-
-    filtered = df.copy()
-    filtered['valortotal'] = pd.to_numeric(filtered['valortotal'],
-                                           errors='coerce').fillna(0)
-    filtered['atraso'] = pd.to_numeric(filtered['atraso'],
-                                       errors='coerce').fillna(0)
-    filtered['nome'] = filtered['nome'].astype(str).fillna('')
-    filtered['pessoa'] = filtered['pessoa'].astype(str).fillna('')
-
-    if filters['search_term']:
-        term = filters['search_term'].strip()
-        name_match = filtered['nome'].str.contains(term, case=False, na=False)
-        id_match = filtered['pessoa'].str.contains(term, case=False, na=False)
-        filtered = filtered[name_match | id_match]
-
-    if filters['valor_range'] != (filters['original_valor_min'],
-                                  filters['original_valor_max']):
-        filtered = filtered[
-            (filtered['valortotal'] >= filters['valor_range'][0])
-            & (filtered['valortotal'] <= filters['valor_range'][1])]
-
-    if filters['dias_range'] != (filters['original_dias_min'],
-                                 filters['original_dias_max']):
-        filtered = filtered[(filtered['atraso'] >= filters['dias_range'][0])
-                            & (filtered['atraso'] <= filters['dias_range'][1])]
-
-    return filtered
-
-
-def render_data_controls():
+def apply_filters(carteira: CarteiraCompartilhada, filters) -> np.ndarray:
+    """
+    Posições filtradas e ordenadas da carteira compartilhada. A sessão guarda
+    só o filtro, a ordem e essas posições; elas são recalculadas apenas quando
+    um deles ou a versão dos dados muda.
+    """
+    filtro = FiltroCarteira(
+        termo=filters['search_term'] or '',
+        valor=None if filters['valor_range'] == (
+            filters['original_valor_min'], filters['original_valor_max'])
+        else tuple(filters['valor_range']),
+        atraso=None if filters['dias_range'] == (
+            filters['original_dias_min'], filters['original_dias_max'])
+        else tuple(filters['dias_range']))
+    chave = (carteira.versao, filtro, st.session_state.ordem_carteira)
+    if st.session_state.chave_indices != chave:
+        st.session_state.indices_filtrados = carteira.ordenar(
+            carteira.filtrar(filtro), st.session_state.ordem_carteira)
+        st.session_state.filtro_carteira = filtro
+        st.session_state.chave_indices = chave
+    return st.session_state.indices_filtrados
+
+
+def render_data_controls(carteira: CarteiraCompartilhada):
     col1, col2 = st.columns([0.3, 1])
     with col1:
         if st.button("🧹 Limpar Filtros",
@@ -179,28 +297,24 @@ def render_data_controls():
             st.session_state.page_number = 1
             st.session_state.search_term_state = ""
             st.session_state.should_reload_df = True
-            st.session_state.edited_df_state = None
             st.rerun()
 
     with col2:
-        if not st.session_state.filtered_df.empty:
-            excel_data, msg = export_devedores_to_excel(
-                st.session_state.filtered_df)
-
-            if excel_data:
-                st.download_button(
-                    label="📤 Exportar Tabela Filtrada para Excel",
-                    data=excel_data,
-                    file_name=
-                    f"devedores_filtrados_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                    mime=
-                    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                    key="export_filtered_excel_btn",
-                    use_container_width=True)
+        indices = st.session_state.indices_filtrados
+        if len(indices):
+            botao_exportacao(
+                lambda: carteira.linhas(indices),
+                st.session_state.chave_indices,
+                "📤 Exportar Tabela Filtrada para Excel",
+                f"devedores_filtrados_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                "filtrada")
 
 def process_table_edits(edited_df, original_df):
-    diff_mask = (edited_df
-                 != original_df) & ~(edited_df.isna() & original_df.isna())
+    # Colunas compactas (texto pyarrow, boolean) usam pd.NA: comparações com
+    # NA dão NA, então "igual" é decidido com NA contando como diferente, e
+    # dois ausentes contam como iguais.
+    iguais = (edited_df == original_df).fillna(False).astype(bool)
+    diff_mask = ~(iguais | (edited_df.isna() & original_df.isna()))
     rows_with_changes = diff_mask.any(axis=1)
     changed_rows = edited_df[rows_with_changes]
 
@@ -208,34 +322,46 @@ def process_table_edits(edited_df, original_df):
         return
 
     updates_processed = 0
+    conflitos = 0
     for idx in changed_rows.index:
-        devedor_id = original_df.loc[idx, 'id']
+        # Os inteiros compactos da carteira (numpy) não servem de chave para
+        # o session.get do SQLite: id e versão vão como int do Python.
+        devedor_id = int(original_df.loc[idx, 'id'])
         changes = {
-            col: edited_df.loc[idx, col]
-            for col in edited_df.columns
-            if edited_df.loc[idx, col] != original_df.loc[idx, col]
+            col: None if pd.isna(valor) else
+            valor.item() if isinstance(valor, np.generic) else valor
+            for col, valor in edited_df.loc[idx, diff_mask.loc[idx]].items()
         }
 
         if 'status' in changes and str(
                 changes['status']) == StatusDevedor.PAGO.value:
             changes['data_pagamento'] = datetime.now().date()
 
-        success, message = update_devedor_in_db(st.session_state.db_engine,
-                                                devedor_id, changes)
+        resultado = update_devedor_in_db(
+            st.session_state.db_engine,
+            devedor_id,
+            changes,
+            versao_esperada=int(original_df.loc[idx, 'versao']))
+        success, message = resultado
         if success:
             updates_processed += 1
+        elif isinstance(resultado, (ConflitoVersao, ResultadoIncerto)):
+            conflitos += 1
+            st.warning(message)
         else:
             st.error(f"Erro ao atualizar ID {devedor_id}: {message}")
 
+    if conflitos:
+        st.session_state.should_reload_df = True
+
     if updates_processed:
         st.success(
             f"{updates_processed} registro(s) atualizado(s) com sucesso!")
         st.session_state.should_reload_df = True
-        cached_load_devedores.clear()
         st.rerun()
 
 
-def show_lista_devedores_tab(filters):
+def show_lista_devedores_tab(carteira: CarteiraCompartilhada, filters):
 
     st.title("📋 Lista de Devedores")
 
@@ -256,34 +382,32 @@ def show_lista_devedores_tab(filters):
                 if not nome or valor <= 0:
                     st.error("Por favor, preencha o Nome e o Valor Devido.")
                 else:
-                    success, message = add_devedor_to_db(
+                    resultado = add_devedor_to_db(
                         st.session_state.db_engine, nome, valor, atraso,
                         telefone, pessoa_id)
+                    success, message = resultado
                     if success:
                         st.success(message)
                         st.session_state.should_reload_df = True
                         st.session_state.search_term_state = ""
-
-                        cached_load_devedores.clear()
                         st.rerun()
+                    elif isinstance(resultado, ResultadoIncerto):
+                        st.warning(message)
+                        st.session_state.should_reload_df = True
                     else:
                         st.error(message)
 
     if st.session_state.should_reload_df:
-        st.session_state.df = cached_load_devedores(st.session_state.db_engine)
-        if st.session_state.df is not None:
-            st.session_state.df = st.session_state.df.sort_values(
-                by=['atraso', 'valortotal'], ascending=[False, False])
         st.session_state.should_reload_df = False
         st.session_state.page_number = 1
 
-    if st.session_state.df is None or st.session_state.df.empty:
+    if not len(carteira):
         st.info(
             "ℹ️ Nenhum devedor encontrado no banco de dados. Adicione um novo ou importe de um Excel."
         )
         return
-      
-    st.session_state.filtered_df = apply_filters(st.session_state.df, filters)
+
+    indices = apply_filters(carteira, filters)
     st.markdown("---")
 
     if st.session_state.confirming_delete:
@@ -297,11 +421,17 @@ def show_lista_devedores_tab(filters):
                        type="primary",
                        use_container_width=True):
             sucessos, falhas = 0, 0
-            for devedor_id in st.session_state.ids_to_delete:
-                success, message = remover_devedor_from_db(
-                    st.session_state.db_engine, devedor_id)
+            for devedor_id, versao in st.session_state.ids_to_delete:
+                resultado = remover_devedor_from_db(
+                    st.session_state.db_engine,
+                    devedor_id,
+                    versao_esperada=versao)
+                success, message = resultado
                 if success:
                     sucessos += 1
+                elif isinstance(resultado, (ConflitoVersao, ResultadoIncerto)):
+                    falhas += 1
+                    st.warning(message)
                 else:
                     falhas += 1
                     st.error(f"Erro ao remover ID {devedor_id}: {message}")
@@ -312,7 +442,6 @@ def show_lista_devedores_tab(filters):
             st.session_state.confirming_delete = False
             st.session_state.ids_to_delete = []
             st.session_state.should_reload_df = True
-            cached_load_devedores.clear()
             st.rerun()
 
         if col2.button("Cancelar", use_container_width=True):
@@ -321,14 +450,14 @@ def show_lista_devedores_tab(filters):
             st.rerun()
         return
 
-    total_registros_original = len(st.session_state.df)
-    total_registros_filtrados = len(st.session_state.filtered_df)
+    total_registros_original = len(carteira)
+    total_registros_filtrados = len(indices)
     st.info(
         f"📊 **Total de registros:** {total_registros_filtrados} de {total_registros_original} (filtrados)"
     )
 
     st.subheader("Registros de Devedores")
-    render_data_controls()
+    render_data_controls(carteira)
 
     items_per_page_options = [10, 25, 50, 100]
     if total_registros_filtrados > 100:
@@ -343,6 +472,13 @@ def show_lista_devedores_tab(filters):
 
     page_col1, page_col2 = st.columns([0.7, 0.3])
     with page_col2:
+        rotulo_ordem = st.selectbox("Ordenar por:",
+                                    options=list(ORDENACOES_LISTA),
+                                    key="ordem_lista_select")
+        if ORDENACOES_LISTA[rotulo_ordem] != st.session_state.ordem_carteira:
+            st.session_state.ordem_carteira = ORDENACOES_LISTA[rotulo_ordem]
+            st.session_state.page_number = 1
+            st.rerun()
         st.session_state.items_per_page = st.selectbox(
             "Itens por página:",
             options=items_per_page_options,
@@ -358,7 +494,7 @@ def show_lista_devedores_tab(filters):
 
     start_idx = (st.session_state.page_number - 1) * items_per_page
     end_idx = start_idx + items_per_page
-    display_df = st.session_state.filtered_df.iloc[start_idx:end_idx].copy()
+    display_df = carteira.linhas(indices[start_idx:end_idx])
 
     with page_col1:
         nav_cols = st.columns([1, 1, 3])
@@ -414,6 +550,12 @@ def show_lista_devedores_tab(filters):
                                              required=True),
             "telefone":
             st.column_config.TextColumn("Telefone", disabled=True),
+            "telefone_normalizado":
+            None,
+            "telefone_valido":
+            None,
+            "versao":
+            None,
             "data_pagamento":
             st.column_config.DateColumn("Data Pagamento",
                                         format="DD/MM/YYYY",
@@ -449,13 +591,21 @@ def show_lista_devedores_tab(filters):
                     type="primary",
                     use_container_width=True):
                 st.session_state.confirming_delete = True
-                st.session_state.ids_to_delete = linhas_para_excluir[
-                    'id'].tolist()
+                # (id, versão lida): a exclusão não apaga um devedor que
+                # outro usuário alterou depois.
+                st.session_state.ids_to_delete = [
+                    (int(devedor_id), int(versao))
+                    for devedor_id, versao in zip(
+                        linhas_para_excluir['id'],
+                        linhas_para_excluir['versao'])
+                ]
                 st.rerun()
     else:
         st.warning("Nenhum registro encontrado com os filtros aplicados.")
 
 
 if __name__ == "__main__":
-    active_filters = sidebar_content()
-    show_lista_devedores_tab(active_filters)
+    carteira = obter_carteira()
+    active_filters = sidebar_content(carteira)
+    show_lista_devedores_tab(carteira, active_filters)
+    exibir_perfil_inicializacao()
@@ -0,0 +1,141 @@
+import numpy as np
+from datetime import date, timedelta
+from functools import lru_cache
+
+# Débitos a partir deste valor ocupam duas vagas da agenda (negociação mais longa).
+LIMITE_ALTO_VALOR = 1000.0
+FASE_MAXIMA = 3
+
+_FERIADOS_FIXOS = [(1, 1), (4, 21), (5, 1), (9, 7), (10, 12), (11, 2),
+                   (11, 15), (11, 20), (12, 25)]
+
+
+def _pascoa(ano: int) -> date:
+    """Domingo de Páscoa (algoritmo de Meeus/Jones/Butcher)."""
+    a = ano % 19
+    b, c = divmod(ano, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    mes, dia = divmod(h + l - 7 * m + 114, 31)
+    return date(ano, mes, dia + 1)
+
+
+@lru_cache(maxsize=None)
+def feriados_nacionais(ano: int) -> tuple:
+    """Feriados nacionais (fixos e móveis) de um ano."""
+    pascoa = _pascoa(ano)
+    moveis = [
+        pascoa - timedelta(days=48),  # Carnaval (segunda)
+        pascoa - timedelta(days=47),  # Carnaval (terça)
+        pascoa - timedelta(days=2),  # Sexta-feira Santa
+        pascoa + timedelta(days=60),  # Corpus Christi
+    ]
+    fixos = [date(ano, mes, dia) for mes, dia in _FERIADOS_FIXOS]
+    return tuple(sorted(fixos + moveis))
+
+
+def dias_uteis(inicio: date, fim: date, feriados=()) -> np.ndarray:
+    """Dias úteis (datetime64[D]) entre inicio e fim, inclusive."""
+    anos = range(inicio.year, fim.year + 1)
+    todos_feriados = [f for ano in anos for f in feriados_nacionais(ano)]
+    todos_feriados += list(feriados)
+    dias = np.arange(np.datetime64(inicio, 'D'),
+                     np.datetime64(fim, 'D') + 1,
+                     dtype='datetime64[D]')
+    feriados_np = np.array(todos_feriados, dtype='datetime64[D]')
+    return dias[np.is_busday(dias, holidays=feriados_np)]
+
+
+def calcular_pesos(valortotal: np.ndarray,
+                   fase_cobranca: np.ndarray,
+                   criterio: str | None = None) -> np.ndarray:
+    """
+    Quantas vagas da capacidade diária cada cobrança ocupa.
+    - None: uma vaga por devedor
+    - 'fase': fases mais avançadas ocupam mais vagas (1 a 3)
+    - 'valor': débitos altos ocupam duas vagas
+    """
+    n = len(valortotal)
+    if criterio is None:
+        return np.ones(n, dtype=np.float64)
+    if criterio == 'fase':
+        fase = np.nan_to_num(np.asarray(fase_cobranca, dtype=np.float64),
+                             nan=1.0)
+        return np.clip(fase, 1, FASE_MAXIMA)
+    if criterio == 'valor':
+        valor = np.nan_to_num(np.asarray(valortotal, dtype=np.float64))
+        return np.where(valor >= LIMITE_ALTO_VALOR, 2.0, 1.0)
+    raise ValueError(f"Critério de peso desconhecido: {criterio}")
+
+
+def distribuir_carga(pesos: np.ndarray, carga_existente: np.ndarray,
+                     capacidade: float) -> np.ndarray:
+    """
+    Distribui itens (já ordenados por prioridade) pelos dias disponíveis.
+
+    Os dias são nivelados ("water filling"): a carga final de cada dia tende
+    ao mesmo nível, sem nunca passar da capacidade. Itens de maior prioridade
+    ficam nos primeiros dias; um item que não cabe em nenhuma sobra é
+    pulado e os seguintes continuam sendo encaixados. Retorna o índice do
+    dia de cada item, ou -1 quando não há capacidade livre para ele.
+    """
+    pesos = np.asarray(pesos, dtype=np.float64)
+    carga_existente = np.asarray(carga_existente, dtype=np.float64)
+    resultado = np.full(len(pesos), -1, dtype=np.int64)
+    if len(pesos) == 0 or len(carga_existente) == 0:
+        return resultado
+
+    livre = np.clip(capacidade - carga_existente, 0, None)
+    total = pesos.sum()
+
+    if total >= livre.sum():
+        cotas = livre
+    else:
+        # Busca binária do nível que acomoda exatamente o total de pesos.
+        baixo, alto = carga_existente.min(), float(capacidade)
+        for _ in range(60):
+            nivel = (baixo + alto) / 2
+            if np.clip(nivel - carga_existente, 0, livre).sum() < total:
+                baixo = nivel
+            else:
+                alto = nivel
+        cotas = np.clip(alto - carga_existente, 0, livre)
+
+    acumulado = np.cumsum(pesos)
+    limites = np.cumsum(cotas)
+    eps = 1e-9
+    inicio, base = 0, 0.0
+    for dia in range(len(cotas)):
+        if inicio >= len(pesos):
+            break
+        fim = min(
+            np.searchsorted(acumulado, limites[dia] + eps, side='right'),
+            np.searchsorted(acumulado, base + livre[dia] + eps, side='right'))
+        if fim > inicio:
+            resultado[inicio:fim] = dia
+            base = acumulado[fim - 1]
+            inicio = fim
+
+    # Um item que não coube no dia corta a faixa contínua acima; os que vêm
+    # depois dele ainda ocupam as sobras, no primeiro dia com vaga.
+    pendentes = np.flatnonzero(resultado < 0)
+    if len(pendentes):
+        folga = livre - np.bincount(resultado[resultado >= 0],
+                                    weights=pesos[resultado >= 0],
+                                    minlength=len(livre))
+        menor_restante = np.minimum.accumulate(pesos[pendentes][::-1])[::-1]
+        for i, item in enumerate(pendentes):
+            maior_folga = folga.max()
+            if maior_folga + eps < menor_restante[i]:
+                break
+            if pesos[item] > maior_folga + eps:
+                continue
+            dia = int(np.argmax(folga + eps >= pesos[item]))
+            resultado[item] = dia
+            folga[dia] -= pesos[item]
+    return resultado
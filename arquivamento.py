@@ -0,0 +1,75 @@
+"""
+Arquivamento de devedores pagos.
+
+Devedores com status PAGO e pagamento há mais de `dias` (padrão em
+COBRANCAS_DIAS_ARQUIVAMENTO, 90) saem de `devedores` e vão para
+`devedores_arquivados`, em lotes: cada lote copia e remove as linhas na mesma
+transação. Assim as listas, contagens e dashboards do dia a dia só percorrem
+a carteira ativa; relatórios históricos usam a visão `devedores_historico`.
+
+Pagos sem `data_pagamento` (anteriores a essa coluna) não são arquivados.
+
+Uso headless: python arquivamento.py [dias]
+"""
+import os
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, literal, select
+from sqlalchemy.orm import Session
+
+from database import (COLUNAS_DEVEDOR, Devedor, DevedorArquivado,
+                      ItemFilaTrabalho, StatusDevedor, init_db)
+from estatisticas import invalidar_estatisticas
+from fila_escrita import LINHAS_POR_OPERACAO, escrever
+
+DIAS_ARQUIVAMENTO = int(os.environ.get('COBRANCAS_DIAS_ARQUIVAMENTO', '90'))
+TAMANHO_LOTE_ARQUIVAMENTO = LINHAS_POR_OPERACAO
+
+
+def _arquivar_lote(session: Session, limite: datetime, tamanho_lote: int,
+                   agora: datetime) -> int:
+    ids = session.execute(
+        select(Devedor.id).where(
+            Devedor.status == StatusDevedor.PAGO,
+            Devedor.data_pagamento < limite).order_by(
+                Devedor.id).limit(tamanho_lote)).scalars().all()
+    if not ids:
+        return 0
+
+    devedores = Devedor.__table__
+    session.execute(
+        insert(DevedorArquivado).from_select(
+            COLUNAS_DEVEDOR + ['arquivado_em'],
+            select(*[devedores.c[c] for c in COLUNAS_DEVEDOR],
+                   literal(agora, DevedorArquivado.arquivado_em.type)).where(
+                       devedores.c.id.in_(ids))))
+    session.execute(
+        delete(ItemFilaTrabalho).where(ItemFilaTrabalho.devedor_id.in_(ids)))
+    session.execute(delete(devedores).where(devedores.c.id.in_(ids)))
+    invalidar_estatisticas(session)
+    return len(ids)
+
+
+def arquivar_pagos(db_engine,
+                   dias: int = DIAS_ARQUIVAMENTO,
+                   tamanho_lote: int = TAMANHO_LOTE_ARQUIVAMENTO) -> int:
+    """
+    Move os pagos há mais de `dias` para `devedores_arquivados`, um lote por
+    operação da fila de escrita. Retorna quantos foram arquivados.
+    """
+    agora = datetime.now()
+    limite = agora - timedelta(days=dias)
+    total = 0
+    while True:
+        arquivados = escrever(db_engine, _arquivar_lote, limite, tamanho_lote,
+                              agora)
+        total += arquivados
+        if arquivados < tamanho_lote:
+            return total
+
+
+if __name__ == "__main__":
+    dias = int(sys.argv[1]) if len(sys.argv) > 1 else DIAS_ARQUIVAMENTO
+    total = arquivar_pagos(init_db(), dias)
+    print(f"{total} devedor(es) pago(s) há mais de {dias} dias arquivado(s).")
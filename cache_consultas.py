@@ -0,0 +1,257 @@
+"""
+Cache de resultados de consultas, compartilhado por todas as sessões do
+processo.
+
+A chave é (nome da consulta, banco, parâmetros normalizados, versões das
+tabelas lidas pela consulta, dia). Cada consulta declara as tabelas de onde
+lê (`em_cache(tabelas=...)`): um commit só tira do cache as consultas dessas
+tabelas, seja deste processo ou de outro (`versao_tabelas`). Resultados
+antigos deixam de ser pedidos e saem pelo LRU ou pelo TTL. A memória é
+limitada em bytes, e sessões que pedem a mesma chave ao mesmo tempo esperam
+uma única execução da consulta.
+
+`precarregar` executa consultas em segundo plano (ex.: as páginas vizinhas da
+que acabou de ser exibida) para que já estejam no cache quando pedidas. O
+pool tem poucas threads e uma fila curta: pedidos além dela são descartados,
+e cada sessão cancela os seus pedidos ainda não iniciados ao fazer novos.
+"""
+import inspect
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date
+from functools import wraps
+from typing import (Any, Callable, Dict, Hashable, Iterable, List, Sequence,
+                    Tuple)
+
+import pandas as pd
+
+from compactacao import bytes_em_memoria
+from database import versao_tabelas
+
+MAX_BYTES_CACHE = 128 * 1024 * 1024
+TTL_CACHE = 60.0
+THREADS_PRECARGA = 2
+MAX_PRECARGAS_PENDENTES = 8
+
+
+def _tamanho(valor: Any) -> int:
+    if isinstance(valor, pd.DataFrame):
+        return bytes_em_memoria(valor)
+    return sys.getsizeof(valor)
+
+
+def _copia(valor: Any) -> Any:
+    # DataFrames são mutáveis: cada sessão recebe a sua cópia (como
+    # st.cache_data), e o valor guardado nunca é alterado.
+    return valor.copy() if isinstance(valor, pd.DataFrame) else valor
+
+
+class CacheConsultas:
+    """LRU limitado em bytes, com TTL e contadores de acertos e falhas."""
+
+    def __init__(self, max_bytes: int = MAX_BYTES_CACHE,
+                 ttl: float = TTL_CACHE):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._itens: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._em_andamento: Dict[Hashable, Future] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.despejos = 0
+
+    def obter(self, chave: Hashable, calcular: Callable[[], Any]) -> Any:
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None and item[2] > time.monotonic():
+                self._itens.move_to_end(chave)
+                self.acertos += 1
+                return _copia(item[0])
+            if item is not None:
+                self._remover(chave)
+            futuro = self._em_andamento.get(chave)
+            calcula_aqui = futuro is None
+            if calcula_aqui:
+                futuro = self._em_andamento[chave] = Future()
+                self.falhas += 1
+            else:
+                self.acertos += 1
+
+        if not calcula_aqui:
+            return _copia(futuro.result())
+
+        try:
+            valor = calcular()
+        except BaseException as erro:
+            with self._lock:
+                del self._em_andamento[chave]
+            futuro.set_exception(erro)
+            raise
+        with self._lock:
+            del self._em_andamento[chave]
+            self._guardar(chave, valor)
+        futuro.set_result(valor)
+        return _copia(valor)
+
+    def _guardar(self, chave: Hashable, valor: Any):
+        tamanho = _tamanho(valor)
+        if tamanho > self.max_bytes:
+            return
+        self._itens[chave] = (valor, tamanho, time.monotonic() + self.ttl)
+        self._bytes += tamanho
+        while self._bytes > self.max_bytes:
+            self._remover(next(iter(self._itens)))
+            self.despejos += 1
+
+    def _remover(self, chave: Hashable):
+        _, tamanho, _ = self._itens.pop(chave)
+        self._bytes -= tamanho
+
+    def contem(self, chave: Hashable) -> bool:
+        """Chave válida no cache ou sendo calculada (não conta como acesso)."""
+        with self._lock:
+            item = self._itens.get(chave)
+            return (chave in self._em_andamento
+                    or (item is not None and item[2] > time.monotonic()))
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+            self._bytes = 0
+
+    def estatisticas(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.acertos + self.falhas
+            return {
+                'itens': len(self._itens),
+                'bytes': self._bytes,
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'despejos': self.despejos,
+                'taxa_acerto': self.acertos / total if total else 0.0,
+            }
+
+
+cache_consultas = CacheConsultas()
+
+
+def _normalizar(valor: Any) -> Hashable:
+    if isinstance(valor, str):
+        return valor.strip() or None
+    if isinstance(valor, (list, tuple, set, frozenset)):
+        return tuple(_normalizar(v) for v in valor)
+    return valor
+
+
+def em_cache(func: Callable = None,
+             *,
+             tabelas: Sequence[str],
+             nome: str = None):
+    """
+    Guarda em `cache_consultas` o resultado de uma consulta de serviço
+    `func(db_engine, ...)` que lê das `tabelas`. Os parâmetros entram na chave
+    já com os valores padrão aplicados e textos sem espaços nas pontas
+    (vazio = None).
+    """
+    if func is None:
+        return lambda f: em_cache(f, tabelas=tabelas, nome=nome)
+    tabelas = tuple(tabelas)
+
+    assinatura = inspect.signature(func)
+    nome = nome or func.__name__
+
+    def chave_e_argumentos(db_engine, *args, **kwargs):
+        argumentos = assinatura.bind(db_engine, *args, **kwargs)
+        argumentos.apply_defaults()
+        for chave, valor in argumentos.arguments.items():
+            if isinstance(valor, str):
+                # A consulta recebe o mesmo texto normalizado da chave.
+                argumentos.arguments[chave] = _normalizar(valor)
+        parametros = tuple((chave, _normalizar(valor))
+                           for chave, valor in argumentos.arguments.items()
+                           if chave != 'db_engine')
+        chave = (nome, str(db_engine.url), parametros,
+                 versao_tabelas(db_engine, *tabelas), date.today())
+        return chave, argumentos
+
+    @wraps(func)
+    def wrapper(db_engine, *args, **kwargs):
+        chave, argumentos = chave_e_argumentos(db_engine, *args, **kwargs)
+        return cache_consultas.obter(
+            chave, lambda: func(*argumentos.args, **argumentos.kwargs))
+
+    wrapper.chave = lambda *args, **kwargs: chave_e_argumentos(
+        *args, **kwargs)[0]
+    wrapper.sem_cache = func
+    return wrapper
+
+
+class Precarregador:
+    """
+    Executa consultas `em_cache` em segundo plano para aquecer o cache.
+    Limitado a `max_threads` consultas simultâneas e `max_pendentes` na fila.
+    """
+
+    def __init__(self, cache: CacheConsultas,
+                 max_threads: int = THREADS_PRECARGA,
+                 max_pendentes: int = MAX_PRECARGAS_PENDENTES):
+        self.cache = cache
+        self.max_pendentes = max_pendentes
+        self._executor = ThreadPoolExecutor(max_workers=max_threads,
+                                            thread_name_prefix='precarga')
+        self._por_grupo: Dict[Hashable, List[Future]] = {}
+        self._pendentes = 0
+        self._lock = threading.Lock()
+        self.agendadas = 0
+        self.descartadas = 0
+        self.canceladas = 0
+
+    def agendar(self, grupo: Hashable,
+                chamadas: Iterable[Tuple[Callable, tuple]]) -> int:
+        """
+        Cancela os pedidos ainda não iniciados do `grupo` (ex.: a sessão) e
+        agenda `consulta(*args)` para cada chamada que ainda não está no
+        cache. Retorna quantas foram agendadas.
+        """
+        self.cancelar(grupo)
+        futuros = []
+        for consulta, args in chamadas:
+            if self.cache.contem(consulta.chave(*args)):
+                continue
+            with self._lock:
+                if self._pendentes >= self.max_pendentes:
+                    self.descartadas += 1
+                    continue
+                self._pendentes += 1
+                self.agendadas += 1
+            futuro = self._executor.submit(consulta, *args)
+            futuro.add_done_callback(self._concluida)
+            futuros.append(futuro)
+        with self._lock:
+            self._por_grupo[grupo] = futuros
+        return len(futuros)
+
+    def cancelar(self, grupo: Hashable):
+        with self._lock:
+            futuros = self._por_grupo.pop(grupo, [])
+        for futuro in futuros:
+            if futuro.cancel():
+                with self._lock:
+                    self.canceladas += 1
+
+    def _concluida(self, futuro: Future):
+        # Também chamada para futuros cancelados.
+        with self._lock:
+            self._pendentes -= 1
+
+
+precarregador = Precarregador(cache_consultas)
+
+
+def precarregar(grupo: Hashable,
+                chamadas: Iterable[Tuple[Callable, tuple]]) -> int:
+    return precarregador.agendar(grupo, chamadas)
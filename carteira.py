@@ -0,0 +1,103 @@
+"""
+Carteira de devedores compartilhada entre as sessões do Streamlit.
+
+Existe uma única cópia da carteira por versão da tabela de devedores no banco
+(`versao_tabelas`), já ordenada pela ordem padrão da lista. Commits de outros
+processos aparecem em até `VALIDADE_VERSOES` segundos. Ela nunca é alterada: cada sessão guarda
+só o filtro, a chave de ordenação e um array de posições (int32) nessa cópia,
+e a paginação materializa apenas as linhas da página.
+"""
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from telefones import normalizar_telefone
+
+ORDEM_PADRAO = 'atraso'
+
+# chave -> (colunas, ascendente) para sort_values
+ORDENACOES: Dict[str, Tuple[list, list]] = {
+    'atraso': (['atraso', 'valortotal'], [False, False]),
+    'valortotal': (['valortotal', 'atraso'], [False, False]),
+    'nome': (['nome'], [True]),
+}
+
+
+@dataclass(frozen=True)
+class FiltroCarteira:
+    """Filtro da lista de devedores; faixas None não filtram."""
+    termo: str = ''
+    valor: Optional[Tuple[float, float]] = None
+    atraso: Optional[Tuple[int, int]] = None
+
+
+class CarteiraCompartilhada:
+    """
+    DataFrame somente leitura de uma versão dos dados. Os métodos devolvem
+    arrays de posições ou cópias de fatias; `df` não deve ser alterado.
+    """
+
+    def __init__(self, df: pd.DataFrame, versao: int):
+        colunas, ascendente = ORDENACOES[ORDEM_PADRAO]
+        if not df.empty:
+            df = df.sort_values(colunas, ascending=ascendente, kind='stable')
+        self.df = df.reset_index(drop=True)
+        self.versao = versao
+        self._postos: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.df)
+
+    def filtrar(self, filtro: FiltroCarteira) -> np.ndarray:
+        """Posições (na ordem padrão) das linhas que atendem ao filtro."""
+        df = self.df
+        mascara = np.ones(len(df), dtype=bool)
+        if filtro.termo:
+            termo = filtro.termo.strip()
+            encontrados = (
+                df['nome'].str.contains(termo, case=False, na=False,
+                                        regex=False)
+                | df['pessoa'].str.contains(termo, case=False, na=False,
+                                            regex=False))
+            telefone = normalizar_telefone(termo)
+            if telefone and 'telefone_normalizado' in df.columns:
+                encontrados |= (df['telefone_normalizado'] == telefone).fillna(
+                    False)
+            mascara &= encontrados.to_numpy(dtype=bool)
+        if filtro.valor is not None:
+            valores = df['valortotal'].to_numpy()
+            mascara &= (valores >= filtro.valor[0]) & (valores
+                                                       <= filtro.valor[1])
+        if filtro.atraso is not None:
+            atrasos = df['atraso'].to_numpy()
+            mascara &= (atrasos >= filtro.atraso[0]) & (atrasos
+                                                        <= filtro.atraso[1])
+        return np.flatnonzero(mascara).astype(np.int32)
+
+    def ordenar(self, posicoes: np.ndarray, chave: str) -> np.ndarray:
+        """Reordena as posições pela chave, usando um posto global por chave."""
+        if chave == ORDEM_PADRAO or len(posicoes) == 0:
+            return posicoes
+        return posicoes[np.argsort(self._posto(chave)[posicoes],
+                                   kind='stable')]
+
+    def _posto(self, chave: str) -> np.ndarray:
+        with self._lock:
+            posto = self._postos.get(chave)
+            if posto is None:
+                colunas, ascendente = ORDENACOES[chave]
+                ordem = self.df.sort_values(colunas,
+                                            ascending=ascendente,
+                                            kind='stable').index.to_numpy()
+                posto = np.empty(len(ordem), dtype=np.int32)
+                posto[ordem] = np.arange(len(ordem), dtype=np.int32)
+                self._postos[chave] = posto
+            return posto
+
+    def linhas(self, posicoes: np.ndarray) -> pd.DataFrame:
+        """Cópia das linhas nas posições informadas."""
+        return self.df.iloc[posicoes].copy()
@@ -0,0 +1,130 @@
+"""
+Representação compacta de DataFrames em memória.
+
+Inteiros são rebaixados para o menor tipo que comporta os valores, texto com
+poucos valores distintos vira `category` e o restante usa strings do pyarrow
+(quando instalado) em vez de objetos Python. Floats ficam em float64: valores
+monetários em float32 perdem centavos (1234.57 vira 1234.5699...).
+
+Relatório de memória por coluna, antes e depois da compactação:
+    python compactacao.py [planilha.xlsx]
+Sem planilha, compara a carteira do banco lida nos dois modos.
+"""
+import sys
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    TIPO_STRING = 'string[pyarrow]'
+except ImportError:
+    TIPO_STRING = 'string'
+
+# Texto vira categoria quando os valores distintos são até esta fração do total.
+LIMITE_CARDINALIDADE = 0.5
+
+
+def compactar_tipos(df: pd.DataFrame) -> pd.DataFrame:
+    """Cópia de `df` com tipos compactos; os valores não mudam."""
+    compacto = df.copy()
+    for coluna in compacto.columns:
+        serie = compacto[coluna]
+        if pd.api.types.is_bool_dtype(serie):
+            continue
+        if pd.api.types.is_integer_dtype(serie):
+            compacto[coluna] = compactar_inteiro(serie)
+        elif pd.api.types.is_float_dtype(serie):
+            compacto[coluna] = _compactar_float_generico(serie)
+        elif serie.dtype == object and len(serie) > 0:
+            distintos = serie.nunique(dropna=True)
+            if distintos <= LIMITE_CARDINALIDADE * len(serie):
+                compacto[coluna] = serie.astype('category')
+            elif pd.api.types.infer_dtype(serie, skipna=True) == 'string':
+                compacto[coluna] = serie.astype(TIPO_STRING)
+    return compacto
+
+
+def _compactar_float_generico(serie: pd.Series) -> pd.Series:
+    # Floats inteiros (ex.: inteiros com NaN vindos do Excel) viram Int nulável;
+    # os demais ficam em float64 para não perder centavos.
+    valores = serie.dropna()
+    if len(valores) and (valores % 1 == 0).all():
+        return compactar_inteiro(serie)
+    return serie
+
+
+def compactar_inteiro(serie: pd.Series) -> pd.Series:
+    """Menor inteiro que comporta a série; com nulos, o Int nulável equivalente."""
+    valores = serie.dropna()
+    if len(valores) == 0:
+        return serie
+    tipo = pd.to_numeric(valores.astype(np.int64), downcast='integer').dtype
+    if serie.isna().any():
+        return serie.astype(tipo.name.capitalize())
+    return serie.astype(tipo)
+
+
+def compactar_texto(serie: pd.Series) -> pd.Series:
+    return serie.astype(TIPO_STRING)
+
+
+def bytes_em_memoria(df: pd.DataFrame) -> int:
+    """Memória ocupada pelo DataFrame, incluindo o conteúdo das strings."""
+    return int(df.memory_usage(deep=True).sum())
+
+
+def relatorio_memoria(antes: pd.DataFrame,
+                      depois: pd.DataFrame) -> pd.DataFrame:
+    """
+    Tipo e memória de cada coluna antes e depois da compactação, maiores
+    (antes) primeiro, e quantas vezes a coluna encolheu.
+    """
+    uso_antes = antes.memory_usage(deep=True, index=False)
+    uso_depois = depois.memory_usage(deep=True, index=False)
+    relatorio = pd.DataFrame({
+        'coluna': uso_antes.index,
+        'tipo_antes': [str(antes[c].dtype) for c in uso_antes.index],
+        'bytes_antes': uso_antes.to_numpy(dtype=np.int64),
+        'tipo_depois': [str(depois[c].dtype) for c in uso_antes.index],
+        'bytes_depois': uso_depois.reindex(uso_antes.index).to_numpy(
+            dtype=np.int64),
+    })
+    relatorio['reducao'] = (relatorio['bytes_antes'] /
+                            relatorio['bytes_depois'].clip(lower=1)).round(1)
+    return relatorio.sort_values('bytes_antes',
+                                 ascending=False,
+                                 ignore_index=True)
+
+
+def formatar_bytes(total: float) -> str:
+    for unidade in ('B', 'KB', 'MB'):
+        if total < 1024:
+            return f"{total:.1f} {unidade}"
+        total /= 1024
+    return f"{total:.1f} GB"
+
+
+def _imprimir_relatorio(antes: pd.DataFrame, depois: pd.DataFrame) -> None:
+    relatorio = relatorio_memoria(antes, depois)
+    for coluna in ('bytes_antes', 'bytes_depois'):
+        relatorio[coluna] = relatorio[coluna].map(formatar_bytes)
+    print(relatorio.to_string(index=False))
+    total_antes, total_depois = bytes_em_memoria(antes), bytes_em_memoria(
+        depois)
+    print(f"\nTotal: {formatar_bytes(total_antes)} -> "
+          f"{formatar_bytes(total_depois)} "
+          f"({total_antes / max(total_depois, 1):.1f}x menor), "
+          f"{len(antes)} linha(s).")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        original = pd.read_excel(sys.argv[1])
+        _imprimir_relatorio(original, compactar_tipos(original))
+    else:
+        from database import init_db
+        from devedores_service import load_devedores_from_db
+        engine = init_db()
+        _imprimir_relatorio(load_devedores_from_db(engine),
+                            load_devedores_from_db(engine, compacto=True))
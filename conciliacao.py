@@ -0,0 +1,306 @@
+"""
+Conciliação em massa de pagamentos recebidos em arquivos do banco/ERP.
+
+O arquivo (pessoa, valor, data_pagamento) é validado de uma vez
+(`validar_pagamentos`) e gravado em lotes de pessoas, cada lote uma operação
+da fila de escrita. O lote é carregado numa tabela temporária; o casamento
+com a carteira é um único INSERT ... SELECT com JOIN pelo índice de
+`pessoa_normalizada`, que soma os pagamentos de cada devedor em aberto. A
+baixa são dois UPDATEs em conjunto, na mesma transação do lote:
+
+- pagamentos que cobrem `valortotal` quitam: status PAGO e `data_pagamento`
+  com a data real do pagamento (a mais recente do arquivo);
+- pagamentos parciais abatem o valor pago de `valortotal`.
+
+Cada pagamento aplicado fica registrado em `pagamentos_conciliados` (com o
+hash do arquivo). Pagamentos já registrados são descartados antes das baixas,
+então reenviar um arquivo, ou outro arquivo com os mesmos pagamentos, não
+abate nada duas vezes.
+
+Linhas inválidas, já conciliadas, sem devedor na carteira ou de devedores já
+pagos voltam no relatório de não conciliados, com o motivo.
+
+Uso headless: python conciliacao.py arquivo.csv|arquivo.xlsx
+"""
+import hashlib
+import io
+import os
+import sys
+from datetime import date, datetime
+from typing import Union
+
+import pandas as pd
+from sqlalchemy import (Boolean, Column, DateTime, Float, Integer, String,
+                        delete, exists, func, insert, literal, select, update)
+from sqlalchemy.orm import Session
+
+from database import (Devedor, PagamentoConciliado, StatusDevedor, init_db,
+                       pessoa_normalizada)
+from dialeto import inserir_em_massa, tabela_temporaria
+from estatisticas import invalidar_estatisticas
+from fila_escrita import LINHAS_POR_OPERACAO, EscritaIncerta, escrever
+from fila_trabalho import atualizar_fila
+from priorizacao import atualizar_scores
+from validacao import PRIMEIRA_LINHA_DADOS, validar_pagamentos
+
+COLUNAS_PAGAMENTO = ['pessoa', 'valor', 'data_pagamento']
+# Diferença de arredondamento aceita para considerar a dívida quitada.
+TOLERANCIA_QUITACAO = 0.005
+
+
+class ResultadoConciliacao(tuple):
+    """
+    Resultado (sucesso, mensagem) da conciliação, com as linhas do arquivo
+    que não deram baixa e o motivo de cada uma em `nao_conciliados`.
+    `sucesso` é None quando a conciliação foi interrompida depois de dar
+    baixa em parte dos lotes.
+    """
+
+    def __new__(cls, sucesso: bool, mensagem: str,
+                nao_conciliados: pd.DataFrame = None,
+                quitados: int = 0, parciais: int = 0):
+        resultado = super().__new__(cls, (sucesso, mensagem))
+        resultado.nao_conciliados = (nao_conciliados
+                                     if nao_conciliados is not None else
+                                     pd.DataFrame())
+        resultado.quitados = quitados
+        resultado.parciais = parciais
+        return resultado
+
+
+def ler_arquivo_pagamentos(conteudo: bytes, nome: str) -> pd.DataFrame:
+    """CSV (separador detectado) ou Excel, pelo nome do arquivo."""
+    if nome.lower().endswith('.csv'):
+        # Tudo como texto: valores no formato brasileiro são tratados na
+        # validação.
+        return pd.read_csv(io.BytesIO(conteudo), sep=None, engine='python',
+                           dtype=str)
+    return pd.read_excel(io.BytesIO(conteudo), engine='openpyxl')
+
+
+def conciliar_arquivo_pagamentos(
+        db_engine, arquivo: Union[str, io.BytesIO]) -> ResultadoConciliacao:
+    try:
+        if isinstance(arquivo, (str, os.PathLike)):
+            with open(arquivo, 'rb') as entrada:
+                conteudo = entrada.read()
+        else:
+            conteudo = arquivo.getvalue()
+        df = ler_arquivo_pagamentos(
+            conteudo, getattr(arquivo, 'name', str(arquivo)))
+    except Exception as e:
+        return ResultadoConciliacao(False,
+                                    f"Erro ao ler o arquivo de pagamentos: {e}")
+    return conciliar_pagamentos(db_engine, df,
+                                hashlib.sha256(conteudo).hexdigest())
+
+
+def conciliar_pagamentos(db_engine,
+                         df: pd.DataFrame,
+                         arquivo_hash: str = None) -> ResultadoConciliacao:
+    """
+    Dá baixa nos pagamentos de `df` em lotes (`_lotes_por_pessoa`), cada um
+    em sua transação. `arquivo_hash` identifica o arquivo de origem no
+    registro de pagamentos conciliados.
+    """
+    if not all(col in df.columns for col in COLUNAS_PAGAMENTO):
+        return ResultadoConciliacao(
+            False,
+            f"O arquivo de pagamentos deve conter as colunas: {', '.join(COLUNAS_PAGAMENTO)}."
+        )
+
+    df = df.reset_index(drop=True)
+    validos, rejeitadas = validar_pagamentos(df)
+    if validos.empty:
+        return ResultadoConciliacao(
+            False, "Nenhum pagamento válido encontrado no arquivo.",
+            rejeitadas)
+
+    pagamentos = pd.DataFrame({
+        'linha': validos.index + PRIMEIRA_LINHA_DADOS,
+        'pessoa': validos['pessoa'],
+        'chave': validos['pessoa'].str.upper(),
+        'valor': validos['valor'].round(2),
+        'data_pagamento': validos['data_pagamento'],
+    })
+    # Pagamentos idênticos no mesmo arquivo são pagamentos distintos.
+    pagamentos['ocorrencia'] = pagamentos.groupby(
+        ['chave', 'valor', 'data_pagamento']).cumcount() + 1
+    quitados, parciais, sem_baixa = 0, 0, {}
+    for lote in _lotes_por_pessoa(pagamentos):
+        try:
+            quitados_lote, parciais_lote, sem_baixa_lote = escrever(
+                db_engine, _conciliar_via_staging,
+                lote.astype(object).to_dict('records'), arquivo_hash)
+        except Exception as e:
+            # Lotes anteriores já deram baixa; reenviar o arquivo completa a
+            # conciliação sem repeti-los (pagamentos já conciliados).
+            mensagem = f"Erro durante a conciliação no banco de dados: {e}"
+            parcial = bool(quitados or parciais) or isinstance(
+                e, EscritaIncerta)
+            if parcial:
+                mensagem += (
+                    f" Baixas antes da interrupção: {quitados} quitado(s), "
+                    f"{parciais} parcial(is). Reenvie o arquivo para "
+                    "completar; os pagamentos já conciliados são ignorados.")
+            return ResultadoConciliacao(None if parcial else False, mensagem,
+                                        rejeitadas, quitados, parciais)
+        quitados += quitados_lote
+        parciais += parciais_lote
+        sem_baixa.update(sem_baixa_lote)
+
+    nao_conciliados = df.loc[[linha - PRIMEIRA_LINHA_DADOS
+                              for linha in sem_baixa]].copy()
+    nao_conciliados.insert(0, 'linha', list(sem_baixa))
+    nao_conciliados['motivo'] = list(sem_baixa.values())
+    nao_conciliados = pd.concat([rejeitadas, nao_conciliados]).astype({
+        'linha': int
+    }).sort_values('linha', kind='stable').reset_index(drop=True)
+
+    mensagem = f"Conciliação concluída! Quitados: {quitados}. Pagamentos parciais: {parciais}."
+    if len(nao_conciliados):
+        mensagem += f" Não conciliados: {len(nao_conciliados)} (veja o relatório)."
+    return ResultadoConciliacao(True, mensagem, nao_conciliados, quitados,
+                                parciais)
+
+
+def _lotes_por_pessoa(pagamentos: pd.DataFrame,
+                      tamanho: int = LINHAS_POR_OPERACAO):
+    """
+    Lotes de cerca de `tamanho` pagamentos, um por operação da fila de
+    escrita. Os pagamentos de uma pessoa ficam no mesmo lote, para que sejam
+    somados juntos contra o `valortotal` do devedor.
+    """
+    pagamentos = pagamentos.sort_values('chave', kind='stable')
+    chaves = pagamentos['chave'].to_numpy()
+    inicio = 0
+    while inicio < len(pagamentos):
+        fim = min(inicio + tamanho, len(pagamentos))
+        while fim < len(pagamentos) and chaves[fim] == chaves[fim - 1]:
+            fim += 1
+        yield pagamentos.iloc[inicio:fim]
+        inicio = fim
+
+
+def _conciliar_via_staging(session: Session, registros: list,
+                           arquivo_hash: str = None):
+    """
+    Carrega os pagamentos numa tabela temporária, descarta os já
+    conciliados, casa com os devedores em aberto, registra e aplica as
+    baixas. Não faz commit.
+    Retorna (quitados, parciais, {linha: motivo} das linhas sem baixa).
+    """
+    devedores = Devedor.__table__
+    conciliados = PagamentoConciliado.__table__
+    hoje = date.today()
+    with tabela_temporaria(session, 'conciliacao_pagamentos', [
+            Column('linha', Integer, primary_key=True),
+            Column('pessoa', String),
+            Column('chave', String),
+            Column('valor', Float),
+            Column('data_pagamento', DateTime),
+            Column('ocorrencia', Integer),
+            Column('devedor_id', Integer),
+    ]) as pagamentos, tabela_temporaria(session, 'conciliacao_baixas', [
+            Column('devedor_id', Integer, primary_key=True),
+            Column('valor', Float),
+            Column('data_pagamento', DateTime),
+            Column('quitado', Boolean),
+    ]) as baixas:
+        inserir_em_massa(session, pagamentos, registros)
+
+        ja_conciliado = exists().where(
+            conciliados.c.pessoa == pagamentos.c.chave,
+            conciliados.c.valor == pagamentos.c.valor,
+            conciliados.c.data_pagamento == pagamentos.c.data_pagamento,
+            conciliados.c.ocorrencia == pagamentos.c.ocorrencia)
+        sem_baixa = {
+            linha: "já conciliado"
+            for linha in session.execute(
+                select(pagamentos.c.linha).where(ja_conciliado)).scalars()
+        }
+        if sem_baixa:
+            session.execute(delete(pagamentos).where(ja_conciliado))
+
+        # Cada pagamento guarda o devedor em aberto da sua pessoa: uma busca
+        # pelo índice de `pessoa_normalizada` por linha do arquivo.
+        casa_pessoa = pessoa_normalizada(
+            devedores.c.pessoa) == pessoa_normalizada(pagamentos.c.pessoa)
+        session.execute(
+            update(pagamentos).values(devedor_id=select(devedores.c.id).where(
+                casa_pessoa, devedores.c.status != StatusDevedor.PAGO).limit(
+                    1).scalar_subquery()))
+        casados = pagamentos.c.devedor_id.isnot(None)
+
+        valor_pago = func.sum(pagamentos.c.valor)
+        session.execute(
+            insert(baixas).from_select(
+                ['devedor_id', 'valor', 'data_pagamento', 'quitado'],
+                select(devedores.c.id, valor_pago,
+                       func.max(pagamentos.c.data_pagamento),
+                       valor_pago >= devedores.c.valortotal -
+                       TOLERANCIA_QUITACAO).select_from(pagamentos).join(
+                           devedores,
+                           devedores.c.id == pagamentos.c.devedor_id).group_by(
+                               devedores.c.id, devedores.c.valortotal)))
+
+        sem_baixa.update({
+            linha: ("pessoa não encontrada na carteira"
+                    if status is None else "devedor já pago")
+            for linha, status in session.execute(
+                select(pagamentos.c.linha, devedores.c.status).select_from(
+                    pagamentos).outerjoin(devedores, casa_pessoa).where(
+                        ~casados))
+        })
+
+        session.execute(
+            insert(conciliados).from_select(
+                ['pessoa', 'valor', 'data_pagamento', 'ocorrencia',
+                 'devedor_id', 'arquivo_hash', 'conciliado_em'],
+                select(pagamentos.c.chave, pagamentos.c.valor,
+                       pagamentos.c.data_pagamento, pagamentos.c.ocorrencia,
+                       pagamentos.c.devedor_id,
+                       literal(arquivo_hash, conciliados.c.arquivo_hash.type),
+                       literal(datetime.now(),
+                               conciliados.c.conciliado_em.type)).where(
+                                   casados)))
+
+        def da_baixa(coluna):
+            return select(coluna).where(
+                baixas.c.devedor_id == devedores.c.id).scalar_subquery()
+
+        quitados = session.execute(
+            update(devedores).where(
+                devedores.c.id.in_(
+                    select(baixas.c.devedor_id).where(baixas.c.quitado))).
+            values(status=StatusDevedor.PAGO,
+                   data_pagamento=da_baixa(baixas.c.data_pagamento),
+                   atraso_referencia=hoje,
+                   versao=devedores.c.versao + 1)).rowcount
+        parciais = session.execute(
+            update(devedores).where(
+                devedores.c.id.in_(
+                    select(baixas.c.devedor_id).where(~baixas.c.quitado))).
+            values(valortotal=devedores.c.valortotal -
+                   da_baixa(baixas.c.valor),
+                   versao=devedores.c.versao + 1)).rowcount
+
+        devedor_ids = session.execute(select(
+            baixas.c.devedor_id)).scalars().all()
+
+    if devedor_ids:
+        atualizar_scores(session, devedor_ids)
+        atualizar_fila(session, devedor_ids)
+        invalidar_estatisticas(session)
+    return quitados, parciais, sem_baixa
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("Uso: python conciliacao.py arquivo.csv|arquivo.xlsx")
+    resultado = conciliar_arquivo_pagamentos(init_db(), sys.argv[1])
+    print(resultado[1])
+    for linha in resultado.nao_conciliados.itertuples(index=False):
+        print(f"  linha {linha.linha}: {linha.motivo}")
+    if not resultado[0]:
+        sys.exit(1)
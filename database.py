@@ -1,7 +1,16 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Enum
-from sqlalchemy.orm import declarative_base, sessionmaker
-from datetime import datetime
+from sqlalchemy import create_engine, event, inspect, Column, Integer, String, Float, DateTime, Date, Enum, Boolean, ForeignKey, Index, MetaData, Table, UniqueConstraint, func, literal, select, union_all
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy.schema import CreateIndex, CreateTable
+from contextlib import contextmanager
 import enum
+import os
+import threading
+import time
+
+from inicializacao import medir
+
+DATABASE_URL_PADRAO = 'sqlite:///cobrancas.db'
+TAMANHO_POOL_LEITURA = 10
 
 class StatusDevedor(enum.Enum):
     PENDENTE = "PENDENTE"  
@@ -11,6 +20,12 @@ class StatusDevedor(enum.Enum):
 
 Base = declarative_base()
 
+
+def pessoa_normalizada(coluna):
+    """ID pessoa sem espaços nas pontas e em maiúsculas, como é comparado."""
+    return func.upper(func.trim(coluna))
+
+
 class Devedor(Base):
     __tablename__ = 'devedores'
 
@@ -19,21 +34,545 @@ class Devedor(Base):
     nome = Column(String, nullable=False)
     valortotal = Column(Float, nullable=False)
     atraso = Column(Integer, nullable=False)
+    atraso_referencia = Column(Date, nullable=True)
     telefone = Column(String, nullable=True)
+    telefone_normalizado = Column(String, nullable=True, index=True)
+    telefone_valido = Column(Boolean, nullable=True)
     data_cobranca = Column(DateTime, nullable=True)
     ultima_cobranca = Column(DateTime, nullable=True)
     status = Column(Enum(StatusDevedor), default=StatusDevedor.PENDENTE, nullable=False)
     data_pagamento = Column(DateTime, nullable=True)
     fase_cobranca = Column(Integer, default=1, nullable=False)
+    score_prioridade = Column(Float, nullable=True)
+    # Versão da linha: cada UPDATE do ORM vira
+    # "UPDATE ... WHERE id = ? AND versao = ?" e incrementa a versão.
+    versao = Column(Integer, nullable=False, default=1, server_default='1')
+
+    __mapper_args__ = {'version_id_col': versao}
+    # Índice de expressão usado pelo anti-join da importação.
+    # Índice parcial na ordem do ranking por score (só devedores em aberto têm
+    # score), percorrido pela consulta paginada por score.
+    # AUTOINCREMENT: no SQLite, sem ele o id de um devedor arquivado (removido
+    # daqui) seria reutilizado e colidiria em `devedores_arquivados`.
+    __table_args__ = (Index('ix_devedores_pessoa_normalizada',
+                            pessoa_normalizada(pessoa)),
+                      Index('ix_devedores_score_prioridade_id',
+                            score_prioridade.desc(),
+                            id,
+                            sqlite_where=score_prioridade.isnot(None),
+                            postgresql_where=score_prioridade.isnot(None)), {
+                                'sqlite_autoincrement': True
+                            })
 
     def __repr__(self):
         return f"<Devedor(id={self.id}, pessoa='{self.pessoa}', nome='{self.nome}', valortotal={self.valortotal})>"
 
-def init_db():
-    engine = create_engine('sqlite:///cobrancas.db')
-    Base.metadata.create_all(engine)
-    return engine
+
+class DevedorArquivado(Base):
+    """
+    Devedores pagos há mais tempo, movidos de `devedores` pelo arquivamento
+    (arquivamento.py). Mesmas colunas e mesmos IDs; `pessoa` não é única
+    porque a pessoa pode voltar à carteira com uma dívida nova.
+    """
+    __tablename__ = 'devedores_arquivados'
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    pessoa = Column(String, nullable=True, index=True)
+    nome = Column(String, nullable=False)
+    valortotal = Column(Float, nullable=False)
+    atraso = Column(Integer, nullable=False)
+    atraso_referencia = Column(Date, nullable=True)
+    telefone = Column(String, nullable=True)
+    telefone_normalizado = Column(String, nullable=True)
+    telefone_valido = Column(Boolean, nullable=True)
+    data_cobranca = Column(DateTime, nullable=True)
+    ultima_cobranca = Column(DateTime, nullable=True)
+    status = Column(Enum(StatusDevedor), nullable=False)
+    data_pagamento = Column(DateTime, nullable=True, index=True)
+    fase_cobranca = Column(Integer, nullable=False)
+    score_prioridade = Column(Float, nullable=True)
+    versao = Column(Integer, nullable=False, server_default='1')
+    arquivado_em = Column(DateTime, nullable=False)
+
+
+COLUNAS_DEVEDOR = [c.name for c in Devedor.__table__.columns]
+
+# Visão `devedores_historico`: carteira ativa + arquivados, para relatórios.
+# `status` é lido como texto para não depender do tipo ENUM de cada banco.
+devedores_historico = Table(
+    'devedores_historico', MetaData(), *[
+        Column(c.name, String if c.name == 'status' else c.type)
+        for c in Devedor.__table__.columns
+    ], Column('arquivado', Integer))
+
+
+def _select_historico():
+    ativos = Devedor.__table__.c
+    arquivados = DevedorArquivado.__table__.c
+    return union_all(
+        select(*[ativos[c] for c in COLUNAS_DEVEDOR],
+               literal(0).label('arquivado')),
+        select(*[arquivados[c] for c in COLUNAS_DEVEDOR],
+               literal(1).label('arquivado')))
+
+
+def _criar_visao_historico(engine):
+    # Recriada a cada processo, para acompanhar colunas novas de `devedores`.
+    corpo = _select_historico().compile(
+        dialect=engine.dialect, compile_kwargs={'literal_binds': True})
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f'DROP VIEW IF EXISTS {devedores_historico.name}')
+        conn.exec_driver_sql(
+            f'CREATE VIEW {devedores_historico.name} AS {corpo}')
+
+
+class PagamentoConciliado(Base):
+    """
+    Pagamentos já aplicados pela conciliação (conciliacao.py). Um pagamento
+    é (pessoa normalizada, valor, data, ocorrência): a ocorrência numera
+    pagamentos idênticos do mesmo arquivo. Reaplicar um arquivo, ou outro
+    arquivo com os mesmos pagamentos, não baixa nada duas vezes.
+    """
+    __tablename__ = 'pagamentos_conciliados'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    pessoa = Column(String, nullable=False)
+    valor = Column(Float, nullable=False)
+    data_pagamento = Column(DateTime, nullable=False)
+    ocorrencia = Column(Integer, nullable=False)
+    # Sem chave estrangeira: o devedor pode ser arquivado depois.
+    devedor_id = Column(Integer, nullable=False, index=True)
+    arquivo_hash = Column(String(64), nullable=True, index=True)
+    conciliado_em = Column(DateTime, nullable=False)
+
+    __table_args__ = (UniqueConstraint('pessoa', 'valor', 'data_pagamento',
+                                       'ocorrencia',
+                                       name='uq_pagamentos_conciliados'), )
+
+
+class ItemFilaTrabalho(Base):
+    """Devedores que exigem ação no dia, materializados com as chaves de ordenação."""
+    __tablename__ = 'fila_trabalho'
+
+    devedor_id = Column(Integer,
+                        ForeignKey('devedores.id', ondelete='CASCADE'),
+                        primary_key=True)
+    data_referencia = Column(Date, nullable=False)
+    prioridade = Column(Integer, nullable=False, index=True)
+    pessoa = Column(String, nullable=True)
+    nome = Column(String, nullable=False, index=True)
+    valortotal = Column(Float, nullable=False, index=True)
+    atraso = Column(Integer, nullable=False, index=True)
+    telefone = Column(String, nullable=True)
+    data_cobranca = Column(DateTime, nullable=True, index=True)
+    ultima_cobranca = Column(DateTime, nullable=True)
+    status = Column(String, nullable=False)
+    data_pagamento = Column(DateTime, nullable=True)
+    fase_cobranca = Column(Integer, nullable=False, index=True)
+    score_prioridade = Column(Float, nullable=True)
+    versao = Column(Integer, nullable=False, server_default='1')
+
+
+class VersaoTabela(Base):
+    """
+    Versão dos dados de cada tabela, incrementada logo depois de cada commit
+    que a altera (`versao_tabelas`). Visível a todos os processos que usam o
+    banco.
+    """
+    __tablename__ = 'versoes_tabelas'
+
+    tabela = Column(String, primary_key=True)
+    versao = Column(Integer, nullable=False, server_default='0')
+
+
+class ExecucaoFilaTrabalho(Base):
+    """Registro de cada materialização diária da fila de trabalho."""
+    __tablename__ = 'fila_trabalho_execucoes'
+
+    data_referencia = Column(Date, primary_key=True)
+    gerada_em = Column(DateTime, nullable=False)
+    total = Column(Integer, nullable=False)
+
+
+# Índices criados por versões anteriores que nenhuma consulta usa mais; só
+# custavam escrita. O ranking por score usa `ix_devedores_score_prioridade_id`
+# e a fila do dia, `fila_trabalho.prioridade`.
+INDICES_REMOVIDOS = [
+    'ix_devedores_score_prioridade', 'ix_fila_trabalho_score_prioridade'
+]
+
+
+def _migrar_schema(engine):
+    """
+    Adiciona colunas e índices novos em tabelas criadas por versões anteriores
+    e remove os de INDICES_REMOVIDOS. `create_all` só cria tabelas
+    inexistentes, não altera as que já existem.
+    """
+    inspector = inspect(engine)
+    for tabela in Base.metadata.sorted_tables:
+        if not inspector.has_table(tabela.name):
+            continue
+        existentes = {c['name'] for c in inspector.get_columns(tabela.name)}
+        with engine.begin() as conn:
+            for coluna in tabela.columns:
+                if coluna.name in existentes:
+                    continue
+                tipo = coluna.type.compile(dialect=engine.dialect)
+                ddl = f'ALTER TABLE {tabela.name} ADD COLUMN {coluna.name} {tipo}'
+                if coluna.server_default is not None:
+                    ddl += f' DEFAULT {coluna.server_default.arg}'
+                conn.exec_driver_sql(ddl)
+        # IF NOT EXISTS em vez de checkfirst: a reflexão não enxerga índices
+        # de expressão (ex.: pessoa normalizada) e tentaria recriá-los.
+        with engine.begin() as conn:
+            for indice in tabela.indexes:
+                conn.execute(CreateIndex(indice, if_not_exists=True))
+    with engine.begin() as conn:
+        for nome in INDICES_REMOVIDOS:
+            conn.exec_driver_sql(f'DROP INDEX IF EXISTS {nome}')
+
+
+def _migrar_autoincremento(engine):
+    """
+    Recria `devedores` com AUTOINCREMENT em bancos SQLite criados antes dele
+    (o SQLite não altera a chave de uma tabela existente). A sequência parte
+    do maior id já usado, inclusive pelos arquivados. Devedores ativos cujo id
+    já foi reutilizado recebem um id novo (`_remapear_ids_reutilizados`).
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    tabela = Devedor.__table__
+    with engine.begin() as conn:
+        ddl = conn.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (tabela.name, )).scalar()
+        if ddl is None or 'AUTOINCREMENT' in ddl.upper():
+            return
+
+        nova = tabela.to_metadata(MetaData(), name=f'{tabela.name}_nova')
+        conn.execute(CreateTable(nova))
+        colunas = ', '.join(COLUNAS_DEVEDOR)
+        arquivados = DevedorArquivado.__tablename__
+        conn.exec_driver_sql(
+            f'INSERT INTO {nova.name} ({colunas}) SELECT {colunas} '
+            f'FROM {tabela.name} WHERE id NOT IN (SELECT id FROM {arquivados})')
+        maior_id = conn.exec_driver_sql(
+            f'SELECT max(coalesce((SELECT max(id) FROM {tabela.name}), 0), '
+            f'coalesce((SELECT max(id) FROM {arquivados}), 0))').scalar()
+        conn.exec_driver_sql('DELETE FROM sqlite_sequence WHERE name = ?',
+                             (nova.name, ))
+        conn.exec_driver_sql(
+            'INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)',
+            (nova.name, maior_id))
+        reutilizados = conn.exec_driver_sql(
+            f'SELECT id FROM {tabela.name} '
+            f'WHERE id IN (SELECT id FROM {arquivados}) ORDER BY id'
+        ).scalars().all()
+        if reutilizados:
+            _remapear_ids_reutilizados(conn, nova.name, [
+                (antigo, maior_id + n)
+                for n, antigo in enumerate(reutilizados, start=1)
+            ])
+
+        conn.exec_driver_sql(f'DROP VIEW IF EXISTS {devedores_historico.name}')
+        conn.exec_driver_sql(f'DROP TABLE {tabela.name}')
+        conn.exec_driver_sql(
+            f'ALTER TABLE {nova.name} RENAME TO {tabela.name}')
+        for indice in tabela.indexes:
+            conn.execute(CreateIndex(indice, if_not_exists=True))
+
+
+def _remapear_ids_reutilizados(conn, tabela_nova: str, mapa: list):
+    """
+    Grava em `tabela_nova` os devedores ativos que reutilizaram o id de um
+    arquivado, com os ids de `mapa` [(antigo, novo)], e leva as referências
+    junto na mesma transação: a fila de trabalho e os pagamentos conciliados
+    depois do arquivamento (os anteriores são do devedor arquivado). A fila
+    do dia é regerada, pois o id desempata a ordem de prioridade.
+    """
+    conciliados = PagamentoConciliado.__tablename__
+    fila = ItemFilaTrabalho.__tablename__
+    conn.exec_driver_sql('CREATE TEMP TABLE ids_reutilizados '
+                         '(antigo INTEGER PRIMARY KEY, novo INTEGER NOT NULL)')
+    conn.exec_driver_sql('INSERT INTO ids_reutilizados VALUES (?, ?)', mapa)
+    origem = ', '.join('m.novo' if c == 'id' else f'd.{c}'
+                       for c in COLUNAS_DEVEDOR)
+    conn.exec_driver_sql(
+        f'INSERT INTO {tabela_nova} ({", ".join(COLUNAS_DEVEDOR)}) '
+        f'SELECT {origem} FROM {Devedor.__tablename__} d '
+        f'JOIN ids_reutilizados m ON m.antigo = d.id')
+
+    def novo_id(tabela):
+        return ('(SELECT novo FROM ids_reutilizados '
+                f'WHERE antigo = {tabela}.devedor_id)')
+
+    reutilizado = 'devedor_id IN (SELECT antigo FROM ids_reutilizados)'
+    conn.exec_driver_sql(f'UPDATE {fila} SET devedor_id = {novo_id(fila)} '
+                         f'WHERE {reutilizado}')
+    conn.exec_driver_sql(
+        f'UPDATE {conciliados} SET devedor_id = {novo_id(conciliados)} '
+        f'WHERE {reutilizado} AND conciliado_em > (SELECT a.arquivado_em '
+        f'FROM {DevedorArquivado.__tablename__} a '
+        f'WHERE a.id = {conciliados}.devedor_id)')
+    conn.exec_driver_sql(f'DELETE FROM {ExecucaoFilaTrabalho.__tablename__}')
+    conn.exec_driver_sql('DROP TABLE ids_reutilizados')
+
+
+def _ativar_wal(dbapi_connection, connection_record):
+    # Em WAL, leitores não bloqueiam o escritor (e vice-versa).
+    dbapi_connection.execute('PRAGMA journal_mode=WAL')
+    # O pysqlite só abre a transação no primeiro DML e SAVEPOINTs emitidos
+    # antes disso não ficam aninhados. O BEGIN passa a ser emitido por
+    # `_iniciar_transacao` (receita da documentação do SQLAlchemy).
+    dbapi_connection.isolation_level = None
+
+
+def _iniciar_transacao(conn):
+    # Este engine é o de escrita (leituras usam `get_read_engine`). IMMEDIATE
+    # reserva o lock de escrita já no BEGIN, esperando o busy timeout se
+    # preciso; com um BEGIN adiado, a promoção de leitura para escrita no
+    # meio da transação falha na hora com SQLITE_BUSY quando outro escritor
+    # (importação, jobs headless, outro processo) está ativo.
+    conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+def get_database_url() -> str:
+    """URL do banco: variável COBRANCAS_DATABASE_URL ou o SQLite local."""
+    return os.environ.get('COBRANCAS_DATABASE_URL', DATABASE_URL_PADRAO)
+
+
+_engines = {}
+_lock_engines = threading.Lock()
+
+
+def init_db(database_url: str = None):
+    """
+    Engine do banco, um por URL e por processo. O esquema é criado/migrado
+    só na primeira chamada; as seguintes (cada sessão do Streamlit) apenas
+    devolvem o mesmo engine, com seu pool e sua fila de escrita.
+    """
+    database_url = database_url or get_database_url()
+    with _lock_engines:
+        engine = _engines.get(database_url)
+        if engine is None:
+            engine = create_engine(database_url)
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', _ativar_wal)
+                event.listen(engine, 'begin', _iniciar_transacao)
+            with medir('esquema do banco'):
+                Base.metadata.create_all(engine)
+                _migrar_schema(engine)
+                _migrar_autoincremento(engine)
+                _criar_visao_historico(engine)
+                _criar_versoes_tabelas(engine)
+            _engines[database_url] = engine
+        return engine
+
+
+_engines_leitura = {}
+_lock_engines_leitura = threading.Lock()
+
+
+def get_read_engine(engine):
+    """
+    Engine somente leitura (SQLite `mode=ro`) com pool próprio, usado pelas
+    consultas de dashboards e listas. Um por banco, compartilhado entre as
+    threads do Streamlit. Em outros bancos usa a réplica indicada em
+    COBRANCAS_DATABASE_URL_LEITURA, ou o próprio engine.
+    """
+    url = engine.url
+    if url.get_backend_name() != 'sqlite':
+        url_replica = os.environ.get('COBRANCAS_DATABASE_URL_LEITURA')
+        if not url_replica:
+            return engine
+        with _lock_engines_leitura:
+            if url_replica not in _engines_leitura:
+                _engines_leitura[url_replica] = create_engine(
+                    url_replica, pool_size=TAMANHO_POOL_LEITURA)
+            return _engines_leitura[url_replica]
+
+    if url.database in (None, '', ':memory:'):
+        return engine
+
+    with _lock_engines_leitura:
+        engine_leitura = _engines_leitura.get(url.database)
+        if engine_leitura is None:
+            caminho = os.path.abspath(url.database)
+            engine_leitura = create_engine(
+                f'sqlite:///file:{caminho}?mode=ro&uri=true',
+                pool_size=TAMANHO_POOL_LEITURA,
+                max_overflow=TAMANHO_POOL_LEITURA,
+                connect_args={'check_same_thread': False})
+            _engines_leitura[url.database] = engine_leitura
+        return engine_leitura
+
+# Tempo em que as versões lidas do banco valem sem nova leitura: o atraso
+# máximo para enxergar escritas de outros processos.
+VALIDADE_VERSOES = 1.0
+
+_versoes_lidas = {}
+_lock_versoes = threading.Lock()
+
+
+def _criar_versoes_tabelas(engine):
+    tabelas = VersaoTabela.__table__
+    with engine.begin() as conn:
+        existentes = set(conn.execute(select(tabelas.c.tabela)).scalars())
+        faltantes = [{
+            'tabela': nome,
+            'versao': 0
+        } for nome in Base.metadata.tables
+                     if nome not in existentes and nome != tabelas.name]
+        if faltantes:
+            conn.execute(tabelas.insert(), faltantes)
+
+
+def registrar_alteracao(session, tabela: str):
+    """
+    Marca `tabela` como alterada na transação de `session`; a versão dela é
+    incrementada logo depois do commit. As escritas pela sessão já são
+    registradas sozinhas; só escritas direto no cursor do driver precisam
+    chamar isto.
+    """
+    if tabela in Base.metadata.tables and tabela != VersaoTabela.__tablename__:
+        session.info.setdefault('tabelas_alteradas', set()).add(tabela)
+
+
+def versao_tabelas(engine, *tabelas: str) -> tuple:
+    """
+    Versões atuais das `tabelas` no banco, em ordem. Servem de chave para
+    caches de dados compartilhados entre sessões: mudam a cada commit que
+    altera a tabela, em qualquer processo. Commits deste processo aparecem
+    na hora; os de outros processos, em até VALIDADE_VERSOES segundos.
+    """
+    chave = str(engine.url)
+    with _lock_versoes:
+        lidas = _versoes_lidas.get(chave)
+        if lidas is None or time.monotonic() - lidas[0] > VALIDADE_VERSOES:
+            with get_read_engine(engine).connect() as conn:
+                versoes = dict(
+                    conn.execute(
+                        select(VersaoTabela.tabela, VersaoTabela.versao)).all())
+            if lidas is not None:
+                # Uma réplica atrasada não desfaz commits já vistos aqui.
+                for tabela, versao in lidas[1].items():
+                    versoes[tabela] = max(versao, versoes.get(tabela, 0))
+            lidas = _versoes_lidas[chave] = (time.monotonic(), versoes)
+        return tuple(lidas[1].get(tabela, 0) for tabela in tabelas)
+
+
+@event.listens_for(Session, 'after_flush')
+def _registrar_objetos_alterados(session, flush_context):
+    for objeto in (*session.new, *session.dirty, *session.deleted):
+        tabela = getattr(objeto, '__tablename__', None)
+        if tabela:
+            registrar_alteracao(session, tabela)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _registrar_dml(estado):
+    if estado.is_insert or estado.is_update or estado.is_delete:
+        tabela = getattr(estado.statement, 'table', None)
+        if tabela is not None:
+            registrar_alteracao(estado.session, tabela.name)
+
+
+@event.listens_for(Session, 'before_commit')
+def _separar_tabelas_alteradas(session):
+    session.flush()
+    if session.in_nested_transaction():
+        # SAVEPOINT: as tabelas seguem para o commit da transação externa.
+        return
+    session.info['versoes_confirmadas'] = {}
+    session.info['tabelas_confirmadas'] = session.info.pop(
+        'tabelas_alteradas', set())
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _descartar_alteracoes(session, transacao_anterior):
+    if transacao_anterior.parent is None:
+        session.info.pop('tabelas_alteradas', None)
+        session.info.pop('tabelas_confirmadas', None)
+
+
+def _incrementar_versoes(engine, tabelas) -> dict:
+    """
+    Incrementa as versões das `tabelas` em uma transação própria e curta.
+    Retorna {tabela: versão nova}.
+    """
+    versoes = VersaoTabela.__table__
+    with engine.begin() as conn:
+        return dict(
+            conn.execute(
+                versoes.update().where(versoes.c.tabela.in_(sorted(tabelas))).
+                values(versao=versoes.c.versao + 1).returning(
+                    versoes.c.tabela, versoes.c.versao)).all())
+
+
+@event.listens_for(Session, 'after_commit')
+def _publicar_versoes(session):
+    # A versão é incrementada depois do commit, fora da transação que
+    # escreveu: dentro dela, a linha de cada tabela em `versoes_tabelas`
+    # ficaria travada até o commit e todos os escritores da tabela, de
+    # qualquer processo, se enfileirariam nela. Quem ler a versão antiga
+    # entre os dois commits só guarda dados novos sob a chave antiga, que a
+    # versão nova invalida. Roda antes do listener de `estatisticas`, que
+    # usa `versoes_confirmadas`.
+    if session.in_nested_transaction():
+        return
+    alteradas = session.info.pop('tabelas_confirmadas', None)
+    if not alteradas or session.bind is None:
+        return
+    engine = getattr(session.bind, 'engine', session.bind)
+    try:
+        confirmadas = _incrementar_versoes(engine, alteradas)
+    except Exception as e:
+        # Os dados já foram confirmados: não transforma o commit em erro.
+        # Os caches enxergam a escrita na próxima versão da tabela.
+        print(f"Erro ao incrementar a versão de {sorted(alteradas)}: {e}")
+        return
+    session.info['versoes_confirmadas'] = confirmadas
+    # Commits deste processo valem na hora, sem esperar a próxima leitura.
+    with _lock_versoes:
+        lidas = _versoes_lidas.get(str(engine.url))
+        if lidas is not None:
+            for tabela, versao in confirmadas.items():
+                lidas[1][tabela] = max(versao, lidas[1].get(tabela, 0))
+
 
 def get_session(engine):
     Session = sessionmaker(bind=engine)
     return Session()
+
+
+@contextmanager
+def unit_of_work(db_object, somente_leitura: bool = False):
+    """
+    Sessão única para uma operação (ou várias operações compostas).
+
+    - Recebendo um Engine, abre uma sessão, faz commit ao final (ou rollback
+      em caso de erro) e a fecha.
+    - Recebendo uma Session já aberta, apenas a reutiliza: quem abriu a
+      unidade de trabalho externa decide o commit. Isso permite compor
+      várias chamadas de serviço em uma única transação.
+    - Com somente_leitura=True a sessão nunca faz commit e usa o pool
+      somente leitura (`get_read_engine`).
+    """
+    if isinstance(db_object, Session):
+        yield db_object
+        return
+
+    if somente_leitura:
+        db_object = get_read_engine(db_object)
+    session = get_session(db_object)
+    try:
+        yield session
+        if somente_leitura:
+            session.rollback()
+        else:
+            session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.close()
@@ -1,58 +1,173 @@
 import pandas as pd
 import io
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import select
 from datetime import datetime, date, timedelta
 from functools import wraps
-from typing import Tuple, Any, Dict, List
+from typing import Tuple, Any, Dict, List, Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import func, or_
-from sqlalchemy.engine import Engine
-from datetime import date, datetime
-from sqlalchemy.exc import NoResultFound
+from sqlalchemy import (Column, DateTime, Integer, String, exists, func,
+                        insert, literal, select, type_coerce, update)
+from sqlalchemy.orm.exc import StaleDataError
+
+import numpy as np
+
+from database import unit_of_work, Devedor, ItemFilaTrabalho, StatusDevedor, pessoa_normalizada
+from fila_escrita import (LINHAS_POR_OPERACAO, EscritaIncerta, escrever,
+                          fila_escrita)
+from agendamento import calcular_pesos, dias_uteis, distribuir_carga
+from fila_trabalho import atualizar_fila
+from priorizacao import atualizar_scores
+from dialeto import (atualizar_em_massa, inserir_em_massa, mesmo_dia,
+                     tabela_temporaria)
+from telefones import normalizar_telefone, normalizar_telefones
+from cache_consultas import em_cache
+from estatisticas import invalidar_estatisticas
+from validacao import PRIMEIRA_LINHA_DADOS, validar_devedores
+from compactacao import compactar_inteiro, compactar_texto
+
+
+class ConflitoVersao(tuple):
+    """
+    Resultado (False, mensagem) de uma escrita recusada porque o devedor foi
+    alterado por outra operação depois de lido. Desempacota como os demais
+    resultados e traz os detalhes para a interface.
+    """
 
-import math
+    def __new__(cls,
+                devedor_ids: List[int] = (),
+                versao_esperada: int = None,
+                versao_atual: int = None,
+                mensagem: str = None):
+        devedor_ids = tuple(devedor_ids)
+        if mensagem is None:
+            if len(devedor_ids) == 1:
+                mensagem = f"Devedor ID {devedor_ids[0]} foi alterado por outro usuário"
+                if versao_esperada is not None:
+                    mensagem += f" (versão {versao_esperada} → {versao_atual})"
+            else:
+                mensagem = f"{len(devedor_ids)} devedor(es) foram alterados por outro usuário"
+            mensagem += ". Recarregue antes de tentar novamente."
+        resultado = super().__new__(cls, (False, mensagem))
+        resultado.devedor_ids = devedor_ids
+        resultado.versao_esperada = versao_esperada
+        resultado.versao_atual = versao_atual
+        return resultado
 
-from database import get_session, Devedor, StatusDevedor
 
+class ResultadoIncerto(tuple):
+    """
+    Resultado (None, mensagem) de uma escrita que passou do tempo de espera
+    depois de começar: pode ter sido gravada ou não. A interface deve
+    recarregar os dados em vez de informar falha.
+    """
 
-def _get_engine(db_object) -> Engine:
-    """Função auxiliar para garantir que sempre tenhamos um Engine."""
-    if isinstance(db_object, Engine):
-        return db_object
-    if isinstance(db_object, Session):
-        return db_object.get_bind()
-    raise TypeError(f"Objeto de banco de dados inesperado: {type(db_object)}")
+    def __new__(cls, mensagem: str):
+        return super().__new__(cls, (None, mensagem))
 
 
-def session_handler(func):
+def _obter_devedor(session: Session, devedor_id: int,
+                   versao_esperada: int = None):
+    """
+    (devedor, None) se o devedor existe e está na versão esperada; senão
+    (None, resultado de erro). Sem versão esperada, não verifica a versão.
+    """
+    devedor = session.get(Devedor, devedor_id)
+    if devedor is None:
+        return None, (False, "Erro: Devedor não encontrado.")
+    if versao_esperada is not None and devedor.versao != int(versao_esperada):
+        return None, ConflitoVersao([devedor_id], int(versao_esperada),
+                                    devedor.versao)
+    return devedor, None
+
+
+def _registrar_alteracao(session: Session, devedor_ids: List[int]) -> None:
+    """Mantém score e fila do dia em dia com os devedores alterados."""
+    atualizar_scores(session, devedor_ids)
+    atualizar_fila(session, devedor_ids)
+
+
+def session_handler(func=None, *, somente_leitura: bool = False):
+    """
+    Executa a função de serviço em uma unidade de trabalho (`unit_of_work`).
+
+    Chamada com um Engine, escritas vão para a fila de escrita do engine
+    (`fila_escrita`), que as agrupa em um único commit; erros viram
+    (False, mensagem) e um resultado (False, ...) desfaz as alterações.
+    Chamada com a Session de uma unidade de trabalho externa, participa da
+    transação dela e propaga exceções, para que tudo seja desfeito junto.
+    Funções somente leitura nunca fazem commit e propagam exceções.
+    Uma linha alterada por outra operação durante a escrita (StaleDataError)
+    vira um `ConflitoVersao`; uma escrita que passou do tempo de espera já
+    em execução (`EscritaIncerta`) vira um `ResultadoIncerto`.
+    """
+    if func is None:
+        return lambda f: session_handler(f, somente_leitura=somente_leitura)
 
     @wraps(func)
-    def wrapper(db_engine, *args, **kwargs):
-        session = get_session(db_engine)
+    def wrapper(db_object, *args, **kwargs):
+        if somente_leitura or isinstance(db_object, Session):
+            with unit_of_work(db_object, somente_leitura) as session:
+                return func(session, *args, **kwargs)
+
         try:
-            result = func(session, *args, **kwargs)
-            session.commit()
-            return result
+            return fila_escrita(db_object).executar(func, *args, **kwargs)
+        except StaleDataError:
+            return ConflitoVersao(mensagem=(
+                "O registro foi alterado por outro usuário durante a "
+                "operação. Recarregue antes de tentar novamente."))
+        except EscritaIncerta as e:
+            return ResultadoIncerto(str(e))
+        except TimeoutError as e:
+            return False, str(e)
         except IntegrityError as e:
-            session.rollback()
             return False, f"Erro de Integridade: Um registro com dados únicos já existe. Detalhe: {e.orig}"
         except Exception as e:
-            session.rollback()
             return False, f"Ocorreu um erro inesperado na operação: {e}"
-        finally:
-            session.close()
 
     return wrapper
 
 
-def load_devedores_from_db(db_engine) -> pd.DataFrame:
-
+def _compactar_devedores(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Tipos compactos para o DataFrame de devedores. `status` chega como o nome
+    do enum gravado no banco e é decodificado de uma vez via categorias.
+    """
+    status = list(StatusDevedor)
+    df['status'] = pd.Categorical(
+        df['status'], categories=[s.name for s in status]).rename_categories(
+            [s.value for s in status])
+    df['fase_cobranca'] = df['fase_cobranca'].astype(
+        pd.CategoricalDtype(sorted(df['fase_cobranca'].dropna().unique()),
+                            ordered=True))
+    df['id'] = compactar_inteiro(df['id'])
+    df['atraso'] = compactar_inteiro(df['atraso'])
+    df['versao'] = compactar_inteiro(df['versao'])
+    # valortotal e score seguem em float64: a carteira é exportada e
+    # filtrada por faixas de valor, e float32 não guarda centavos exatos.
+    for col in ['pessoa', 'nome', 'telefone', 'telefone_normalizado']:
+        df[col] = compactar_texto(df[col])
+    df['telefone_valido'] = df['telefone_valido'].astype('boolean')
+    df['atraso_referencia'] = pd.to_datetime(df['atraso_referencia'],
+                                             errors='coerce')
+    return df
+
+
+@session_handler(somente_leitura=True)
+def load_devedores_from_db(session, compacto: bool = False) -> pd.DataFrame:
+    """
+    Todos os devedores. Com compacto=True usa categorias, strings do pyarrow
+    e tipos inteiros menores (ver `compactacao`).
+    """
     try:
-        with db_engine.connect() as connection:
-
+        if compacto:
+            colunas = [
+                type_coerce(c, String).label(c.key) if c.key == 'status' else c
+                for c in Devedor.__table__.columns
+            ]
+            query = select(*colunas)
+        else:
             query = select(Devedor)
-            df = pd.read_sql(query, connection)
+        df = pd.read_sql(query, session.connection())
 
         for col in [
                 'data_cobranca', 'ultima_cobranca', 'data_pagamento',
@@ -61,6 +176,9 @@ def load_devedores_from_db(db_engine) -> pd.DataFrame:
             if col in df.columns:
                 df[col] = pd.to_datetime(df[col], errors='coerce')
 
+        if compacto:
+            return _compactar_devedores(df)
+
         if 'status' in df.columns:
             df['status'] = df['status'].apply(
                 lambda s: s.value if isinstance(s, StatusDevedor) else s)
@@ -85,26 +203,36 @@ def add_devedor_to_db(session,
     if not nome:
         return False, "Erro: O campo 'Nome' é obrigatório e não pode ser vazio."
 
+    telefone_normalizado = normalizar_telefone(telefone) if telefone else None
     novo_devedor = Devedor(pessoa=pessoa_id,
                            nome=nome,
                            valortotal=valortotal,
                            atraso=atraso,
-                           telefone=telefone,
+                           atraso_referencia=date.today(),
+                           telefone=telefone or None,
+                           telefone_normalizado=telefone_normalizado,
+                           telefone_valido=telefone_normalizado is not None,
                            status=StatusDevedor.EM_ABERTO)
     session.add(novo_devedor)
+    session.flush()
+    _registrar_alteracao(session, [novo_devedor.id])
 
     return True, f"Devedor '{nome}' adicionado com sucesso!"
 
 
 @session_handler
-def update_devedor_in_db(session, devedor_id: int,
-                         updates: Dict[str, Any]) -> Tuple[bool, str]:
+def update_devedor_in_db(session,
+                         devedor_id: int,
+                         updates: Dict[str, Any],
+                         versao_esperada: int = None) -> Tuple[bool, str]:
 
-    devedor = session.query(Devedor).filter_by(id=devedor_id).first()
-    if not devedor:
-        return False, "Devedor não encontrado para atualização."
+    devedor, erro = _obter_devedor(session, devedor_id, versao_esperada)
+    if erro:
+        return erro
 
     for key, value in updates.items():
+        if key == 'versao':
+            continue
 
         if key == 'status' and isinstance(value, str):
             try:
@@ -113,104 +241,190 @@ def update_devedor_in_db(session, devedor_id: int,
                 setattr(devedor, key, enum_value)
             except ValueError:
                 return False, f"Status '{value}' inválido."
+        elif key == 'atraso':
+            devedor.atraso = value
+            devedor.atraso_referencia = date.today()
+        elif key == 'telefone':
+            devedor.telefone = value or None
+            devedor.telefone_normalizado = normalizar_telefone(
+                value) if value else None
+            devedor.telefone_valido = devedor.telefone_normalizado is not None
         else:
             setattr(devedor, key, value)
 
+    _registrar_alteracao(session, [devedor.id])
     return True, f"Devedor ID {devedor_id} atualizado com sucesso."
 
 
 @session_handler
-def remover_devedor_from_db(db_object, devedor_id: int):
-    """
-    Remove um devedor do banco de dados.
-    AGORA COM LÓGICA DEFENSIVA PARA OBTER O ENGINE CORRETO.
-    """
-    try:
-        engine = _get_engine(db_object)
-        with Session(bind=engine) as session:
-            devedor = session.query(Devedor).filter(
-                Devedor.id == devedor_id).one()
+def remover_devedor_from_db(session,
+                            devedor_id: int,
+                            versao_esperada: int = None):
+    """Remove um devedor do banco de dados."""
+    devedor, erro = _obter_devedor(session, devedor_id, versao_esperada)
+    if erro:
+        return erro
 
-            session.delete(devedor)
+    session.delete(devedor)
+    _registrar_alteracao(session, [devedor_id])
 
-            session.commit()
-            return True, "Devedor removido com sucesso!"
+    return True, "Devedor removido com sucesso!"
 
-    except NoResultFound:
-        return False, "Erro: Devedor não encontrado."
-    except Exception as e:
-        return False, f"Erro ao remover devedor: {e}"
+
+class ResultadoImportacao(tuple):
+    """
+    Resultado (sucesso, mensagem) da importação, com as linhas rejeitadas na
+    validação e o motivo de cada uma em `rejeitadas`. `sucesso` é None quando
+    a importação foi interrompida depois de gravar parte dos lotes.
+    """
+
+    def __new__(cls, sucesso: Optional[bool], mensagem: str,
+                rejeitadas: pd.DataFrame = None):
+        resultado = super().__new__(cls, (sucesso, mensagem))
+        resultado.rejeitadas = (rejeitadas if rejeitadas is not None else
+                                pd.DataFrame())
+        return resultado
 
 
-def import_excel_to_db(db_engine, file: io.BytesIO) -> Tuple[bool, str]:
+def import_excel_to_db(db_engine, file: io.BytesIO) -> ResultadoImportacao:
     try:
         df_excel = pd.read_excel(file, engine='openpyxl')
     except Exception as e:
-        return False, f"Erro ao ler o arquivo Excel: {e}"
+        return ResultadoImportacao(False, f"Erro ao ler o arquivo Excel: {e}")
 
     required_cols = ['pessoa', 'nome', 'valortotal', 'atraso']
     if not all(col in df_excel.columns for col in required_cols):
-        return False, f"O arquivo Excel deve conter as colunas: {', '.join(required_cols)}."
-
-    # Limpeza dos dados
-    df_excel['pessoa'] = df_excel['pessoa'].astype(str).str.strip()
-    df_excel.dropna(subset=['pessoa'], inplace=True)
-    df_excel = df_excel[df_excel['pessoa'] != '']
-    if df_excel.empty:
-        return False, "Nenhum devedor com ID Pessoa válido encontrado no arquivo."
-
-    session = get_session(db_engine)
-    try:
-        existing_pessoa_ids_query = session.query(Devedor.pessoa).all()
-        existing_pessoa_ids = {
-            str(p[0]).strip().upper()
-            for p in existing_pessoa_ids_query if p[0]
-        }
-
-        df_excel['pessoa_cleaned'] = df_excel['pessoa'].str.strip().str.upper()
-        df_to_add = df_excel[~df_excel['pessoa_cleaned'].
-                             isin(existing_pessoa_ids)].copy()
-        count_skipped = len(df_excel) - len(df_to_add)
-
-        if df_to_add.empty:
-            return True, f"Importação concluída. Nenhum devedor novo para adicionar. {count_skipped} devedores já existentes foram ignorados."
-
-        df_to_add['status'] = df_to_add['status'].replace(
-            'Pendente', StatusDevedor.EM_ABERTO.value)
-
-        if 'celular1' in df_to_add.columns:
-            df_to_add['telefone'] = df_to_add['celular1'].fillna(
-                df_to_add.get('telefone', '')).astype(str)
-        elif 'telefone' not in df_to_add.columns:
-            df_to_add['telefone'] = ''
-
-        df_to_add['telefone'] = df_to_add['telefone'].apply(
-            lambda x: None if pd.isna(
-                x) or x in ['()', '( )', '()--', '( )--', '-'] else str(x))
-
-
-        datetime_cols = ['data_cobranca', 'ultima_cobranca', 'data_pagamento']
-        for col in datetime_cols:
-            if col in df_to_add.columns:
-                df_to_add[col] = df_to_add[col].where(pd.notna(df_to_add[col]),
-                                                      None)
-        model_cols = [c.key for c in Devedor.__table__.columns]
-        df_final = df_to_add[[
-            col for col in df_to_add.columns if col in model_cols
-        ]]
-
-        records_to_insert = df_final.to_dict('records')
-
-        session.bulk_insert_mappings(Devedor, records_to_insert)
-        session.commit()
-
-        return True, f"Importação concluída! Adicionados: {len(records_to_insert)}. Ignorados (já existentes): {count_skipped}."
-
-    except Exception as e:
-        session.rollback()
-        return False, f"Erro durante a importação para o banco de dados: {e}"
-    finally:
-        session.close()
+        return ResultadoImportacao(
+            False,
+            f"O arquivo Excel deve conter as colunas: {', '.join(required_cols)}."
+        )
+
+    df_validos, rejeitadas = validar_devedores(df_excel)
+    aviso_rejeitadas = (
+        f" Rejeitadas: {len(rejeitadas)} (veja o relatório de rejeições)."
+        if len(rejeitadas) else "")
+    if df_validos.empty:
+        return ResultadoImportacao(
+            False, "Nenhuma linha válida encontrada no arquivo." +
+            aviso_rejeitadas, rejeitadas)
+
+    if 'celular1' in df_validos.columns:
+        df_validos['telefone'] = df_validos['celular1'].fillna(
+            df_validos.get('telefone', ''))
+    elif 'telefone' not in df_validos.columns:
+        df_validos['telefone'] = ''
+
+    df_validos[['telefone', 'telefone_normalizado',
+                'telefone_valido']] = normalizar_telefones(
+                    df_validos['telefone'])
+
+    df_validos['atraso_referencia'] = date.today()
+
+    colunas = [
+        c.key for c in Devedor.__table__.columns
+        if c.key in df_validos.columns and c.key != 'id'
+    ]
+    df_final = df_validos[colunas].astype(object)
+    df_final = df_final.where(pd.notna(df_final), None)
+    df_final.insert(0, 'linha', df_validos.index + PRIMEIRA_LINHA_DADOS)
+
+    # Um lote por operação da fila de escrita. Linhas já gravadas por um
+    # lote anterior contam como existentes, então reimportar o arquivo
+    # depois de uma falha no meio é seguro.
+    registros = df_final.to_dict('records')
+    novos_ids, existentes = [], 0
+    for inicio in range(0, len(registros), LINHAS_POR_OPERACAO):
+        try:
+            ids_lote, existentes_lote = escrever(
+                db_engine, _gravar_importacao, colunas,
+                registros[inicio:inicio + LINHAS_POR_OPERACAO])
+        except Exception as e:
+            # Com lotes já gravados (ou um de resultado incerto), a
+            # importação fica parcial: sucesso None, como em ResultadoIncerto.
+            mensagem = f"Erro durante a importação para o banco de dados: {e}"
+            parcial = bool(novos_ids) or isinstance(e, EscritaIncerta)
+            if parcial:
+                mensagem += (
+                    f" Adicionados antes da interrupção: {len(novos_ids)}. "
+                    "Importe o arquivo de novo para completar; os já "
+                    "gravados serão ignorados.")
+            return ResultadoImportacao(None if parcial else False, mensagem,
+                                       rejeitadas)
+        novos_ids += ids_lote
+        existentes += existentes_lote
+
+    if not novos_ids:
+        return ResultadoImportacao(
+            True,
+            f"Importação concluída. Nenhum devedor novo para adicionar. {existentes} devedores já existentes foram ignorados."
+            + aviso_rejeitadas, rejeitadas)
+    return ResultadoImportacao(
+        True,
+        f"Importação concluída! Adicionados: {len(novos_ids)}. Ignorados (já existentes): {existentes}."
+        + aviso_rejeitadas, rejeitadas)
+
+
+def _gravar_importacao(session: Session, colunas: List[str],
+                       registros: List[Dict[str, Any]]
+                       ) -> Tuple[List[int], int]:
+    novos_ids, existentes = _importar_via_staging(session, colunas, registros)
+    if novos_ids:
+        # Só os devedores novos entram no score e na fila; a materialização
+        # completa fica com o job diário.
+        atualizar_scores(session, novos_ids)
+        atualizar_fila(session, novos_ids)
+        invalidar_estatisticas(session)
+    return novos_ids, existentes
+
+
+def _importar_via_staging(session: Session, colunas: List[str],
+                          registros: List[Dict[str, Any]]
+                          ) -> Tuple[List[int], int]:
+    """
+    Carrega as linhas validadas numa tabela temporária e insere, com um único
+    INSERT ... SELECT, as pessoas que ainda não existem (anti-join pelo
+    índice de `pessoa_normalizada`). O custo depende do tamanho do arquivo,
+    não da carteira.
+    Retorna (ids inseridos, quantidade de já existentes).
+    """
+    devedores = Devedor.__table__
+    estrutura = [Column('linha', Integer, primary_key=True)] + [
+        Column(c, devedores.c[c].type) for c in colunas
+    ]
+    with tabela_temporaria(session, 'importacao_devedores',
+                           estrutura) as staging:
+        inserir_em_massa(session, staging, registros)
+
+        ja_existe = exists().where(
+            pessoa_normalizada(devedores.c.pessoa) == pessoa_normalizada(
+                staging.c.pessoa))
+        existentes = session.execute(
+            select(func.count()).select_from(staging).where(
+                ja_existe)).scalar()
+        resultado = session.execute(
+            insert(devedores).from_select(
+                colunas,
+                select(*[_valor_ou_padrao(devedores.c[c], staging.c[c])
+                         for c in colunas]).where(~ja_existe)).returning(
+                             devedores.c.id))
+        novos_ids = resultado.scalars().all()
+    return novos_ids, existentes
+
+
+def _valor_ou_padrao(destino: Column, origem: Column):
+    # Vazio na planilha vale o default do modelo (ex.: status, fase).
+    padrao = destino.default
+    if padrao is None or not padrao.is_scalar:
+        return origem
+    return func.coalesce(origem, literal(padrao.arg, destino.type))
+
+
+def export_rejeitadas_to_excel(rejeitadas: pd.DataFrame):
+    """Relatório de rejeições da importação (linha, dados originais, motivo)."""
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        rejeitadas.to_excel(writer, index=False, sheet_name='Rejeitadas')
+    return output.getvalue()
 
 
 def export_devedores_to_excel(
@@ -239,87 +453,233 @@ def export_devedores_to_excel(
 
 
 @session_handler
-def marcar_como_pago_in_db(db_object, devedor_id: int):
+def marcar_como_pago_in_db(session,
+                           devedor_id: int,
+                           versao_esperada: int = None,
+                           data_pagamento: date = None):
     """
-    Marca um devedor como PAGO.
-    AGORA COM LÓGICA DEFENSIVA PARA OBTER O ENGINE CORRETO.
+    Marca um devedor como PAGO, com a data real do pagamento (padrão: hoje).
+    Para arquivos de pagamentos, use a conciliação em massa (conciliacao.py).
     """
-    try:
-        engine = _get_engine(db_object)
-        with Session(bind=engine) as session:
-            devedor = session.query(Devedor).filter(
-                Devedor.id == devedor_id).one()
-            devedor.status = StatusDevedor.PAGO
-            devedor.data_pagamento = date.today()
-
-            session.commit()
-            return True, "Devedor marcado como pago com sucesso!"
-
-    except NoResultFound:
-        return False, "Erro: Devedor não encontrado."
-    except Exception as e:
-        return False, f"Erro ao marcar como pago: {e}"
+    devedor, erro = _obter_devedor(session, devedor_id, versao_esperada)
+    if erro:
+        return erro
+
+    devedor.status = StatusDevedor.PAGO
+    devedor.data_pagamento = data_pagamento or date.today()
+    devedor.atraso_referencia = date.today()
+    _registrar_alteracao(session, [devedor_id])
+
+    return True, "Devedor marcado como pago com sucesso!"
 
 
 @session_handler
-def marcar_cobranca_feita_e_reagendar_in_db(db_object,
+def marcar_cobranca_feita_e_reagendar_in_db(session,
                                             devedor_id: int,
-                                            nova_data: date = None):
-    """
-    Marca uma cobrança como feita e reagenda a próxima.
-    AGORA COM LÓGICA DEFENSIVA PARA OBTER O ENGINE CORRETO.
-    """
-    try:
-        engine = _get_engine(db_object)
-        with Session(bind=engine) as session:
-            devedor = session.query(Devedor).filter(
-                Devedor.id == devedor_id).one()
+                                            nova_data: date = None,
+                                            versao_esperada: int = None):
+    """Marca uma cobrança como feita e reagenda a próxima."""
+    devedor, erro = _obter_devedor(session, devedor_id, versao_esperada)
+    if erro:
+        return erro
 
-            hoje = date.today()
-            devedor.ultima_cobranca = hoje
+    hoje = date.today()
+    devedor.ultima_cobranca = hoje
 
-            if nova_data is None:
-                proxima_data = hoje + timedelta(days=10)
-            else:
-                proxima_data = nova_data
+    if nova_data is None:
+        proxima_data = hoje + timedelta(days=10)
+    else:
+        proxima_data = nova_data
 
-            devedor.data_cobranca = proxima_data
-            devedor.status = StatusDevedor.AGENDADO.value
-            if devedor.fase_cobranca is None:
-                devedor.fase_cobranca = 1
-            else:
-                devedor.fase_cobranca += 1
+    devedor.data_cobranca = proxima_data
+    devedor.status = StatusDevedor.AGENDADO.value
+    if devedor.fase_cobranca is None:
+        devedor.fase_cobranca = 1
+    else:
+        devedor.fase_cobranca += 1
+    _registrar_alteracao(session, [devedor_id])
 
-            session.commit()
-            return True, f"Cobrança registrada! Próximo agendamento para {proxima_data.strftime('%d/%m/%Y')}."
+    return True, f"Cobrança registrada! Próximo agendamento para {proxima_data.strftime('%d/%m/%Y')}."
 
-    except NoResultFound:
-        return False, "Erro: Devedor não encontrado."
-    except Exception as e:
-    
-        return False, f"Erro ao registrar cobrança: {e}"
 
+def _ler_selecionados(session: Session, devedor_ids: List[int]) -> pd.DataFrame:
+    """
+    id, valortotal, fase_cobranca e versao dos devedores em aberto entre os
+    IDs, lidos em uma consulta só por JOIN com uma tabela temporária dos IDs.
+    """
+    with tabela_temporaria(session, 'reagendamento_selecionados', [
+            Column('id', Integer, primary_key=True),
+    ]) as selecionados:
+        inserir_em_massa(session, selecionados,
+                         [{'id': devedor_id} for devedor_id in devedor_ids])
+        return pd.read_sql(
+            select(Devedor.id, Devedor.valortotal, Devedor.fase_cobranca,
+                   Devedor.versao).join(
+                       selecionados, selecionados.c.id == Devedor.id).where(
+                           Devedor.status != StatusDevedor.PAGO),
+            session.connection())
+
+
+def _gravar_reagendamento(session: Session, devedor_ids: List[int],
+                          versoes: List[int], datas: List[datetime]) -> None:
+    """
+    Grava as novas datas com um único UPDATE: (id, versão lida, data) vão para
+    uma tabela temporária e só linhas ainda na versão lida são reagendadas.
+    Se alguma mudou desde a leitura, levanta StaleDataError e o lote inteiro
+    é desfeito. A fila do dia é atualizada pela mesma tabela temporária.
+    """
+    devedores = Devedor.__table__
+    with tabela_temporaria(session, 'reagendamento_datas', [
+            Column('id', Integer, primary_key=True),
+            Column('versao', Integer),
+            Column('data_cobranca', DateTime),
+    ]) as novas:
+        inserir_em_massa(session, novas, [{
+            'id': int(devedor_id),
+            'versao': int(versao),
+            'data_cobranca': data
+        } for devedor_id, versao, data in zip(devedor_ids, versoes, datas)])
+        # UPDATE ... FROM: um JOIN com a tabela temporária (SQLite 3.33+).
+        atualizados = session.execute(
+            update(devedores).where(
+                devedores.c.id == novas.c.id,
+                devedores.c.versao == novas.c.versao).values(
+                    data_cobranca=novas.c.data_cobranca,
+                    status=StatusDevedor.AGENDADO,
+                    versao=devedores.c.versao + 1)).rowcount
+        if atualizados != len(devedor_ids):
+            raise StaleDataError(
+                f"{len(devedor_ids) - atualizados} de {len(devedor_ids)} "
+                "devedor(es) foram alterados por outra operação.")
+        invalidar_estatisticas(session)
+        # Valor, atraso, fase e último contato não mudam: o score continua o
+        # mesmo e só a fila do dia precisa ser atualizada.
+        atualizar_fila(session, select(novas.c.id))
 
-def get_devedores_para_acoes_count(db_engine, filtro_nome: str = None) -> int:
-    """Conta quantos devedores precisam de ação, aplicando filtros."""
-    with Session(db_engine) as session:
-        hoje = date.today()
-        query = session.query(func.count(Devedor.id))
 
-        nao_pago = Devedor.status != StatusDevedor.PAGO.value
-        agendado_para_hoje = (Devedor.status
-                              == StatusDevedor.AGENDADO.value) & (func.date(
-                                  Devedor.data_cobranca) == hoje)
-        requer_acao = Devedor.status != StatusDevedor.AGENDADO.value
+@session_handler
+def reagendar_em_lote_in_db(session,
+                            devedor_ids: List[int],
+                            capacidade_diaria: float,
+                            intervalo_minimo: int = 1,
+                            intervalo_maximo: int = 30,
+                            criterio_peso: str = None,
+                            feriados: List[date] = (),
+                            data_base: date = None,
+                            versoes: Dict[int, int] = None) -> Tuple[bool, str]:
+    """
+    Reagenda vários devedores de uma vez, distribuindo a carga entre os dias
+    úteis da janela [data_base + intervalo_minimo, data_base + intervalo_maximo]
+    sem exceder a capacidade diária (considerando o que já está agendado).
+    Todas as datas são gravadas em uma única transação, cada linha condicionada
+    à versão lida. Com `versoes` ({id: versão vista pelo usuário}), devedores
+    alterados desde então ficam de fora e são informados na mensagem.
+    """
+    devedor_ids = list(dict.fromkeys(int(i) for i in devedor_ids))
+    if not devedor_ids:
+        return False, "Nenhum devedor selecionado para reagendamento."
+    if capacidade_diaria <= 0:
+        return False, "A capacidade diária deve ser maior que zero."
+    if intervalo_minimo > intervalo_maximo:
+        return False, "O intervalo mínimo não pode ser maior que o máximo."
+
+    hoje = data_base or date.today()
+    dias = dias_uteis(hoje + timedelta(days=intervalo_minimo),
+                      hoje + timedelta(days=intervalo_maximo), feriados)
+    if len(dias) == 0:
+        return False, "Nenhum dia útil disponível no intervalo informado."
+
+    alvo = _ler_selecionados(session, devedor_ids)
+    if alvo.empty:
+        return False, "Nenhum devedor em aberto encontrado entre os selecionados."
+
+    conflitos = []
+    if versoes:
+        esperadas = alvo['id'].map(versoes)
+        alterados = esperadas.notna() & (esperadas != alvo['versao'])
+        conflitos = alvo.loc[alterados, 'id'].tolist()
+        alvo = alvo[~alterados]
+        if alvo.empty:
+            return ConflitoVersao(conflitos)
+    alvo = alvo.sort_values('valortotal', ascending=False, kind='stable')
+    pesos = calcular_pesos(alvo['valortotal'].to_numpy(),
+                           alvo['fase_cobranca'].to_numpy(), criterio_peso)
+
+    inicio_janela = datetime.combine(dias[0].item(), datetime.min.time())
+    fim_janela = datetime.combine(dias[-1].item() + timedelta(days=1),
+                                  datetime.min.time())
+    ids_alvo = set(alvo['id'])
+    existentes = pd.DataFrame(
+        session.query(Devedor.id, Devedor.data_cobranca,
+                      Devedor.valortotal, Devedor.fase_cobranca).filter(
+                          Devedor.status != StatusDevedor.PAGO,
+                          Devedor.data_cobranca >= inicio_janela,
+                          Devedor.data_cobranca < fim_janela).all(),
+        columns=['id', 'data_cobranca', 'valortotal', 'fase_cobranca'])
+    existentes = existentes[~existentes['id'].isin(ids_alvo)]
+
+    carga_existente = np.zeros(len(dias), dtype=np.float64)
+    if not existentes.empty:
+        dias_existentes = pd.to_datetime(
+            existentes['data_cobranca']).to_numpy().astype('datetime64[D]')
+        posicoes = np.searchsorted(dias, dias_existentes)
+        validos = (posicoes < len(dias)) & (
+            dias[np.minimum(posicoes, len(dias) - 1)] == dias_existentes)
+        pesos_existentes = calcular_pesos(
+            existentes['valortotal'].to_numpy(),
+            existentes['fase_cobranca'].to_numpy(), criterio_peso)
+        carga_existente = np.bincount(posicoes[validos],
+                                      weights=pesos_existentes[validos],
+                                      minlength=len(dias))
+
+    indices_dia = distribuir_carga(pesos, carga_existente,
+                                   capacidade_diaria)
+    agendados = indices_dia >= 0
+    datas = dias[indices_dia[agendados]].astype('datetime64[us]').tolist()
+
+    if datas:
+        _gravar_reagendamento(session,
+                              alvo['id'].to_numpy()[agendados].tolist(),
+                              alvo['versao'].to_numpy()[agendados].tolist(),
+                              datas)
+
+    sem_vaga = int((~agendados).sum())
+    mensagem = f"{int(agendados.sum())} devedor(es) reagendado(s) entre {dias[0].item().strftime('%d/%m/%Y')} e {dias[-1].item().strftime('%d/%m/%Y')}."
+    if sem_vaga:
+        mensagem += f" {sem_vaga} sem vaga na janela (capacidade esgotada)."
+    if conflitos:
+        mensagem += f" {len(conflitos)} ignorado(s) por terem sido alterados por outro usuário."
+    return True, mensagem
+
+
+def reagendar_dia_em_lote_in_db(db_engine, data_origem: date,
+                                **kwargs) -> Tuple[bool, str]:
+    """
+    Redistribui os devedores em aberto agendados para `data_origem` com
+    `reagendar_em_lote_in_db`. A janela conta a partir do próprio dia (ou de
+    hoje, se ele já passou), para que ninguém seja antecipado.
+    """
+    ids = get_ids_devedores_para_dia(db_engine, data_origem)
+    return reagendar_em_lote_in_db(db_engine,
+                                   ids,
+                                   data_base=max(data_origem, date.today()),
+                                   **kwargs)
 
-        query = query.filter(nao_pago & or_(agendado_para_hoje, requer_acao))
+
+@em_cache(tabelas=('fila_trabalho', ))
+def get_devedores_para_acoes_count(db_engine, filtro_nome: str = None) -> int:
+    """Conta quantos devedores precisam de ação, aplicando filtros."""
+    with unit_of_work(db_engine, somente_leitura=True) as session:
+        query = session.query(func.count(ItemFilaTrabalho.devedor_id))
 
         if filtro_nome:
-            query = query.filter(Devedor.nome.ilike(f"%{filtro_nome}%"))
+            query = query.filter(
+                ItemFilaTrabalho.nome.ilike(f"%{filtro_nome}%"))
 
         return query.scalar()
 
 
+@em_cache(tabelas=('fila_trabalho', ))
 def get_devedores_para_acoes_paginated(
         db_engine,
         page: int,
@@ -327,60 +687,160 @@ def get_devedores_para_acoes_paginated(
         sort_column: str,
         sort_ascending: bool,
         filtro_nome: str = None) -> pd.DataFrame:
-    """Busca uma página de devedores que precisam de ação."""
-    with Session(db_engine) as session:
+    """
+    Busca uma página de devedores que precisam de ação, lida da fila de
+    trabalho do dia (já filtrada e indexada pelas chaves de ordenação).
+    """
+    with unit_of_work(db_engine, somente_leitura=True) as session:
         offset = page * page_size
-        hoje = date.today()
-
-        query = session.query(Devedor)
-
-        nao_pago = Devedor.status != StatusDevedor.PAGO.value
-        agendado_para_hoje = (Devedor.status
-                              == StatusDevedor.AGENDADO.value) & (func.date(
-                                  Devedor.data_cobranca) == hoje)
-        requer_acao = Devedor.status != StatusDevedor.AGENDADO.value
 
-        query = query.filter(nao_pago & or_(agendado_para_hoje, requer_acao))
+        colunas = [
+            c for c in ItemFilaTrabalho.__table__.columns
+            if c.key not in ('devedor_id', 'data_referencia')
+        ]
+        query = session.query(ItemFilaTrabalho.devedor_id.label('id'),
+                              *colunas)
 
         if filtro_nome:
-            query = query.filter(Devedor.nome.ilike(f"%{filtro_nome}%"))
+            query = query.filter(
+                ItemFilaTrabalho.nome.ilike(f"%{filtro_nome}%"))
 
-        coluna_ordenacao = getattr(Devedor, sort_column, Devedor.nome)
+        coluna_ordenacao = getattr(ItemFilaTrabalho, sort_column,
+                                   ItemFilaTrabalho.nome)
         if not sort_ascending:
             coluna_ordenacao = coluna_ordenacao.desc()
-        query = query.order_by(coluna_ordenacao)
+        query = query.order_by(coluna_ordenacao, ItemFilaTrabalho.prioridade)
 
         query = query.limit(page_size).offset(offset)
 
 
-        df = pd.read_sql(query.statement, session.bind)
+        df = pd.read_sql(query.statement, session.connection())
         return df
 
 
+@em_cache(tabelas=('devedores', ))
 def get_devedores_para_dia_count(db_engine, selected_date: date) -> int:
     """
     Conta o número total de cobranças agendadas para uma data específica.
     """
-    with Session(db_engine) as session:
+    with unit_of_work(db_engine, somente_leitura=True) as session:
         query = session.query(func.count(Devedor.id)).filter(
-            func.date(Devedor.data_cobranca) == selected_date)
+            mesmo_dia(Devedor.data_cobranca, selected_date))
         total = query.scalar()
         return total if total is not None else 0
 
 
+@em_cache(tabelas=('devedores', ))
 def get_devedores_para_dia_paginated(db_engine, selected_date: date, page: int,
                                      page_size: int) -> pd.DataFrame:
     """
     Busca uma página de devedores com cobrança agendada para uma data específica.
     """
-    with Session(db_engine) as session:
+    with unit_of_work(db_engine, somente_leitura=True) as session:
         offset = page * page_size
 
         query = session.query(Devedor).filter(
-            func.date(Devedor.data_cobranca) == selected_date
+            mesmo_dia(Devedor.data_cobranca, selected_date)
         ).order_by(
             Devedor.nome 
         ).limit(page_size).offset(offset)
 
-        df = pd.read_sql(query.statement, session.bind)
+        df = pd.read_sql(query.statement, session.connection())
         return df
+
+
+@em_cache(tabelas=('devedores', ))
+def buscar_devedores_por_telefone(db_engine, telefone: str) -> pd.DataFrame:
+    """
+    Devedores com o telefone informado, em qualquer formato (retorno de
+    ligação). Busca pela coluna normalizada, que é indexada.
+    """
+    telefone_normalizado = normalizar_telefone(telefone)
+    if telefone_normalizado is None:
+        return pd.DataFrame()
+
+    with unit_of_work(db_engine, somente_leitura=True) as session:
+        query = session.query(Devedor).filter(
+            Devedor.telefone_normalizado == telefone_normalizado).order_by(
+                Devedor.nome)
+        return pd.read_sql(query.statement, session.connection())
+
+
+def normalizar_telefones_existentes(db_engine) -> Tuple[bool, str]:
+    """
+    Preenche a coluna normalizada dos devedores cadastrados antes da
+    normalização de telefones existir, um lote por operação da fila de
+    escrita.
+    """
+    total, invalidos = 0, 0
+    while True:
+        resultado = _normalizar_lote_telefones(db_engine)
+        sucesso, normalizados = resultado[:2]
+        if not sucesso:
+            return resultado
+        total += normalizados
+        invalidos += resultado[2]
+        if normalizados < LINHAS_POR_OPERACAO:
+            break
+    if not total:
+        return True, "Nenhum telefone pendente de normalização."
+    return True, f"{total} telefone(s) normalizado(s), {invalidos} inválido(s)."
+
+
+@session_handler
+def _normalizar_lote_telefones(session):
+    """(True, normalizados, inválidos) de um lote de telefones pendentes."""
+    pendentes = session.query(Devedor.id, Devedor.telefone).filter(
+        Devedor.telefone.isnot(None),
+        Devedor.telefone_valido.is_(None)).order_by(
+            Devedor.id).limit(LINHAS_POR_OPERACAO).all()
+    if not pendentes:
+        return True, 0, 0
+
+    df = pd.DataFrame(pendentes, columns=['id', 'telefone'])
+    df[['telefone', 'telefone_normalizado',
+        'telefone_valido']] = normalizar_telefones(df['telefone'])
+
+    atualizar_em_massa(session, Devedor, df.to_dict('records'))
+    return True, len(df), int((~df['telefone_valido']).sum())
+
+
+def get_ids_devedores_para_dia(db_engine, selected_date: date) -> List[int]:
+    """IDs dos devedores em aberto com cobrança agendada para a data."""
+    with unit_of_work(db_engine, somente_leitura=True) as session:
+        linhas = session.query(Devedor.id).filter(
+            mesmo_dia(Devedor.data_cobranca, selected_date),
+            Devedor.status != StatusDevedor.PAGO).all()
+        return [linha[0] for linha in linhas]
+
+
+def _com_score():
+    # Só devedores em aberto têm score (os pagos o perdem); o filtro é o
+    # mesmo do índice parcial, para que o planejador o use.
+    return Devedor.score_prioridade.isnot(None)
+
+
+@em_cache(tabelas=('devedores', ))
+def get_devedores_por_score_count(db_engine) -> int:
+    """Quantos devedores em aberto entram no ranking por score."""
+    with unit_of_work(db_engine, somente_leitura=True) as session:
+        return session.query(func.count(Devedor.id)).filter(
+            _com_score()).scalar()
+
+
+@em_cache(tabelas=('devedores', ))
+def get_devedores_por_score_paginated(db_engine, page: int,
+                                      page_size: int) -> pd.DataFrame:
+    """
+    Página do ranking dos devedores em aberto pelo score de prioridade
+    persistido, percorrendo o índice (score desc, id).
+    """
+    with unit_of_work(db_engine, somente_leitura=True) as session:
+        query = select(Devedor.id, Devedor.nome, Devedor.valortotal,
+                       Devedor.atraso, Devedor.fase_cobranca,
+                       Devedor.ultima_cobranca,
+                       Devedor.score_prioridade).where(_com_score()).order_by(
+                           Devedor.score_prioridade.desc(),
+                           Devedor.id).limit(page_size).offset(
+                               page * page_size)
+        return pd.read_sql(query, session.connection())
@@ -0,0 +1,253 @@
+"""
+Operações em massa e predicados de data portáveis entre SQLite e PostgreSQL.
+
+Cada helper usa o caminho mais rápido disponível no dialeto da sessão:
+COPY / execute_values no PostgreSQL (quando o driver os oferece) e
+executemany do SQLAlchemy nos demais.
+"""
+import csv
+import io
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterator, List, Sequence
+
+import pandas as pd
+from sqlalchemy import (Column, Integer, MetaData, Table, bindparam, insert,
+                        update)
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.sql.functions import FunctionElement
+
+from database import registrar_alteracao
+
+
+class dias_entre(FunctionElement):
+    """Dias inteiros entre duas datas: dias_entre(inicio, fim) = fim - inicio."""
+    type = Integer()
+    inherit_cache = True
+    name = 'dias_entre'
+
+
+@compiles(dias_entre, 'sqlite')
+def _dias_entre_sqlite(element, compiler, **kw):
+    inicio, fim = list(element.clauses)
+    # date() descarta a hora, como o CAST AS DATE do PostgreSQL.
+    return (f"CAST(julianday(date({compiler.process(fim, **kw)})) - "
+            f"julianday(date({compiler.process(inicio, **kw)})) AS INTEGER)")
+
+
+@compiles(dias_entre, 'postgresql')
+def _dias_entre_postgresql(element, compiler, **kw):
+    inicio, fim = list(element.clauses)
+    return (f"(CAST({compiler.process(fim, **kw)} AS DATE) - "
+            f"CAST({compiler.process(inicio, **kw)} AS DATE))")
+
+
+def mesmo_dia(coluna, dia: date):
+    """
+    Predicado "coluna cai no dia" como intervalo [dia, dia + 1), que usa o
+    índice da coluna em qualquer banco (ao contrário de date(coluna) = dia).
+    """
+    inicio = datetime.combine(dia, datetime.min.time())
+    return (coluna >= inicio) & (coluna < inicio + timedelta(days=1))
+
+
+def _tabela(alvo) -> Table:
+    return getattr(alvo, '__table__', alvo)
+
+
+def _dialeto(session: Session) -> str:
+    return session.get_bind().dialect.name
+
+
+def _cursor_bruto(session: Session, tabela: Table):
+    # Escritas direto no driver não passam pelos eventos da sessão.
+    registrar_alteracao(session, tabela.name)
+    return session.connection().connection.cursor()
+
+
+@contextmanager
+def tabela_temporaria(session: Session, nome: str,
+                      colunas: Sequence[Column]) -> Iterator[Table]:
+    """
+    Tabela temporária na conexão da sessão, removida ao final do bloco. Se o
+    bloco falhar, o rollback da transação também desfaz a criação (DDL é
+    transacional no SQLite e no PostgreSQL).
+    """
+    tabela = Table(nome, MetaData(), *colunas, prefixes=['TEMPORARY'])
+    conexao = session.connection()
+    # checkfirst também evita recriar tipos ENUM já existentes no PostgreSQL.
+    tabela.create(conexao, checkfirst=True)
+    yield tabela
+    tabela.drop(conexao)
+
+
+def inserir_em_massa(session: Session, alvo,
+                     registros: List[Dict[str, Any]]) -> int:
+    """Insere muitos registros na transação da sessão (COPY no PostgreSQL)."""
+    if not registros:
+        return 0
+    tabela = _tabela(alvo)
+    session.flush()
+
+    if _dialeto(session) == 'postgresql':
+        cursor = _cursor_bruto(session, tabela)
+        if hasattr(cursor, 'copy_expert') or hasattr(cursor, 'copy'):
+            _copy_postgresql(cursor, tabela, registros)
+            return len(registros)
+
+    session.execute(insert(tabela), registros)
+    return len(registros)
+
+
+def _valor_copy(valor):
+    if valor is None or (not isinstance(valor, str) and pd.isna(valor)):
+        return ''
+    if hasattr(valor, 'name') and hasattr(valor, 'value'):  # Enum
+        return valor.name
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    return valor
+
+
+def _copy_postgresql(cursor, tabela: Table, registros: List[Dict[str, Any]]):
+    # COPY ignora os defaults definidos no modelo: aplica os escalares aqui.
+    padroes = {
+        c.name: c.default.arg
+        for c in tabela.columns if c.name not in registros[0]
+        and c.default is not None and c.default.is_scalar
+    }
+    colunas = [
+        c.name for c in tabela.columns
+        if c.name in registros[0] or c.name in padroes
+    ]
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    for registro in registros:
+        escritor.writerow([
+            _valor_copy(registro.get(c, padroes.get(c))) for c in colunas
+        ])
+    buffer.seek(0)
+
+    comando = (f"COPY {tabela.name} ({', '.join(colunas)}) "
+               "FROM STDIN WITH (FORMAT csv, NULL '')")
+    if hasattr(cursor, 'copy_expert'):  # psycopg2
+        cursor.copy_expert(comando, buffer)
+    else:  # psycopg 3
+        with cursor.copy(comando) as copia:
+            copia.write(buffer.getvalue())
+
+
+def atualizar_em_massa(session: Session,
+                       alvo,
+                       registros: List[Dict[str, Any]],
+                       chave: str = 'id',
+                       versao: str = None) -> int:
+    """
+    Atualiza muitas linhas pela chave, cada uma com seus próprios valores
+    (execute_values + UPDATE ... FROM VALUES no PostgreSQL com psycopg2).
+
+    Com `versao` (nome da coluna de versão), cada registro traz a versão
+    esperada da linha: só linhas ainda nessa versão são atualizadas, e a
+    versão é incrementada. Se alguma linha já tiver mudado, levanta
+    StaleDataError (como o ORM), para que a operação inteira seja desfeita.
+    """
+    if not registros:
+        return 0
+    tabela = _tabela(alvo)
+    session.flush()
+    colunas = [c for c in registros[0] if c not in (chave, versao)]
+
+    if _dialeto(session) == 'postgresql':
+        try:
+            from psycopg2.extras import execute_values
+        except ImportError:
+            execute_values = None
+        if execute_values is not None:
+            tipos = {
+                c.name: c.type.compile(dialect=session.get_bind().dialect)
+                for c in tabela.columns
+            }
+            atribuicoes = [
+                f"{c} = CAST(v.{c} AS {tipos[c]})" for c in colunas
+            ]
+            colunas_valores = [chave] + colunas
+            condicao = f"t.{chave} = v.{chave}"
+            if versao:
+                atribuicoes.append(f"{versao} = t.{versao} + 1")
+                colunas_valores.append(versao)
+                condicao += f" AND t.{versao} = CAST(v.{versao} AS INTEGER)"
+            cursor = _cursor_bruto(session, tabela)
+            execute_values(
+                cursor,
+                f"UPDATE {tabela.name} AS t SET {', '.join(atribuicoes)} "
+                f"FROM (VALUES %s) AS v ({', '.join(colunas_valores)}) "
+                f"WHERE {condicao}",
+                [tuple(_valor_pg(r[c]) for c in colunas_valores)
+                 for r in registros],
+                # Com versão, uma única página para o rowcount cobrir tudo.
+                page_size=len(registros) if versao else 1000)
+            if versao:
+                _verificar_versoes(tabela, len(registros), cursor.rowcount)
+            return len(registros)
+
+    condicao = tabela.c[chave] == bindparam('_chave')
+    valores = {c: bindparam(f'_v_{c}') for c in colunas}
+    if versao:
+        condicao &= tabela.c[versao] == bindparam('_versao')
+        valores[versao] = tabela.c[versao] + 1
+    resultado = session.execute(
+        update(tabela).where(condicao).values(valores),
+        [{
+            '_chave': r[chave],
+            **({'_versao': r[versao]} if versao else {}),
+            **{f'_v_{c}': r[c] for c in colunas}
+        } for r in registros])
+    if versao:
+        _verificar_versoes(tabela, len(registros), resultado.rowcount)
+    return len(registros)
+
+
+def _verificar_versoes(tabela: Table, esperadas: int, atualizadas: int):
+    if atualizadas != esperadas:
+        raise StaleDataError(
+            f"{esperadas - atualizadas} de {esperadas} linha(s) de "
+            f"{tabela.name} foram alteradas por outra operação.")
+
+
+def _valor_pg(valor):
+    if hasattr(valor, 'name') and hasattr(valor, 'value'):  # Enum
+        return valor.name
+    return valor
+
+
+def upsert(session: Session, alvo, registros: List[Dict[str, Any]],
+           chaves: Sequence[str]) -> int:
+    """
+    Insere ou atualiza registros pela chave única (INSERT ... ON CONFLICT,
+    suportado por SQLite e PostgreSQL).
+    """
+    if not registros:
+        return 0
+    tabela = _tabela(alvo)
+    dialeto = _dialeto(session)
+    if dialeto == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as insert_dialeto
+    elif dialeto == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as insert_dialeto
+    else:
+        raise NotImplementedError(f"Upsert não suportado para {dialeto}.")
+
+    comando = insert_dialeto(tabela)
+    atualizar = {
+        c: comando.excluded[c]
+        for c in registros[0] if c not in chaves
+    }
+    if atualizar:
+        comando = comando.on_conflict_do_update(index_elements=list(chaves),
+                                                set_=atualizar)
+    else:
+        comando = comando.on_conflict_do_nothing(index_elements=list(chaves))
+    session.execute(comando, registros)
+    return len(registros)
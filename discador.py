@@ -0,0 +1,170 @@
+"""
+Lista de contatos do dia para o discador dos agentes.
+
+Mesmos devedores e mesma ordem de prioridade da lista "Ações de Cobrança"
+(`get_devedores_para_acoes_*`), lidos da fila de trabalho do dia. As linhas
+vêm do banco em lotes por um cursor no servidor (`stream_results` /
+`yield_per`) e são gravadas no CSV à medida que chegam, então a memória não
+cresce com o tamanho da lista.
+
+Com vários agentes, as linhas são distribuídas em rodízio: cada lote segue em
+ordem de prioridade e todos recebem devedores de todas as faixas. Telefones
+inválidos ficam de fora por padrão; o telefone sai normalizado (+55...)
+quando possível.
+
+Uso headless: python discador.py [--agentes N] [--incluir-invalidos] [--diretorio DIR]
+"""
+import argparse
+import csv
+import io
+import os
+import tempfile
+import zipfile
+from datetime import date
+from typing import BinaryIO, Iterator, List, Sequence, TextIO, Tuple
+
+from sqlalchemy import func, select
+
+from database import Devedor, ItemFilaTrabalho, init_db, unit_of_work
+from fila_trabalho import garantir_fila_do_dia
+
+COLUNAS_DISCADOR = ['nome', 'telefone', 'valortotal', 'fase']
+TAMANHO_LOTE_DISCADOR = 5000
+TAMANHO_BLOCO_COPIA = 64 * 1024
+
+
+def _select_lista(incluir_invalidos: bool = False, filtro_nome: str = None):
+    query = select(
+        ItemFilaTrabalho.nome,
+        func.coalesce(Devedor.telefone_normalizado, ItemFilaTrabalho.telefone),
+        ItemFilaTrabalho.valortotal, ItemFilaTrabalho.fase_cobranca).join(
+            Devedor, Devedor.id == ItemFilaTrabalho.devedor_id)
+    if not incluir_invalidos:
+        query = query.where(Devedor.telefone_valido.is_(True))
+    if filtro_nome:
+        query = query.where(ItemFilaTrabalho.nome.ilike(f"%{filtro_nome}%"))
+    return query.order_by(ItemFilaTrabalho.prioridade)
+
+
+def linhas_lista_discador(
+        db_engine,
+        incluir_invalidos: bool = False,
+        filtro_nome: str = None,
+        tamanho_lote: int = TAMANHO_LOTE_DISCADOR) -> Iterator[Tuple]:
+    """(nome, telefone, valortotal, fase) em ordem de prioridade, em lotes."""
+    with unit_of_work(db_engine, somente_leitura=True) as session:
+        resultado = session.execute(
+            _select_lista(incluir_invalidos, filtro_nome).execution_options(
+                stream_results=True, yield_per=tamanho_lote))
+        for lote in resultado.partitions():
+            yield from lote
+
+
+def escrever_lista_discador(db_engine,
+                            destinos: Sequence[TextIO],
+                            incluir_invalidos: bool = False,
+                            filtro_nome: str = None) -> List[int]:
+    """
+    Grava a lista em CSV, distribuindo as linhas em rodízio entre os
+    `destinos` (um por agente). Retorna quantas linhas cada um recebeu.
+    """
+    garantir_fila_do_dia(db_engine)
+    escritores = [csv.writer(destino) for destino in destinos]
+    for escritor in escritores:
+        escritor.writerow(COLUNAS_DISCADOR)
+    totais = [0] * len(escritores)
+    for i, (nome, telefone, valortotal, fase) in enumerate(
+            linhas_lista_discador(db_engine, incluir_invalidos,
+                                  filtro_nome)):
+        agente = i % len(escritores)
+        escritores[agente].writerow(
+            [nome, telefone or '', f'{valortotal:.2f}', fase])
+        totais[agente] += 1
+    return totais
+
+
+def _nome_arquivo(agente: int = None, agentes: int = 1) -> str:
+    nome = f"lista_discador_{date.today():%Y-%m-%d}"
+    if agentes > 1:
+        nome += f"_agente_{agente + 1:02d}"
+    return nome + ".csv"
+
+
+def exportar_lista_discador(db_engine,
+                            diretorio: str = '.',
+                            agentes: int = 1,
+                            incluir_invalidos: bool = False
+                            ) -> List[Tuple[str, int]]:
+    """Grava um CSV por agente em `diretorio`. Retorna [(caminho, linhas)]."""
+    caminhos = [
+        os.path.join(diretorio, _nome_arquivo(agente, agentes))
+        for agente in range(agentes)
+    ]
+    arquivos = [
+        open(caminho, 'w', newline='', encoding='utf-8')
+        for caminho in caminhos
+    ]
+    try:
+        totais = escrever_lista_discador(db_engine, arquivos,
+                                         incluir_invalidos)
+    finally:
+        for arquivo in arquivos:
+            arquivo.close()
+    return list(zip(caminhos, totais))
+
+
+def _copiar_em_blocos(origem: TextIO, destino: BinaryIO):
+    """Copia um CSV temporário, do início, em blocos codificados em UTF-8."""
+    origem.seek(0)
+    for bloco in iter(lambda: origem.read(TAMANHO_BLOCO_COPIA), ''):
+        destino.write(bloco.encode('utf-8'))
+
+
+def gerar_arquivo_discador(db_engine,
+                           agentes: int = 1,
+                           incluir_invalidos: bool = False
+                           ) -> Tuple[bytes, str, str, int]:
+    """
+    Arquivo para download: o CSV, ou um .zip com um CSV por agente.
+    Retorna (conteúdo, nome do arquivo, mime, total de linhas).
+    """
+    # As linhas vão para arquivos temporários à medida que saem do banco e
+    # são copiadas em blocos para o arquivo final. Com vários agentes, os
+    # lotes são gravados em paralelo (rodízio) e compactados um por vez.
+    temporarios = [
+        tempfile.TemporaryFile('w+', newline='', encoding='utf-8')
+        for _ in range(max(agentes, 1))
+    ]
+    try:
+        totais = escrever_lista_discador(db_engine, temporarios,
+                                         incluir_invalidos)
+        saida = io.BytesIO()
+        if agentes <= 1:
+            _copiar_em_blocos(temporarios[0], saida)
+            return saida.getvalue(), _nome_arquivo(), 'text/csv', totais[0]
+        with zipfile.ZipFile(saida, 'w', zipfile.ZIP_DEFLATED) as arquivo_zip:
+            for agente, temporario in enumerate(temporarios):
+                with arquivo_zip.open(_nome_arquivo(agente, agentes),
+                                      'w') as entrada:
+                    _copiar_em_blocos(temporario, entrada)
+    finally:
+        for temporario in temporarios:
+            temporario.close()
+    nome = f"lista_discador_{date.today():%Y-%m-%d}.zip"
+    return saida.getvalue(), nome, 'application/zip', sum(totais)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--agentes', type=int, default=1,
+                        help='número de lotes (um CSV por agente)')
+    parser.add_argument('--incluir-invalidos', action='store_true',
+                        help='inclui devedores com telefone inválido')
+    parser.add_argument('--diretorio', default='.',
+                        help='pasta onde os CSVs são gravados')
+    args = parser.parse_args()
+
+    for caminho, linhas in exportar_lista_discador(init_db(), args.diretorio,
+                                                   max(args.agentes, 1),
+                                                   args.incluir_invalidos):
+        print(f"{caminho}: {linhas} contato(s).")
@@ -0,0 +1,51 @@
+"""
+Envelhecimento diário de `atraso`.
+
+`atraso` guarda os dias em atraso na data de `atraso_referencia`. O job soma,
+com um único UPDATE, os dias decorridos desde a referência de cada devedor em
+aberto e move a referência para hoje. Rodar mais de uma vez no mesmo dia não
+altera nada; dias sem execução são compensados na próxima.
+
+Uso headless: python envelhecimento.py
+"""
+from datetime import date
+from typing import Tuple
+
+from sqlalchemy import Date, func, literal, or_, update
+from sqlalchemy.orm import Session
+
+from database import Devedor, StatusDevedor, init_db, unit_of_work
+from dialeto import dias_entre
+from estatisticas import invalidar_estatisticas
+
+
+def envelhecer_atrasos(session: Session,
+                       hoje: date = None,
+                       faixa_ids: Tuple[int, int] = None) -> int:
+    """
+    Atualiza `atraso` de todos os devedores em aberto até `hoje` (ou só dos
+    IDs na faixa fechada `faixa_ids`). Devedores sem referência passam a
+    tê-la sem incremento. Não faz commit.
+    """
+    hoje = hoje or date.today()
+    dias_decorridos = dias_entre(
+        func.coalesce(Devedor.atraso_referencia, hoje), literal(hoje, Date))
+
+    query = update(Devedor).where(
+        Devedor.status != StatusDevedor.PAGO,
+        or_(Devedor.atraso_referencia.is_(None),
+            Devedor.atraso_referencia < hoje))
+    if faixa_ids is not None:
+        query = query.where(Devedor.id.between(*faixa_ids))
+    resultado = session.execute(
+        query.values(atraso=Devedor.atraso + dias_decorridos,
+                     atraso_referencia=hoje).execution_options(
+                         synchronize_session=False))
+    invalidar_estatisticas(session)
+    return resultado.rowcount
+
+
+if __name__ == "__main__":
+    with unit_of_work(init_db()) as session:
+        total = envelhecer_atrasos(session)
+    print(f"Atraso atualizado para {total} devedor(es) em {date.today():%d/%m/%Y}.")
@@ -0,0 +1,479 @@
+"""
+Catálogo de estatísticas das colunas de devedores.
+
+Para cada coluna numérica ou de data o catálogo guarda total, nulos, soma,
+mínimo, máximo e um histograma de faixas fixas (de onde saem os quantis
+aproximados); para colunas categóricas, a contagem por valor. Ler qualquer
+estatística é O(1) (ou O(faixas)), sem percorrer a carteira.
+
+O catálogo é montado com uma leitura das colunas e depois mantido
+incrementalmente: as alterações feitas pelo ORM em `Devedor` são registradas
+no flush e aplicadas quando a transação é confirmada (savepoints desfeitos são
+descartados). Escritas em massa pelo Core chamam `invalidar_estatisticas`, e o
+catálogo é reconstruído na próxima leitura.
+
+Mínimo e máximo são mantidos com a quantidade de linhas em cada um; quando a
+última linha com o valor extremo sai, o catálogo é reconstruído na próxima
+leitura.
+
+Cada processo mantém o próprio catálogo, marcado com a versão da tabela de
+devedores no banco (`versao_tabelas`). Se a versão mudar por um commit que o
+catálogo não aplicou (outro processo, ou o job headless), ele é reconstruído.
+A versão é incrementada depois do commit dos dados; uma reconstrução entre os
+dois pode já ler um commit deste processo que ainda será aplicado, e então o
+catálogo fica para nova reconstrução em vez de contá-lo duas vezes.
+"""
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from database import Devedor, unit_of_work, versao_tabelas
+from graficos import QUANTIS_PADRAO
+
+COLUNAS_NUMERICAS = ('valortotal', 'atraso', 'fase_cobranca')
+COLUNAS_DATA = ('data_cobranca', 'ultima_cobranca', 'data_pagamento')
+COLUNAS_CONTAGEM = ('status', 'fase_cobranca')
+COLUNAS_CATALOGO = tuple(
+    dict.fromkeys(COLUNAS_NUMERICAS + COLUNAS_DATA + COLUNAS_CONTAGEM))
+
+FAIXAS_HISTOGRAMA = 64
+# Fração de valores fora das faixas a partir da qual o histograma é refeito.
+LIMITE_FORA_DAS_FAIXAS = 0.05
+
+_SEGUNDOS_DIA = 86400
+
+
+def _data_para_numero(valores) -> np.ndarray:
+    """Datas em dias desde 1970-01-01 (float); nulos viram NaN."""
+    datas = pd.to_datetime(pd.Series(valores), errors='coerce')
+    numeros = datas.to_numpy(dtype='datetime64[s]').astype(np.int64).astype(
+        np.float64) / _SEGUNDOS_DIA
+    numeros[datas.isna().to_numpy()] = np.nan
+    return numeros
+
+
+def _numero_para_data(numero: float) -> Optional[pd.Timestamp]:
+    if numero is None or np.isnan(numero):
+        return None
+    return pd.Timestamp(int(round(numero * _SEGUNDOS_DIA)), unit='s')
+
+
+def _categoria(valor):
+    return getattr(valor, 'value', valor)
+
+
+class EstatisticaColuna:
+    """Estatísticas de uma coluna numérica (datas já convertidas em dias)."""
+
+    def __init__(self, valores: np.ndarray, faixas: int = FAIXAS_HISTOGRAMA):
+        valores = np.asarray(valores, dtype=np.float64)
+        finitos = valores[~np.isnan(valores)]
+        self.total = len(valores)
+        self.nulos = self.total - len(finitos)
+        self.soma = float(finitos.sum())
+        self.minimo = float(finitos.min()) if len(finitos) else np.nan
+        self.maximo = float(finitos.max()) if len(finitos) else np.nan
+        # Linhas com o valor mínimo/máximo; zerar uma delas deixa a faixa
+        # desatualizada.
+        self.no_minimo = int(np.count_nonzero(finitos == self.minimo))
+        self.no_maximo = int(np.count_nonzero(finitos == self.maximo))
+        self.abaixo = 0
+        self.acima = 0
+        if len(finitos):
+            self.contagens, self.bordas = np.histogram(finitos, bins=faixas)
+        else:
+            self.contagens, self.bordas = np.zeros(0, np.int64), None
+
+    @property
+    def validos(self) -> int:
+        return self.total - self.nulos
+
+    @property
+    def media(self) -> float:
+        return self.soma / self.validos if self.validos else np.nan
+
+    @property
+    def fora_das_faixas(self) -> bool:
+        """Muitos valores caíram fora das faixas: hora de reconstruir."""
+        if self.bordas is None:
+            return self.validos > 0
+        fora = self.abaixo + self.acima
+        return fora > LIMITE_FORA_DAS_FAIXAS * max(self.validos, 1)
+
+    @property
+    def extremo_removido(self) -> bool:
+        """Saiu a última linha com o mínimo ou o máximo: faixa desatualizada."""
+        return self.validos > 0 and (self.no_minimo <= 0 or self.no_maximo <= 0)
+
+    def _faixa_do_valor(self, valor: float) -> int:
+        if valor < self.bordas[0]:
+            return -1
+        if valor > self.bordas[-1]:
+            return len(self.contagens)
+        # A última faixa do np.histogram é fechada à direita.
+        return min(int(np.searchsorted(self.bordas, valor, side='right')) - 1,
+                   len(self.contagens) - 1)
+
+    def _contar(self, valor: float, delta: int):
+        if self.bordas is None:
+            return
+        faixa = self._faixa_do_valor(valor)
+        if faixa < 0:
+            self.abaixo += delta
+        elif faixa >= len(self.contagens):
+            self.acima += delta
+        else:
+            self.contagens[faixa] += delta
+
+    def adicionar(self, valor: Optional[float]):
+        self.total += 1
+        if valor is None or np.isnan(valor):
+            self.nulos += 1
+            return
+        self.soma += valor
+        if np.isnan(self.minimo) or valor < self.minimo:
+            self.minimo, self.no_minimo = valor, 0
+        if np.isnan(self.maximo) or valor > self.maximo:
+            self.maximo, self.no_maximo = valor, 0
+        self.no_minimo += valor == self.minimo
+        self.no_maximo += valor == self.maximo
+        self._contar(valor, 1)
+
+    def remover(self, valor: Optional[float]):
+        self.total -= 1
+        if valor is None or np.isnan(valor):
+            self.nulos -= 1
+            return
+        self.soma -= valor
+        self.no_minimo -= valor == self.minimo
+        self.no_maximo -= valor == self.maximo
+        self._contar(valor, -1)
+
+    def quantis(self, probabilidades: Sequence[float]) -> pd.Series:
+        """
+        Quantis aproximados pelo histograma (interpolação linear dentro da
+        faixa); valores fora das faixas ficam entre a borda e o mínimo/máximo.
+        """
+        probabilidades = list(probabilidades)
+        if self.bordas is None or self.validos <= 0:
+            return pd.Series(np.nan, index=probabilidades)
+        bordas = np.concatenate(([min(self.minimo, self.bordas[0])],
+                                 self.bordas,
+                                 [max(self.maximo, self.bordas[-1])]))
+        contagens = np.concatenate(([self.abaixo], self.contagens,
+                                    [self.acima])).astype(np.float64)
+        acumulado = np.concatenate(([0.0], np.cumsum(contagens)))
+        alvo = np.asarray(probabilidades) * acumulado[-1]
+        return pd.Series(np.interp(alvo, acumulado, bordas),
+                         index=probabilidades)
+
+    def histograma(self) -> pd.DataFrame:
+        """Mesmo formato de `graficos.histograma`, sem os valores fora das faixas."""
+        if self.bordas is None:
+            return pd.DataFrame(columns=['inicio', 'fim', 'centro', 'quantidade'])
+        return pd.DataFrame({
+            'inicio': self.bordas[:-1],
+            'fim': self.bordas[1:],
+            'centro': (self.bordas[:-1] + self.bordas[1:]) / 2,
+            'quantidade': self.contagens.copy(),
+        })
+
+
+class CatalogoEstatisticas:
+    """
+    Estatísticas das colunas de `Devedor` de um engine. É montado na primeira
+    leitura e refeito na leitura seguinte a uma invalidação ou a uma mudança
+    de versão da tabela que não passou por `aplicar`.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._lock = threading.RLock()
+        self._colunas: Dict[str, EstatisticaColuna] = {}
+        self._contagens: Dict[str, Counter] = {}
+        self._obsoleto = True
+        self._versao = None
+        # Commits deste processo entre o commit dos dados e o `aplicar`.
+        self._lock_commits = threading.Lock()
+        self._commits_em_andamento = 0
+        self._commits_iniciados = 0
+
+    def _iniciar_commit(self):
+        with self._lock_commits:
+            self._commits_em_andamento += 1
+            self._commits_iniciados += 1
+
+    def _concluir_commit(self):
+        with self._lock_commits:
+            self._commits_em_andamento -= 1
+
+    def _commits(self) -> Tuple[int, int]:
+        with self._lock_commits:
+            return self._commits_em_andamento, self._commits_iniciados
+
+    def _versao_banco(self) -> int:
+        return versao_tabelas(self.engine, Devedor.__tablename__)[0]
+
+    def reconstruir(self):
+        # Lida antes das colunas: um commit no meio muda a versão e força
+        # outra reconstrução, nunca o contrário.
+        em_andamento, iniciados = self._commits()
+        versao = self._versao_banco()
+        with unit_of_work(self.engine, somente_leitura=True) as session:
+            linhas = session.execute(
+                select(*[getattr(Devedor, c)
+                         for c in COLUNAS_CATALOGO])).all()
+        df = pd.DataFrame(linhas, columns=list(COLUNAS_CATALOGO))
+
+        colunas = {
+            c: EstatisticaColuna(
+                pd.to_numeric(df[c], errors='coerce').to_numpy(
+                    dtype=np.float64))
+            for c in COLUNAS_NUMERICAS
+        }
+        colunas.update({
+            c: EstatisticaColuna(_data_para_numero(df[c]))
+            for c in COLUNAS_DATA
+        })
+        contagens = {
+            c: Counter(df[c].dropna().map(_categoria).tolist())
+            for c in COLUNAS_CONTAGEM
+        }
+        with self._lock:
+            self._colunas, self._contagens = colunas, contagens
+            self._versao = versao
+            # Um commit em andamento pode estar nas linhas lidas e ainda
+            # chegar a `aplicar`: esta leitura serve, mas não é incrementada.
+            self._obsoleto = em_andamento > 0 or self._commits()[1] != iniciados
+
+    def invalidar(self):
+        with self._lock:
+            self._obsoleto = True
+
+    def _garantir(self):
+        with self._lock:
+            if self._obsoleto or self._versao != self._versao_banco():
+                self.reconstruir()
+
+    def aplicar(self,
+                alteracoes: Iterable[Tuple[str, object, object]],
+                versao: int = None):
+        """
+        Aplica (coluna, valor anterior, valor novo); `_AUSENTE` de um lado
+        indica inclusão ou exclusão da linha. `versao` é a versão da tabela
+        criada pelo commit: se não for a seguinte à do catálogo, houve
+        commits que ele não viu, e ele fica para reconstrução.
+        """
+        with self._lock:
+            if self._obsoleto:
+                return
+            if versao is not None:
+                if self._versao is None or versao != self._versao + 1:
+                    self._obsoleto = True
+                    return
+                self._versao = versao
+            for coluna, anterior, novo in alteracoes:
+                if coluna in self._colunas:
+                    estatistica = self._colunas[coluna]
+                    converter = (_valor_data if coluna in COLUNAS_DATA else
+                                 _valor_numerico)
+                    if anterior is not _AUSENTE:
+                        estatistica.remover(converter(anterior))
+                    if novo is not _AUSENTE:
+                        estatistica.adicionar(converter(novo))
+                    if (estatistica.fora_das_faixas
+                            or estatistica.extremo_removido):
+                        self._obsoleto = True
+                if coluna in self._contagens:
+                    contagem = self._contagens[coluna]
+                    if anterior is not _AUSENTE and anterior is not None:
+                        contagem[_categoria(anterior)] -= 1
+                    if novo is not _AUSENTE and novo is not None:
+                        contagem[_categoria(novo)] += 1
+
+    def coluna(self, coluna: str) -> EstatisticaColuna:
+        self._garantir()
+        return self._colunas[coluna]
+
+    def faixa(self, coluna: str) -> Optional[Tuple]:
+        """(mínimo, máximo) dos valores não nulos; datas como Timestamp."""
+        estatistica = self.coluna(coluna)
+        if estatistica.validos <= 0:
+            return None
+        if coluna in COLUNAS_DATA:
+            return (_numero_para_data(estatistica.minimo),
+                    _numero_para_data(estatistica.maximo))
+        return estatistica.minimo, estatistica.maximo
+
+    def resumo(self, coluna: str) -> Dict[str, float]:
+        estatistica = self.coluna(coluna)
+        return {
+            'total': estatistica.total,
+            'nulos': estatistica.nulos,
+            'soma': estatistica.soma,
+            'media': estatistica.media,
+            'minimo': estatistica.minimo,
+            'maximo': estatistica.maximo,
+        }
+
+    def quantis(self,
+                coluna: str,
+                probabilidades: Sequence[float] = QUANTIS_PADRAO) -> pd.Series:
+        return self.coluna(coluna).quantis(probabilidades)
+
+    def histograma(self, coluna: str) -> pd.DataFrame:
+        return self.coluna(coluna).histograma()
+
+    def contagens(self, coluna: str) -> Dict[object, int]:
+        """Quantidade por valor, sem os valores que zeraram."""
+        self._garantir()
+        return {
+            valor: quantidade
+            for valor, quantidade in self._contagens[coluna].items()
+            if quantidade > 0
+        }
+
+    def total(self) -> int:
+        self._garantir()
+        return self._colunas[COLUNAS_NUMERICAS[0]].total
+
+
+def _valor_numerico(valor) -> Optional[float]:
+    return None if valor is None else float(valor)
+
+
+def _valor_data(valor) -> Optional[float]:
+    return None if valor is None else float(_data_para_numero([valor])[0])
+
+
+_AUSENTE = object()
+
+_catalogos: Dict[object, CatalogoEstatisticas] = {}
+_lock_catalogos = threading.Lock()
+
+
+def catalogo_estatisticas(engine) -> CatalogoEstatisticas:
+    """O catálogo do engine, criado no primeiro uso."""
+    with _lock_catalogos:
+        catalogo = _catalogos.get(engine)
+        if catalogo is None:
+            catalogo = _catalogos[engine] = CatalogoEstatisticas(engine)
+        return catalogo
+
+
+def invalidar_estatisticas(session: Session):
+    """
+    Marca o catálogo para reconstrução quando a transação for confirmada. Para
+    escritas em `Devedor` que não passam pelo ORM (update/insert em massa).
+    """
+    session.info['estatisticas_invalidas'] = True
+
+
+# Registro das alterações feitas pelo ORM ------------------------------------
+
+
+def _pendentes(session: Session) -> List[Tuple[str, object, object]]:
+    return session.info.setdefault('alteracoes_estatisticas', [])
+
+
+def _valores_carregados(estado) -> Optional[Dict[str, object]]:
+    valores = {}
+    for coluna in COLUNAS_CATALOGO:
+        if coluna not in estado.dict:
+            return None
+        valores[coluna] = estado.dict[coluna]
+    return valores
+
+
+@event.listens_for(Session, 'after_flush')
+def _registrar_alteracoes(session, flush_context):
+    alteracoes = _pendentes(session)
+    for objeto in session.new:
+        if isinstance(objeto, Devedor):
+            alteracoes.extend((coluna, _AUSENTE, getattr(objeto, coluna))
+                              for coluna in COLUNAS_CATALOGO)
+    for objeto in session.deleted:
+        if isinstance(objeto, Devedor):
+            valores = _valores_carregados(inspect(objeto))
+            if valores is None:
+                session.info['estatisticas_invalidas'] = True
+                continue
+            alteracoes.extend(
+                (coluna, valor, _AUSENTE) for coluna, valor in valores.items())
+    for objeto in session.dirty:
+        if not isinstance(objeto, Devedor):
+            continue
+        atributos = inspect(objeto).attrs
+        for coluna in COLUNAS_CATALOGO:
+            historico = atributos[coluna].history
+            if not historico.added:
+                continue
+            if not historico.deleted:
+                # Valor anterior não estava carregado.
+                session.info['estatisticas_invalidas'] = True
+                continue
+            if historico.deleted[0] != historico.added[0]:
+                alteracoes.append(
+                    (coluna, historico.deleted[0], historico.added[0]))
+
+
+@event.listens_for(Session, 'after_transaction_create')
+def _marcar_savepoint(session, transacao):
+    if transacao.nested:
+        marcas = session.info.setdefault('marcas_estatisticas', {})
+        marcas[transacao] = (len(_pendentes(session)),
+                             session.info.get('estatisticas_invalidas', False))
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _descartar_alteracoes(session, transacao_anterior):
+    marca = session.info.get('marcas_estatisticas', {}).pop(
+        transacao_anterior, None)
+    if marca is not None:
+        tamanho, invalidas = marca
+        del _pendentes(session)[tamanho:]
+        session.info['estatisticas_invalidas'] = invalidas
+    elif transacao_anterior.parent is None:
+        _limpar(session)
+
+
+@event.listens_for(Session, 'before_commit')
+def _iniciar_commit(session):
+    # Depois do flush de `database`, que registra as tabelas alteradas.
+    catalogo = _catalogos.get(session.bind)
+    if catalogo is not None and not session.in_nested_transaction() and (
+            Devedor.__tablename__ in session.info.get('tabelas_confirmadas', ())
+            or session.info.get('alteracoes_estatisticas')):
+        catalogo._iniciar_commit()
+        session.info['commit_catalogo'] = catalogo
+
+
+@event.listens_for(Session, 'after_commit')
+def _aplicar_alteracoes(session):
+    if session.in_nested_transaction():
+        # SAVEPOINT: as alterações esperam o commit da transação externa.
+        return
+    catalogo = _catalogos.get(session.bind)
+    if catalogo is not None:
+        versao = session.info.get('versoes_confirmadas',
+                                  {}).get(Devedor.__tablename__)
+        if session.info.get('estatisticas_invalidas'):
+            catalogo.invalidar()
+        elif versao is not None or session.info.get('alteracoes_estatisticas'):
+            catalogo.aplicar(session.info.get('alteracoes_estatisticas', ()),
+                             versao)
+    _limpar(session)
+
+
+def _limpar(session: Session):
+    catalogo = session.info.pop('commit_catalogo', None)
+    if catalogo is not None:
+        catalogo._concluir_commit()
+    for chave in ('alteracoes_estatisticas', 'marcas_estatisticas',
+                  'estatisticas_invalidas'):
+        session.info.pop(chave, None)
@@ -0,0 +1,221 @@
+"""
+Fila de escrita com um único escritor e commit em grupo.
+
+Todas as operações de escrita do processo passam por uma thread escritora por
+banco. Ela junta as operações que chegam em uma janela curta (ou até um número
+máximo) e as executa na mesma transação, cada uma em seu próprio SAVEPOINT, com
+um único commit (e fsync) para o grupo. Quem chamou recebe o resultado da sua
+própria operação: uma operação que falha, ou que retorna (False, ...), desfaz
+só o seu savepoint.
+
+Com um só escritor por processo, as escritas não disputam o lock do SQLite
+entre si. Por isso jobs em massa (importação, conciliação, arquivamento, fila
+do dia) submetem lotes de até LINHAS_POR_OPERACAO linhas, um por operação,
+em vez de segurar o escritor pelo job inteiro.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from typing import Any, Callable, List, NamedTuple
+
+from sqlalchemy.orm import Session
+
+from database import get_session
+
+INTERVALO_GRUPO = 0.02
+MAX_OPERACOES_GRUPO = 100
+# Espera máxima de quem chama por uma escrita (fila + execução + commit).
+TIMEOUT_ESCRITA = 60.0
+# Linhas por operação nos jobs em massa.
+LINHAS_POR_OPERACAO = 2000
+
+
+class EscritaIncerta(TimeoutError):
+    """
+    A escrita passou de TIMEOUT_ESCRITA depois de começar a ser executada:
+    ela ainda pode ser confirmada ou desfeita, e quem chamou não sabe qual.
+    """
+
+
+class _Operacao(NamedTuple):
+    func: Callable
+    args: tuple
+    kwargs: dict
+    futuro: Future
+
+
+def _falhou(resultado: Any) -> bool:
+    return (isinstance(resultado, tuple) and len(resultado) > 0
+            and resultado[0] is False)
+
+
+class FilaEscrita:
+    """
+    Escritor único de um engine. `func(session, *args, **kwargs)` é executada
+    na thread escritora; `executar` bloqueia até o commit do grupo.
+    """
+
+    def __init__(self,
+                 engine,
+                 intervalo: float = INTERVALO_GRUPO,
+                 max_operacoes: int = MAX_OPERACOES_GRUPO):
+        self.engine = engine
+        self.intervalo = intervalo
+        self.max_operacoes = max_operacoes
+        self._fila = queue.Queue()
+        self._sessao_atual = None
+        self._thread = threading.Thread(target=self._loop,
+                                        name='fila-escrita',
+                                        daemon=True)
+        self._thread.start()
+
+    def submeter(self, func: Callable, *args, **kwargs) -> Future:
+        operacao = _Operacao(func, args, kwargs, Future())
+        if threading.current_thread() is self._thread:
+            operacao.futuro.set_running_or_notify_cancel()
+            # Escrita disparada por outra operação do grupo: entra no mesmo
+            # grupo em vez de esperar por ele (o que travaria a fila).
+            self._concluir(operacao,
+                           self._executar_operacao(self._sessao_atual,
+                                                   operacao))
+        else:
+            self._fila.put(operacao)
+        return operacao.futuro
+
+    def executar(self, func: Callable, *args, **kwargs):
+        """
+        Resultado da operação. Se ela não terminar em TIMEOUT_ESCRITA e ainda
+        estiver na fila, é cancelada e levanta TimeoutError (nada foi
+        gravado); se já estiver em execução, levanta EscritaIncerta.
+        """
+        futuro = self.submeter(func, *args, **kwargs)
+        try:
+            return futuro.result(timeout=TIMEOUT_ESCRITA)
+        except FuturesTimeoutError:
+            if futuro.cancel():
+                raise TimeoutError(
+                    f"A escrita não começou em {TIMEOUT_ESCRITA:.0f} s "
+                    "(banco ocupado) e foi cancelada; nada foi gravado."
+                ) from None
+            raise EscritaIncerta(
+                f"A escrita não terminou em {TIMEOUT_ESCRITA:.0f} s e ainda "
+                "pode ser gravada. Recarregue e confira antes de repetir."
+            ) from None
+
+    def _loop(self):
+        while True:
+            grupo = [self._fila.get()]
+            limite = time.monotonic() + self.intervalo
+            while len(grupo) < self.max_operacoes:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    grupo.append(self._fila.get(timeout=restante))
+                except queue.Empty:
+                    break
+            # Operações canceladas por timeout enquanto esperavam ficam de
+            # fora; as demais não podem mais ser canceladas.
+            grupo = [
+                operacao for operacao in grupo
+                if operacao.futuro.set_running_or_notify_cancel()
+            ]
+            if not grupo:
+                continue
+            try:
+                self._executar_grupo(grupo)
+            except Exception as erro:
+                # Falha fora das operações (abrir ou fechar a sessão, o
+                # rollback): a thread continua atendendo a fila e quem
+                # espera recebe o erro em vez de ficar bloqueado.
+                for operacao in grupo:
+                    if not operacao.futuro.done():
+                        operacao.futuro.set_exception(erro)
+
+    def _executar_grupo(self, grupo: List[_Operacao]):
+        session = get_session(self.engine)
+        self._sessao_atual = session
+        try:
+            resultados = [
+                self._executar_operacao(session, operacao)
+                for operacao in grupo
+            ]
+            session.commit()
+        except Exception:
+            # O commit do grupo falhou: cada operação é refeita sozinha, para
+            # que uma falha não seja atribuída às demais.
+            session.rollback()
+            resultados = [self._executar_isolada(op) for op in grupo]
+        finally:
+            self._sessao_atual = None
+            session.close()
+
+        for operacao, resultado in zip(grupo, resultados):
+            self._concluir(operacao, resultado)
+
+    @staticmethod
+    def _executar_operacao(session: Session, operacao: _Operacao):
+        """(resultado, exceção) da operação, isolada em um SAVEPOINT."""
+        savepoint = session.begin_nested()
+        try:
+            resultado = operacao.func(session, *operacao.args,
+                                      **operacao.kwargs)
+            if _falhou(resultado):
+                savepoint.rollback()
+            else:
+                # O flush pendente acontece aqui: um erro nele é desta
+                # operação, não do grupo.
+                savepoint.commit()
+        except Exception as erro:
+            savepoint.rollback()
+            return None, erro
+        return resultado, None
+
+    def _executar_isolada(self, operacao: _Operacao):
+        session = get_session(self.engine)
+        self._sessao_atual = session
+        try:
+            resultado = self._executar_operacao(session, operacao)
+            session.commit()
+            return resultado
+        except Exception as erro:
+            session.rollback()
+            return None, erro
+        finally:
+            self._sessao_atual = None
+            session.close()
+
+    @staticmethod
+    def _concluir(operacao: _Operacao, resultado):
+        valor, erro = resultado
+        if erro is not None:
+            operacao.futuro.set_exception(erro)
+        else:
+            operacao.futuro.set_result(valor)
+
+
+_filas = {}
+_lock_filas = threading.Lock()
+
+
+def fila_escrita(engine) -> FilaEscrita:
+    """A fila de escrita do engine, criada no primeiro uso."""
+    with _lock_filas:
+        fila = _filas.get(engine)
+        if fila is None:
+            fila = _filas[engine] = FilaEscrita(engine)
+        return fila
+
+
+def escrever(db_object, func: Callable, *args, **kwargs):
+    """
+    Executa a escrita `func(session, *args, **kwargs)`. Com um Engine, vai
+    para a fila de escrita dele; com a Session de uma unidade de trabalho
+    externa, roda direto na transação dela. Exceções são propagadas,
+    inclusive TimeoutError / EscritaIncerta (`FilaEscrita.executar`).
+    """
+    if isinstance(db_object, Session):
+        return func(db_object, *args, **kwargs)
+    return fila_escrita(db_object).executar(func, *args, **kwargs)
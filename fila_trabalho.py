@@ -0,0 +1,259 @@
+"""
+Fila de trabalho diária ("Ações de Cobrança").
+
+Os devedores que exigem ação no dia são materializados uma vez (job noturno
+ou primeiro acesso do dia) na tabela `fila_trabalho`, já com as chaves de
+ordenação e a prioridade (posição pelo score de `priorizacao`). As ações do dia atualizam a fila incrementalmente.
+
+Uso headless: python fila_trabalho.py
+"""
+from datetime import date, datetime
+from typing import List, Union
+
+from sqlalchemy import (Date, Select, and_, delete, exists, func, insert,
+                        literal, or_, select, true, update)
+from sqlalchemy.orm import Session
+
+from database import (Devedor, ExecucaoFilaTrabalho, ItemFilaTrabalho,
+                      StatusDevedor, init_db, unit_of_work)
+from dialeto import mesmo_dia, upsert
+from envelhecimento import envelhecer_atrasos
+from fila_escrita import LINHAS_POR_OPERACAO, escrever
+from priorizacao import atualizar_scores, limpar_scores_pagos
+
+# Limite de parâmetros por instrução do SQLite
+_TAMANHO_LOTE = 900
+
+_COLUNAS_COPIADAS = [
+    'pessoa', 'nome', 'valortotal', 'atraso', 'telefone', 'data_cobranca',
+    'ultima_cobranca', 'status', 'data_pagamento', 'fase_cobranca',
+    'score_prioridade', 'versao'
+]
+
+
+def predicado_acao(hoje: date):
+    """Devedores não pagos agendados para hoje ou que ainda não foram agendados."""
+    nao_pago = Devedor.status != StatusDevedor.PAGO.value
+    agendado_para_hoje = (Devedor.status == StatusDevedor.AGENDADO.value) & (
+        mesmo_dia(Devedor.data_cobranca, hoje))
+    requer_acao = Devedor.status != StatusDevedor.AGENDADO.value
+    return nao_pago & or_(agendado_para_hoje, requer_acao)
+
+
+def _ordem_prioridade():
+    return (func.coalesce(Devedor.score_prioridade, -1).desc(), Devedor.id)
+
+
+def _score_fila():
+    return func.coalesce(ItemFilaTrabalho.score_prioridade, -1)
+
+
+def _ordem_fila():
+    return (_score_fila().desc(), ItemFilaTrabalho.devedor_id)
+
+
+def _select_fila(hoje: date, prioridade_base: int = 0, devedor_ids=None):
+    prioridade = func.row_number().over(
+        order_by=_ordem_prioridade()) + prioridade_base
+    query = select(Devedor.id, *[getattr(Devedor, c) for c in _COLUNAS_COPIADAS],
+                   prioridade, literal(hoje, Date)).where(predicado_acao(hoje))
+    if devedor_ids is not None:
+        query = query.where(Devedor.id.in_(devedor_ids))
+    return query
+
+
+def _insert_fila(hoje: date, prioridade_base: int = 0, devedor_ids=None):
+    colunas = ['devedor_id'] + _COLUNAS_COPIADAS + ['prioridade', 'data_referencia']
+    return insert(ItemFilaTrabalho).from_select(
+        colunas, _select_fila(hoje, prioridade_base, devedor_ids))
+
+
+def fila_materializada(session: Session, hoje: date = None) -> bool:
+    hoje = hoje or date.today()
+    return session.get(ExecucaoFilaTrabalho, hoje) is not None
+
+
+def materializar_fila_do_dia(db_engine,
+                             hoje: date = None,
+                             tamanho_lote: int = LINHAS_POR_OPERACAO) -> int:
+    """
+    Envelhece os atrasos, recalcula os scores e recria a fila de trabalho do
+    dia, pela fila de escrita, em lotes de até `tamanho_lote` devedores, cada
+    um uma operação da fila: as ações dos agentes entram entre os lotes em
+    vez de esperar a carteira inteira. Pode ser executada várias vezes no
+    mesmo dia (idempotente).
+
+    A fila já conta como materializada a partir de `_iniciar_fila`: ações
+    durante a recriação atualizam a fila incrementalmente, e quem a lê vê os
+    itens antigos sendo trocados pelos novos, lote a lote.
+    """
+    hoje = hoje or date.today()
+    ultimo_id = 0
+    while ultimo_id is not None:
+        ultimo_id = escrever(db_engine, _preparar_lote, ultimo_id,
+                             tamanho_lote, hoje)
+
+    escrever(db_engine, _iniciar_fila, hoje)
+    # A ordem é lida fora do escritor; cada lote grava uma faixa contínua
+    # dela, com as prioridades da faixa.
+    with unit_of_work(db_engine, somente_leitura=True) as session:
+        ordem = session.execute(
+            select(Devedor.id).where(predicado_acao(hoje)).order_by(
+                *_ordem_prioridade())).scalars().all()
+    for inicio in range(0, len(ordem), tamanho_lote):
+        escrever(db_engine, _gravar_lote_fila,
+                 ordem[inicio:inicio + tamanho_lote], inicio, hoje)
+    return escrever(db_engine, _concluir_fila, hoje)
+
+
+def _preparar_lote(session: Session, ultimo_id: int, tamanho_lote: int,
+                   hoje: date):
+    """
+    Envelhece e pontua os próximos `tamanho_lote` devedores em aberto depois
+    de `ultimo_id`. Retorna o último ID do lote, ou None no último lote.
+    """
+    ids = session.execute(
+        select(Devedor.id).where(
+            Devedor.id > ultimo_id,
+            Devedor.status != StatusDevedor.PAGO).order_by(
+                Devedor.id).limit(tamanho_lote)).scalars().all()
+    if ids:
+        envelhecer_atrasos(session, hoje, faixa_ids=(ids[0], ids[-1]))
+        atualizar_scores(session, ids, hoje)
+    return ids[-1] if len(ids) == tamanho_lote else None
+
+
+def _registrar_execucao(session: Session, hoje: date, total: int) -> None:
+    session.execute(
+        delete(ExecucaoFilaTrabalho).where(
+            ExecucaoFilaTrabalho.data_referencia != hoje))
+    upsert(session, ExecucaoFilaTrabalho, [{
+        'data_referencia': hoje,
+        'gerada_em': datetime.now(),
+        'total': total
+    }], chaves=['data_referencia'])
+
+
+def _contar_fila(session: Session) -> int:
+    return session.query(func.count(ItemFilaTrabalho.devedor_id)).scalar()
+
+
+def _iniciar_fila(session: Session, hoje: date) -> None:
+    limpar_scores_pagos(session)
+    _registrar_execucao(session, hoje, _contar_fila(session))
+
+
+def _gravar_lote_fila(session: Session, devedor_ids: List[int],
+                      posicao_inicial: int, hoje: date) -> None:
+    """Troca os itens dos devedores, que ocupam posições a partir de `posicao_inicial`."""
+    for i in range(0, len(devedor_ids), _TAMANHO_LOTE):
+        lote = devedor_ids[i:i + _TAMANHO_LOTE]
+        session.execute(
+            delete(ItemFilaTrabalho).where(
+                ItemFilaTrabalho.devedor_id.in_(lote)))
+        session.execute(
+            _insert_fila(hoje, posicao_inicial + i, devedor_ids=lote))
+
+
+def _concluir_fila(session: Session, hoje: date) -> int:
+    """
+    Remove os itens de devedores que não exigem mais ação (da fila anterior
+    ou alterados durante a recriação) e corrige prioridades fora de ordem.
+    """
+    session.execute(
+        delete(ItemFilaTrabalho).where(~exists().where(
+            Devedor.id == ItemFilaTrabalho.devedor_id,
+            predicado_acao(hoje))).execution_options(
+                synchronize_session=False))
+    _renumerar_a_partir_de(session)
+    total = _contar_fila(session)
+    _registrar_execucao(session, hoje, total)
+    return total
+
+
+def garantir_fila_do_dia(db_engine, hoje: date = None) -> None:
+    """
+    Materializa a fila se o job noturno ainda não rodou hoje. Chamada na
+    entrada das páginas e ações, nunca nas consultas (que podem rodar na
+    pré-carga): leituras não escrevem.
+    """
+    hoje = hoje or date.today()
+    with unit_of_work(db_engine, somente_leitura=True) as session:
+        if fila_materializada(session, hoje):
+            return
+    materializar_fila_do_dia(db_engine, hoje)
+
+
+def atualizar_fila(session: Session, devedor_ids: Union[List[int], Select],
+                   hoje: date = None) -> None:
+    """
+    Atualiza incrementalmente a fila para os devedores alterados na sessão.
+    Devedores que deixaram de exigir ação saem da fila; os demais voltam na
+    posição do seu score atual, e os itens dali em diante são renumerados.
+    `devedor_ids` pode ser um SELECT dos IDs (ex.: de uma tabela temporária),
+    tratado de uma vez em vez de em lotes de IDs. Não faz commit.
+    """
+    hoje = hoje or date.today()
+    if isinstance(devedor_ids, Select):
+        lotes = [devedor_ids]
+    else:
+        devedor_ids = list(devedor_ids or [])
+        lotes = [
+            devedor_ids[i:i + _TAMANHO_LOTE]
+            for i in range(0, len(devedor_ids), _TAMANHO_LOTE)
+        ]
+    if not lotes or not fila_materializada(session, hoje):
+        return
+
+    session.flush()
+    primeiros = []
+    for lote in lotes:
+        session.execute(
+            delete(ItemFilaTrabalho).where(
+                ItemFilaTrabalho.devedor_id.in_(lote)))
+        session.execute(_insert_fila(hoje, devedor_ids=lote))
+        primeiro = session.execute(
+            select(_score_fila(), ItemFilaTrabalho.devedor_id).where(
+                ItemFilaTrabalho.devedor_id.in_(lote)).order_by(
+                    *_ordem_fila()).limit(1)).first()
+        if primeiro is not None:
+            primeiros.append(primeiro)
+    if primeiros:
+        # Maior score e, no empate, menor id: o primeiro na ordem da fila.
+        _renumerar_a_partir_de(
+            session, *min(primeiros, key=lambda p: (-p[0], p[1])))
+
+
+def _renumerar_a_partir_de(session: Session, score_inicial: float = None,
+                           id_inicial: int = None) -> None:
+    """
+    Refaz a prioridade, pela ordem do score, dos itens da fila a partir da
+    posição de (`score_inicial`, `id_inicial`), ou de todos sem posição; os
+    anteriores não mudam. Só são gravados os itens cuja prioridade muda.
+    """
+    score = _score_fila()
+    if score_inicial is None:
+        a_partir = true()
+    else:
+        a_partir = or_(
+            score < score_inicial,
+            and_(score == score_inicial,
+                 ItemFilaTrabalho.devedor_id >= id_inicial))
+    anterior = session.query(
+        func.coalesce(func.max(ItemFilaTrabalho.prioridade),
+                      0)).filter(~a_partir).scalar()
+    posicoes = select(
+        ItemFilaTrabalho.devedor_id,
+        (func.row_number().over(order_by=_ordem_fila()) +
+         anterior).label('prioridade')).where(a_partir).subquery()
+    session.execute(
+        update(ItemFilaTrabalho).where(
+            ItemFilaTrabalho.devedor_id == posicoes.c.devedor_id,
+            ItemFilaTrabalho.prioridade != posicoes.c.prioridade).values(
+                prioridade=posicoes.c.prioridade).execution_options(
+                    synchronize_session=False))
+
+
+if __name__ == "__main__":
+    total = materializar_fila_do_dia(init_db())
+    print(f"Fila de trabalho de {date.today():%d/%m/%Y} gerada com {total} devedor(es).")
@@ -0,0 +1,120 @@
+"""
+Dados agregados para gráficos.
+
+Os dashboards entregam ao plotly/Streamlit apenas os pontos já agregados no
+servidor (faixas de histograma, faixas de atraso, quantis e séries reduzidas
+por LTTB), de modo que o volume enviado ao navegador não cresce com a carteira.
+"""
+from typing import Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+FAIXAS_ATRASO = (0, 16, 31, 61, 91, 181, 366)
+ROTULOS_FAIXAS_ATRASO = ('0-15', '16-30', '31-60', '61-90', '91-180',
+                         '181-365', '365+')
+QUANTIS_PADRAO = (0.25, 0.5, 0.75, 0.9, 0.99)
+LIMITE_PONTOS_SERIE = 500
+
+
+def _numeros(valores) -> np.ndarray:
+    valores = np.asarray(pd.to_numeric(pd.Series(valores), errors='coerce'),
+                         dtype=np.float64)
+    return valores[~np.isnan(valores)]
+
+
+def histograma(valores, bins: int = 20) -> pd.DataFrame:
+    """Contagem por faixa de mesma largura (np.histogram), ignorando nulos."""
+    valores = _numeros(valores)
+    if len(valores) == 0:
+        return pd.DataFrame(columns=['inicio', 'fim', 'centro', 'quantidade'])
+    contagens, bordas = np.histogram(valores, bins=bins)
+    return pd.DataFrame({
+        'inicio': bordas[:-1],
+        'fim': bordas[1:],
+        'centro': (bordas[:-1] + bordas[1:]) / 2,
+        'quantidade': contagens,
+    })
+
+
+def quantis(valores,
+            probabilidades: Sequence[float] = QUANTIS_PADRAO) -> pd.Series:
+    """Quantis dos valores não nulos, indexados pela probabilidade."""
+    valores = _numeros(valores)
+    if len(valores) == 0:
+        return pd.Series(np.nan, index=list(probabilidades))
+    return pd.Series(np.quantile(valores, probabilidades),
+                     index=list(probabilidades))
+
+
+def por_faixa_atraso(atraso, valortotal=None) -> pd.DataFrame:
+    """
+    Quantidade de devedores (e soma de valortotal, se informado) por faixa
+    de dias em atraso. Todas as faixas aparecem, mesmo vazias.
+    """
+    atraso = np.asarray(pd.to_numeric(pd.Series(atraso), errors='coerce'),
+                        dtype=np.float64)
+    validos = ~np.isnan(atraso)
+    faixas = np.digitize(atraso[validos], FAIXAS_ATRASO[1:])
+    total_faixas = len(ROTULOS_FAIXAS_ATRASO)
+    resultado = pd.DataFrame({
+        'faixa': pd.Categorical(ROTULOS_FAIXAS_ATRASO,
+                                categories=ROTULOS_FAIXAS_ATRASO,
+                                ordered=True),
+        'quantidade': np.bincount(faixas, minlength=total_faixas),
+    })
+    if valortotal is not None:
+        valores = np.nan_to_num(
+            np.asarray(valortotal, dtype=np.float64)[validos])
+        resultado['valortotal'] = np.bincount(faixas,
+                                              weights=valores,
+                                              minlength=total_faixas)
+    return resultado
+
+
+def soma_por_inteiro(chaves, valores) -> pd.Series:
+    """
+    Soma de `valores` por chave inteira não negativa (ex.: dias de atraso),
+    com np.bincount em vez de groupby. Chaves sem valores ficam de fora.
+    """
+    chaves = np.asarray(pd.to_numeric(pd.Series(chaves), errors='coerce'),
+                        dtype=np.float64)
+    validos = ~np.isnan(chaves) & (chaves >= 0)
+    chaves = chaves[validos].astype(np.int64)
+    if len(chaves) == 0:
+        return pd.Series(dtype=np.float64)
+    valores = np.nan_to_num(np.asarray(valores, dtype=np.float64)[validos])
+    somas = np.bincount(chaves, weights=valores)
+    presentes = np.flatnonzero(np.bincount(chaves))
+    return pd.Series(somas[presentes], index=presentes)
+
+
+def lttb(x, y, limite: int = LIMITE_PONTOS_SERIE) -> Tuple[np.ndarray,
+                                                          np.ndarray]:
+    """
+    Reduz uma série ordenada por x a `limite` pontos com o algoritmo
+    Largest-Triangle-Three-Buckets, que preserva picos e vales.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if limite >= n or limite < 3:
+        return x, y
+
+    indices = np.empty(limite, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    # Baldes internos: os pontos 1..n-2 divididos em limite-2 partes.
+    bordas = np.linspace(1, n - 1, limite - 1).astype(np.int64)
+    anterior = 0
+    for i in range(limite - 2):
+        inicio, fim = bordas[i], bordas[i + 1]
+        if i + 2 < limite - 1:
+            proximo = slice(bordas[i + 1], bordas[i + 2])
+            media_x, media_y = x[proximo].mean(), y[proximo].mean()
+        else:
+            media_x, media_y = x[-1], y[-1]
+        areas = np.abs((x[anterior] - media_x) * (y[inicio:fim] - y[anterior]) -
+                       (x[anterior] - x[inicio:fim]) * (media_y - y[anterior]))
+        anterior = inicio + int(np.argmax(areas))
+        indices[i + 1] = anterior
+    return x[indices], y[indices]
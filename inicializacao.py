@@ -0,0 +1,114 @@
+"""
+Inicialização sob demanda e perfil de inicialização.
+
+- `modulo_sob_demanda` adia a execução de módulos pesados (ex.: plotly) até o
+  primeiro uso de um atributo.
+- Com COBRANCAS_DEBUG_INICIALIZACAO=1, as etapas medidas com `medir` e o
+  tempo de importação de cada módulo (`python -X importtime`) aparecem na
+  barra lateral das páginas.
+
+Uso headless: python inicializacao.py [modulo ...]
+"""
+import importlib.util
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import List, Tuple
+
+DEBUG_INICIALIZACAO = os.environ.get('COBRANCAS_DEBUG_INICIALIZACAO') == '1'
+
+MODULOS_PADRAO = ('streamlit', 'pandas', 'numpy', 'sqlalchemy',
+                  'plotly.express', 'devedores_service')
+
+_INICIO_PROCESSO = time.perf_counter()
+_etapas: List[Tuple[str, float]] = []
+_lock_etapas = threading.Lock()
+
+
+def modulo_sob_demanda(nome: str):
+    """
+    O módulo `nome`, carregado só quando um atributo dele for acessado
+    (importlib.util.LazyLoader). Se já estiver importado, devolve o próprio.
+    """
+    if nome in sys.modules:
+        return sys.modules[nome]
+    spec = importlib.util.find_spec(nome)
+    if spec is None:
+        raise ImportError(f"Módulo {nome} não encontrado.")
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules[nome] = modulo
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+@contextmanager
+def medir(etapa: str):
+    """Registra a duração de uma etapa de inicialização do processo."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock_etapas:
+            _etapas.append((etapa, time.perf_counter() - inicio))
+
+
+def etapas_medidas() -> List[Tuple[str, float]]:
+    with _lock_etapas:
+        return list(_etapas)
+
+
+_LINHA_IMPORTTIME = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+@lru_cache(maxsize=8)
+def perfil_importacao(modulos: Tuple[str, ...] = MODULOS_PADRAO,
+                      limite: int = 20) -> List[Tuple[str, float, float]]:
+    """
+    (módulo, tempo próprio ms, tempo acumulado ms) dos `limite` módulos mais
+    lentos ao importar `modulos` em um interpretador novo.
+    """
+    codigo = '; '.join(f'import {m}' for m in modulos)
+    processo = subprocess.run([sys.executable, '-X', 'importtime', '-c', codigo],
+                              capture_output=True,
+                              text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+    linhas = []
+    for linha in processo.stderr.splitlines():
+        encontrado = _LINHA_IMPORTTIME.match(linha)
+        if encontrado:
+            proprio, acumulado, _, modulo = encontrado.groups()
+            linhas.append((modulo, int(proprio) / 1000, int(acumulado) / 1000))
+    linhas.sort(key=lambda l: l[2], reverse=True)
+    return linhas[:limite]
+
+
+def exibir_perfil_inicializacao(modulos: Tuple[str, ...] = MODULOS_PADRAO):
+    """Expander na barra lateral com o perfil; só com a flag de depuração."""
+    if not DEBUG_INICIALIZACAO:
+        return
+    import pandas as pd
+    import streamlit as st
+
+    with st.sidebar.expander("⏱️ Perfil de inicialização"):
+        st.caption(f"Processo iniciado há "
+                   f"{time.perf_counter() - _INICIO_PROCESSO:.1f} s")
+        etapas = etapas_medidas()
+        if etapas:
+            st.dataframe(pd.DataFrame(etapas, columns=['etapa', 's']),
+                         hide_index=True)
+        st.dataframe(pd.DataFrame(perfil_importacao(tuple(modulos)),
+                                  columns=['módulo', 'próprio ms',
+                                           'acumulado ms']),
+                     hide_index=True)
+
+
+if __name__ == "__main__":
+    for modulo, proprio, acumulado in perfil_importacao(
+            tuple(sys.argv[1:]) or MODULOS_PADRAO):
+        print(f"{acumulado:9.1f} ms {proprio:9.1f} ms  {modulo}")
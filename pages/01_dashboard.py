@@ -1,7 +1,6 @@
 import streamlit as st
-import pandas as pd
-from datetime import datetime
-import numpy as np
+
+from inicializacao import exibir_perfil_inicializacao
 
 if 'df' not in st.session_state:
     st.session_state.df = None
@@ -10,14 +9,14 @@ if 'filtered_df' not in st.session_state:
 
 
 def load_excel(file):
+    # pandas só é carregado quando há uma planilha: a primeira renderização
+    # (só o upload) não precisa dele.
+    from planilhas import ler_planilha
     try:
-        return pd.read_excel(file, engine='openpyxl')
-    except:
-        try:
-            return pd.read_excel(file, engine='xlrd')
-        except Exception as e:
-            st.error(f"Erro ao ler o arquivo: {e}")
-            return None
+        return ler_planilha(file.getvalue(), file.name)
+    except Exception as e:
+        st.error(f"Erro ao ler o arquivo: {e}")
+        return None
 
 
 def sidebar():
@@ -27,10 +26,12 @@ def sidebar():
                                              key="file_uploader")
 
     if uploaded_file is not None:
-        st.session_state.df = load_excel(uploaded_file)
-        if st.session_state.df is not None:
+        df = load_excel(uploaded_file)
+        if df is not None:
             st.sidebar.success("Arquivo carregado com sucesso!")
-            st.session_state.filtered_df = st.session_state.df.copy()
+            if df is not st.session_state.df:
+                st.session_state.filtered_df = df
+        st.session_state.df = df
 
 
 def main():
@@ -42,6 +43,9 @@ def main():
     sidebar()
 
     if st.session_state.filtered_df is not None:
+        import pandas as pd
+        from graficos import lttb, por_faixa_atraso, soma_por_inteiro
+
         st.header("Resumo Geral")
         col1, col2, col3, col4 = st.columns(4)
         col1.metric("Total Devedores", len(st.session_state.filtered_df))
@@ -61,14 +65,16 @@ def main():
 
         with tab1:
             st.subheader("Dias em Atraso")
-            st.bar_chart(st.session_state.filtered_df['atraso'].value_counts().
-                         sort_index(),
-                         height=400)
+            faixas = por_faixa_atraso(st.session_state.filtered_df['atraso'])
+            st.bar_chart(faixas.set_index('faixa')['quantidade'], height=400)
 
         with tab2:
             st.subheader("Valores Devidos")
-            st.area_chart(st.session_state.filtered_df.groupby('atraso')
-                          ['valortotal'].sum(),
+            por_atraso = soma_por_inteiro(
+                st.session_state.filtered_df['atraso'],
+                st.session_state.filtered_df['valortotal'])
+            x, y = lttb(por_atraso.index, por_atraso.to_numpy())
+            st.area_chart(pd.Series(y, index=x.astype(int), name='valortotal'),
                           height=400)
 
         st.header("Top 10 Maiores Devedores")
@@ -79,6 +85,7 @@ def main():
     else:
         st.warning(
             "Nenhum dado disponível. Carregue um arquivo Excel na sidebar.")
+    exibir_perfil_inicializacao()
 
 
 if __name__ == "__main__":
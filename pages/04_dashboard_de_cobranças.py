@@ -1,28 +1,47 @@
-import plotly.express as px
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta, date
-from database import Devedor, get_session, init_db
-from sqlalchemy.orm import Session
-
-engine = init_db()
-session: Session = get_session(engine)
-
-def carregar_dados_devedores():
-    devedores = session.query(Devedor).all()
-    df = pd.DataFrame([{
-        "id": d.id,
-        "pessoa": d.pessoa,
-        "nome": d.nome,
-        "valortotal": d.valortotal,
-        "atraso": d.atraso,
-        "telefone": d.telefone,
-        "data_cobranca": d.data_cobranca,
-        "ultima_cobranca": d.ultima_cobranca,
-        "status": d.status.value,
-        "data_pagamento": d.data_pagamento,
-        "fase_cobranca": d.fase_cobranca
-    } for d in devedores])
+from sqlalchemy import String, select, type_coerce
+
+from cache_consultas import em_cache
+from database import (Devedor, StatusDevedor, devedores_historico, init_db,
+                      unit_of_work)
+from devedores_service import (get_devedores_por_score_count,
+                               get_devedores_por_score_paginated)
+from estatisticas import catalogo_estatisticas
+from graficos import histograma, quantis
+from inicializacao import exibir_perfil_inicializacao, modulo_sob_demanda
+from priorizacao import PESOS_PADRAO, calcular_scores, top_k
+
+px = modulo_sob_demanda('plotly.express')
+
+
+def obter_engine():
+    return st.session_state.get('db_engine') or init_db()
+
+
+TAMANHO_PAGINA_RANKING = 20
+
+COLUNAS_DASHBOARD = [
+    'id', 'pessoa', 'nome', 'valortotal', 'atraso', 'telefone',
+    'data_cobranca', 'ultima_cobranca', 'status', 'data_pagamento',
+    'fase_cobranca'
+]
+
+
+@em_cache(tabelas=('devedores', 'devedores_arquivados'))
+def carregar_dados_devedores(db_engine, incluir_arquivados: bool = False):
+    """
+    Carteira ativa ou, com `incluir_arquivados`, a visão histórica. Só vai ao
+    banco quando uma das tabelas muda; os demais reruns leem do cache.
+    """
+    origem = devedores_historico if incluir_arquivados else Devedor.__table__
+    colunas = [
+        type_coerce(origem.c[c], String).label(c) if c == 'status' else
+        origem.c[c] for c in COLUNAS_DASHBOARD
+    ]
+    with unit_of_work(db_engine, somente_leitura=True) as session:
+        df = pd.read_sql(select(*colunas), session.connection())
 
     for col in ['data_cobranca', 'ultima_cobranca', 'data_pagamento']:
         df[col] = pd.to_datetime(df[col], errors='coerce')
@@ -30,10 +49,132 @@ def carregar_dados_devedores():
     return df
 
 
+def exibir_top_prioridades(df_filtrado):
+    st.subheader("🎯 Maiores Prioridades")
+    df_abertos = df_filtrado[df_filtrado['status'] != "PAGO"]
+    if df_abertos.empty:
+        st.info("Nenhum devedor em aberto com os filtros atuais.")
+        return
+
+    with st.expander("Pesos do score de prioridade"):
+        c1, c2, c3, c4, c5 = st.columns(5)
+        pesos = {
+            'valortotal':
+            c1.slider("Valor", 0.0, 1.0, PESOS_PADRAO['valortotal'], 0.05),
+            'atraso':
+            c2.slider("Atraso", 0.0, 1.0, PESOS_PADRAO['atraso'], 0.05),
+            'fase_cobranca':
+            c3.slider("Fase", 0.0, 1.0, PESOS_PADRAO['fase_cobranca'], 0.05),
+            'dias_sem_contato':
+            c4.slider("Dias sem contato", 0.0, 1.0,
+                      PESOS_PADRAO['dias_sem_contato'], 0.05),
+        }
+        k = c5.number_input("Quantidade", min_value=1, value=20, step=5)
+
+    if sum(pesos.values()) <= 0:
+        st.warning("Defina ao menos um peso maior que zero.")
+        return
+
+    scores = calcular_scores(df_abertos['valortotal'].to_numpy(),
+                             df_abertos['atraso'].to_numpy(),
+                             df_abertos['fase_cobranca'].to_numpy(),
+                             df_abertos['ultima_cobranca'],
+                             pesos=pesos)
+    indices = top_k(scores, int(k))
+    df_top = df_abertos.iloc[indices][[
+        'nome', 'valortotal', 'atraso', 'fase_cobranca', 'ultima_cobranca'
+    ]].copy()
+    df_top.insert(0, 'score', scores[indices].round(1))
+    st.dataframe(df_top,
+                 use_container_width=True,
+                 hide_index=True,
+                 column_config={
+                     "score": "Score",
+                     "nome": "Nome",
+                     "valortotal": st.column_config.NumberColumn(
+                         "Valor", format="R$ %.2f"),
+                     "atraso": "Atraso (dias)",
+                     "fase_cobranca": "Fase",
+                     "ultima_cobranca": st.column_config.DateColumn(
+                         "Últ. Cobrança", format="DD/MM/YYYY")
+                 })
+
+
+def exibir_ranking_carteira():
+    """
+    Ranking da carteira inteira pelo score salvo (pesos padrão), paginado no
+    banco pelo índice do score, sem carregar nem pontuar a carteira.
+    """
+    st.subheader("🏆 Ranking da Carteira por Prioridade")
+    total = get_devedores_por_score_count(obter_engine())
+    if total == 0:
+        st.info("Nenhum devedor em aberto com score calculado.")
+        return
+    total_paginas = -(-total // TAMANHO_PAGINA_RANKING)
+    pagina = st.session_state.get('pagina_ranking', 0)
+    pagina = max(0, min(pagina, total_paginas - 1))
+
+    df_pagina = get_devedores_por_score_paginated(obter_engine(), pagina,
+                                                  TAMANHO_PAGINA_RANKING)
+    df_pagina.insert(
+        0, 'posicao',
+        range(pagina * TAMANHO_PAGINA_RANKING + 1,
+              pagina * TAMANHO_PAGINA_RANKING + len(df_pagina) + 1))
+    df_pagina['score_prioridade'] = df_pagina['score_prioridade'].round(1)
+    st.dataframe(df_pagina.drop(columns='id'),
+                 use_container_width=True,
+                 hide_index=True,
+                 column_config={
+                     "posicao": "#",
+                     "score_prioridade": "Score",
+                     "nome": "Nome",
+                     "valortotal": st.column_config.NumberColumn(
+                         "Valor", format="R$ %.2f"),
+                     "atraso": "Atraso (dias)",
+                     "fase_cobranca": "Fase",
+                     "ultima_cobranca": st.column_config.DateColumn(
+                         "Últ. Cobrança", format="DD/MM/YYYY")
+                 })
+
+    col1, col2, col3 = st.columns([1, 2, 1])
+    if col1.button("⬅️ Anterior",
+                   key="ranking_anterior",
+                   use_container_width=True,
+                   disabled=pagina == 0):
+        st.session_state.pagina_ranking = pagina - 1
+        st.rerun()
+    col2.caption(f"Página {pagina + 1} de {total_paginas} · {total} devedores")
+    if col3.button("Próxima ➡️",
+                   key="ranking_proxima",
+                   use_container_width=True,
+                   disabled=pagina >= total_paginas - 1):
+        st.session_state.pagina_ranking = pagina + 1
+        st.rerun()
+
+
+def exibir_resumo_carteira(catalogo):
+    """Métricas da carteira inteira, lidas do catálogo de estatísticas."""
+    valores = catalogo.resumo('valortotal')
+    atraso = catalogo.resumo('atraso')
+    total = catalogo.total()
+    pagos = catalogo.contagens('status').get("PAGO", 0)
+    st.caption(
+        f"Carteira completa: {total} devedores · R$ {valores['soma']:,.2f}"
+        + (f" · atraso médio {atraso['media']:.1f} dias"
+           if not pd.isna(atraso['media']) else "")
+        + (f" · {100 * pagos / total:.1f}% pagos" if total else ""))
+
+
 def exibir_dashboard_estatisticas_tab():
     st.header("📊 Dashboard de Estatísticas de Cobranças")
 
-    df = carregar_dados_devedores()
+    catalogo = catalogo_estatisticas(obter_engine())
+    exibir_resumo_carteira(catalogo)
+
+    incluir_arquivados = st.toggle(
+        "Incluir devedores arquivados (pagos antigos)",
+        help="Consulta a visão histórica, mais lenta que a carteira ativa.")
+    df = carregar_dados_devedores(obter_engine(), incluir_arquivados)
     if df.empty:
         st.info(
             "Nenhum devedor encontrado no sistema para gerar estatísticas.")
@@ -43,19 +184,29 @@ def exibir_dashboard_estatisticas_tab():
     col1, col2, col3 = st.columns(3)
 
     with col1:
-        status_options = ["Todos"] + sorted(df['status'].dropna().unique())
+        status = set(catalogo.contagens('status'))
+        if incluir_arquivados:
+            status.add(StatusDevedor.PAGO.value)
+        status_options = ["Todos"] + sorted(status)
         selected_status = st.selectbox("Status", options=status_options)
 
     with col2:
-        min_date = df['data_cobranca'].min().date() if pd.notna(
-            df['data_cobranca'].min()) else date.today() - timedelta(days=180)
-        max_date = df['data_cobranca'].max().date() if pd.notna(
-            df['data_cobranca'].max()) else date.today()
+        if incluir_arquivados:
+            # O catálogo cobre só a carteira ativa.
+            datas = df['data_cobranca'].dropna()
+            faixa_datas = (datas.min(), datas.max()) if len(datas) else None
+        else:
+            faixa_datas = catalogo.faixa('data_cobranca')
+        if faixa_datas is None:
+            min_date = date.today() - timedelta(days=180)
+            max_date = date.today()
+        else:
+            min_date, max_date = (d.date() for d in faixa_datas)
         date_range = st.date_input("Período (Data da próxima cobrança)",
                                    [min_date, max_date])
 
     with col3:
-        fases = sorted(df['fase_cobranca'].dropna().unique())
+        fases = sorted(catalogo.contagens('fase_cobranca'))
         fase_options = ["Todas"] + fases
         selected_fase = st.selectbox("Fase de Cobrança", options=fase_options)
 
@@ -111,11 +262,10 @@ def exibir_dashboard_estatisticas_tab():
 
     with tab2:
         if df_filtrado['data_cobranca'].notna().any():
-            df_temporal = df_filtrado.copy()
-            df_temporal['mes_ano'] = df_temporal['data_cobranca'].dt.to_period(
-                "M").astype(str)
-            evolucao = df_temporal.groupby(['mes_ano', 'status'
-                                            ]).size().unstack().fillna(0)
+            evolucao = df_filtrado.groupby([
+                df_filtrado['data_cobranca'].dt.to_period("M").astype(
+                    str).rename('mes_ano'), 'status'
+            ]).size().unstack().fillna(0)
             fig_evolucao = px.line(evolucao,
                                    labels={
                                        "value": "Quantidade",
@@ -132,12 +282,23 @@ def exibir_dashboard_estatisticas_tab():
         col1, col2 = st.columns(2)
 
         with col1:
-            fig_valores = px.histogram(df_filtrado,
-                                       x="valortotal",
-                                       nbins=20,
-                                       title="Distribuição de Valores Devidos",
-                                       labels={"valortotal": "Valor (R$)"})
+            faixas_valor = histograma(df_filtrado['valortotal'], bins=20)
+            fig_valores = px.bar(faixas_valor,
+                                 x="centro",
+                                 y="quantidade",
+                                 hover_data=["inicio", "fim"],
+                                 title="Distribuição de Valores Devidos",
+                                 labels={
+                                     "centro": "Valor (R$)",
+                                     "quantidade": "Quantidade"
+                                 })
+            fig_valores.update_traces(width=(
+                faixas_valor['fim'] - faixas_valor['inicio']).tolist())
             st.plotly_chart(fig_valores, use_container_width=True)
+            q = quantis(df_filtrado['valortotal'], (0.5, 0.9, 0.99))
+            if q.notna().all():
+                st.caption(f"Mediana: R$ {q[0.5]:,.2f} · P90: R$ {q[0.9]:,.2f}"
+                           f" · P99: R$ {q[0.99]:,.2f}")
 
         with col2:
             fase_counts = df_filtrado['fase_cobranca'].value_counts(
@@ -149,6 +310,9 @@ def exibir_dashboard_estatisticas_tab():
                               title="Distribuição por Fase de Cobrança")
             st.plotly_chart(fig_fase, use_container_width=True)
 
+    exibir_top_prioridades(df_filtrado)
+    exibir_ranking_carteira()
+
     st.subheader("📋 Tabela de Devedores")
     cols = [
         'id', 'nome', 'status', 'fase_cobranca', 'valortotal', 'atraso',
@@ -180,3 +344,4 @@ if __name__ == "__main__":
     st.set_page_config(page_title="Dashboard de Cobranças", layout="wide")
     st.title("📈 Sistema de Gestão de Cobranças")
     exibir_dashboard_estatisticas_tab()
+    exibir_perfil_inicializacao()
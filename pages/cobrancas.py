@@ -3,6 +3,7 @@ import pandas as pd
 from datetime import datetime, date, timedelta
 import calendar
 import math
+import uuid
 
 st.set_page_config(page_title="Sistema de Cobranças - Agendamento",
                    page_icon="📈",
@@ -10,12 +11,18 @@ st.set_page_config(page_title="Sistema de Cobranças - Agendamento",
                    initial_sidebar_state="collapsed")
 
 try:
-    from database import init_db, Devedor, StatusDevedor
+    from database import init_db, versao_tabelas, Devedor, StatusDevedor
+    from inicializacao import exibir_perfil_inicializacao
+    from cache_consultas import precarregar
+    from discador import gerar_arquivo_discador
+    from fila_trabalho import garantir_fila_do_dia
     from devedores_service import (
         marcar_cobranca_feita_e_reagendar_in_db, marcar_como_pago_in_db,
         remover_devedor_from_db, get_devedores_para_acoes_count,
         get_devedores_para_acoes_paginated, load_devedores_from_db,
-        get_devedores_para_dia_paginated, get_devedores_para_dia_count)
+        get_devedores_para_dia_paginated, get_devedores_para_dia_count,
+        reagendar_dia_em_lote_in_db, buscar_devedores_por_telefone,
+        ConflitoVersao, ResultadoIncerto)
 except ImportError as e:
     st.error(
         f"Erro ao importar módulos: {e}. Verifique se os arquivos de serviço e banco de dados estão corretos."
@@ -30,6 +37,12 @@ if 'page_num_acoes' not in st.session_state:
     st.session_state.page_num_acoes = 0
 if 'page_num_cal' not in st.session_state:
     st.session_state.page_num_cal = 0
+if 'acoes_realizadas' not in st.session_state:
+    st.session_state.acoes_realizadas = {}
+if 'lista_desatualizada' not in st.session_state:
+    st.session_state.lista_desatualizada = False
+if 'id_sessao' not in st.session_state:
+    st.session_state.id_sessao = uuid.uuid4().hex
 
 
 
@@ -39,7 +52,7 @@ def process_dataframe(df: pd.DataFrame) -> pd.DataFrame:
 
     if 'fase_cobranca' not in df.columns:
         df['fase_cobranca'] = 1
-    else:
+    elif not isinstance(df['fase_cobranca'].dtype, pd.CategoricalDtype):
         df['fase_cobranca'] = pd.to_numeric(
             df['fase_cobranca'], errors='coerce').fillna(1).astype(int)
 
@@ -52,11 +65,78 @@ def process_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def exibir_devedor_card(row, from_calendar=False):
+def executar_acao(acao, devedor_id: int, versao, *args):
+    """
+    Callback dos botões do card. Como o card é um fragmento, apenas ele é
+    redesenhado; a lista é recarregada na próxima execução completa.
+    A ação só é gravada se o devedor ainda estiver na versão exibida.
+    """
+    resultado = acao(st.session_state.db_engine,
+                     devedor_id,
+                     *args,
+                     versao_esperada=versao)
+    success, msg = resultado
+    if isinstance(resultado, (ConflitoVersao, ResultadoIncerto)):
+        # Conflito ou escrita de resultado desconhecido: a lista é
+        # recarregada para mostrar o que de fato está gravado.
+        st.toast(msg, icon="⚠️")
+        st.session_state.acoes_realizadas[devedor_id] = f"⚠️ {msg}"
+        st.session_state.lista_desatualizada = True
+        return
+    st.toast(msg, icon="✅" if success else "❌")
+    if success:
+        st.session_state.acoes_realizadas[devedor_id] = msg
+        st.session_state.lista_desatualizada = True
+
+
+def agendar_manualmente(devedor_id: int, versao, chave_data: str):
+    executar_acao(marcar_cobranca_feita_e_reagendar_in_db, devedor_id, versao,
+                  st.session_state[chave_data])
+
+
+def exibir_contador_acoes(contador):
+    total = len(st.session_state.acoes_realizadas)
+    if total:
+        contador.success(
+            f"✅ {total} ação(ões) registrada(s). A lista será atualizada na próxima navegação."
+        )
+
+
+def atualizar_lista_se_necessario():
+    # As consultas em cache são chaveadas pela versão das tabelas: depois de
+    # uma ação, só as afetadas são refeitas, sem limpar o cache de todos.
+    if st.session_state.lista_desatualizada:
+        st.session_state.acoes_realizadas = {}
+        st.session_state.lista_desatualizada = False
+
+
+def precarregar_vizinhas(lista: str, consulta, pagina: int, total_pages: int,
+                         montar_args):
+    """
+    Busca em segundo plano as páginas anterior e seguinte da lista, para que
+    "Próxima"/"Anterior" saiam do cache de consultas.
+    """
+    precarregar((st.session_state.id_sessao, lista), [
+        (consulta, montar_args(p)) for p in (pagina + 1, pagina - 1)
+        if 0 <= p < total_pages
+    ])
+
+
+@st.fragment
+def exibir_devedor_card(row, from_calendar=False, contador=None):
     devedor_id = int(row['id'])
+    versao = int(row['versao']) if pd.notna(row.get('versao')) else None
     fase_atual = int(row.get('fase_cobranca', 1))
     key_suffix = f"{devedor_id}_{'cal' if from_calendar else 'acoes'}"
 
+    if devedor_id in st.session_state.acoes_realizadas:
+        with st.container(border=True):
+            st.markdown(f"#### {row.get('nome', 'Nome não encontrado')}")
+            st.caption(st.session_state.acoes_realizadas[devedor_id])
+        if contador is not None:
+            exibir_contador_acoes(contador)
+        return
+
     with st.container(border=True):
         col_info, col_actions = st.columns([3, 1.2])
 
@@ -103,37 +183,26 @@ def exibir_devedor_card(row, from_calendar=False):
         with col_actions:
             st.write("")
 
-            def clear_all_caches_and_rerun():
-                st.cache_data.clear()
-                st.rerun()
-
-            if st.button("➡️ Cobrança Feita",
-                         key=f"cobranca_feita_{key_suffix}",
-                         use_container_width=True):
-                success, msg = marcar_cobranca_feita_e_reagendar_in_db(
-                    st.session_state.db_engine, devedor_id)
-                st.toast(msg, icon="✅" if success else "❌")
-                if success:
-                    clear_all_caches_and_rerun()
-
-            if st.button("✅ Marcar como Pago",
-                         key=f"pago_{key_suffix}",
-                         use_container_width=True,
-                         disabled=(str(
-                             row.get('status')) == StatusDevedor.PAGO.value)):
-                success, msg = marcar_como_pago_in_db(
-                    st.session_state.db_engine, devedor_id)
-                st.toast(msg, icon="✅" if success else "❌")
-                if success:
-                    clear_all_caches_and_rerun()
-            if st.button("❌ Remover Devedor",
-                         key=f"remover_{key_suffix}",
-                         use_container_width=True,
-                         type="primary"):
-                success, msg = remover_devedor_from_db(
-                    st.session_state.db_engine, devedor_id)
-                st.toast(msg, icon="✅" if success else "❌")
-                if success: clear_all_caches_and_rerun()
+            st.button("➡️ Cobrança Feita",
+                      key=f"cobranca_feita_{key_suffix}",
+                      use_container_width=True,
+                      on_click=executar_acao,
+                      args=(marcar_cobranca_feita_e_reagendar_in_db,
+                            devedor_id, versao))
+
+            st.button("✅ Marcar como Pago",
+                      key=f"pago_{key_suffix}",
+                      use_container_width=True,
+                      disabled=(str(
+                          row.get('status')) == StatusDevedor.PAGO.value),
+                      on_click=executar_acao,
+                      args=(marcar_como_pago_in_db, devedor_id, versao))
+            st.button("❌ Remover Devedor",
+                      key=f"remover_{key_suffix}",
+                      use_container_width=True,
+                      type="primary",
+                      on_click=executar_acao,
+                      args=(remover_devedor_from_db, devedor_id, versao))
 
        
             with st.expander("📅 Agendar Manualmente"):
@@ -147,25 +216,83 @@ def exibir_devedor_card(row, from_calendar=False):
                 if default_date < min_data: default_date = min_data
                 if default_date > max_data: default_date = max_data
 
-                nova_data = st.date_input(
-                    label="Nova data de cobrança",
-                    value=default_date,
-                    min_value=min_data,
-                    max_value=max_data,
-                    key=f"manual_agendamento_data_{key_suffix}")
-
-                if st.button("📌 Agendar",
-                             key=f"manual_agendar_{key_suffix}",
-                             use_container_width=True):
-                    success, msg = marcar_cobranca_feita_e_reagendar_in_db(
-                        st.session_state.db_engine, devedor_id, nova_data)
-                    st.toast(msg, icon="✅" if success else "❌")
-                    if success: clear_all_caches_and_rerun()
-
+                st.date_input(label="Nova data de cobrança",
+                              value=default_date,
+                              min_value=min_data,
+                              max_value=max_data,
+                              key=f"manual_agendamento_data_{key_suffix}")
+
+                st.button("📌 Agendar",
+                          key=f"manual_agendar_{key_suffix}",
+                          use_container_width=True,
+                          on_click=agendar_manualmente,
+                          args=(devedor_id, versao,
+                                f"manual_agendamento_data_{key_suffix}"))
+
+
+
+def exibir_lista_discador():
+    with st.expander("📞 Lista do discador"):
+        col1, col2 = st.columns(2)
+        agentes = col1.number_input("Agentes (um arquivo por agente):",
+                                    min_value=1,
+                                    max_value=50,
+                                    value=1,
+                                    key="discador_agentes")
+        incluir_invalidos = col2.checkbox("Incluir telefones inválidos",
+                                          key="discador_invalidos")
+
+        # O arquivo gerado vale enquanto os dados e as opções não mudarem.
+        assinatura = (versao_tabelas(st.session_state.db_engine,
+                                     'fila_trabalho', 'devedores'),
+                      date.today(), agentes, incluir_invalidos)
+        gerado = st.session_state.get('lista_discador')
+        if gerado is None or gerado[0] != assinatura:
+            if st.button("Gerar lista do discador",
+                         key="gerar_discador",
+                         use_container_width=True):
+                with st.spinner("Gerando lista..."):
+                    st.session_state.lista_discador = (
+                        assinatura,
+                        *gerar_arquivo_discador(st.session_state.db_engine,
+                                                agentes, incluir_invalidos))
+                st.rerun()
+            return
+
+        _, conteudo, nome_arquivo, mime, total = gerado
+        st.download_button(label=f"⬇️ Baixar lista ({total} contatos)",
+                           data=conteudo,
+                           file_name=nome_arquivo,
+                           mime=mime,
+                           key="baixar_discador",
+                           on_click="ignore",
+                           use_container_width=True)
+
+
+def exibir_retorno_ligacao():
+    with st.expander("📲 Retorno de ligação"):
+        telefone = st.text_input("Telefone de quem ligou (qualquer formato):",
+                                 key="telefone_retorno")
+        if not telefone:
+            return
+        encontrados = process_dataframe(
+            buscar_devedores_por_telefone(st.session_state.db_engine,
+                                          telefone))
+        if encontrados.empty:
+            st.info("Nenhum devedor com este telefone.")
+            return
+        st.dataframe(encontrados[[
+            'nome', 'pessoa', 'telefone', 'valortotal', 'atraso',
+            'data_cobranca', 'fase_cobranca'
+        ]],
+                     hide_index=True,
+                     use_container_width=True)
 
 
 def exibir_acoes_cobranca_tab():
     st.header("🎯 Ações de Cobrança para Hoje")
+    exibir_lista_discador()
+    exibir_retorno_ligacao()
 
     PAGE_SIZE = 50
 
@@ -175,6 +302,7 @@ def exibir_acoes_cobranca_tab():
                                     key="filtro_acoes")
     with col2:
         sort_options = {
+            "Prioridade": ("prioridade", True),
             "Data da Próxima Cobrança": ("data_cobranca", True),
             "Fase da Cobrança": ("fase_cobranca", True),
             "Nome (A-Z)": ("nome", True),
@@ -199,16 +327,13 @@ def exibir_acoes_cobranca_tab():
     st.session_state.page_num_acoes = max(
         0, min(st.session_state.page_num_acoes, total_pages - 1))
 
-    @st.cache_data(show_spinner="Carregando devedores...", ttl=60)
-    def cached_get_paginated_data(page, page_size, sort_col, sort_asc, nome):
-        df = get_devedores_para_acoes_paginated(st.session_state.db_engine,
-                                                page, page_size, sort_col,
-                                                sort_asc, nome)
-        return process_dataframe(df)
-
-    df_pagina = cached_get_paginated_data(st.session_state.page_num_acoes,
-                                          PAGE_SIZE, sort_column, ascending,
-                                          filtro_nome)
+    # Páginas vêm do cache de consultas do serviço, compartilhado entre as
+    # sessões e renovado a cada escrita (versão dos dados).
+    df_pagina = process_dataframe(
+        get_devedores_para_acoes_paginated(st.session_state.db_engine,
+                                           st.session_state.page_num_acoes,
+                                           PAGE_SIZE, sort_column, ascending,
+                                           filtro_nome))
 
     st.markdown(
         f"--- \nExibindo **{len(df_pagina)}** de **{total_items}** devedor(es)."
@@ -230,6 +355,8 @@ def exibir_acoes_cobranca_tab():
         st.session_state.page_num_acoes += 1
         st.rerun()
 
+    contador = st.empty()
+    exibir_contador_acoes(contador)
     st.markdown("---")
 
     if df_pagina.empty and total_items > 0:
@@ -240,19 +367,31 @@ def exibir_acoes_cobranca_tab():
         st.rerun()
 
     for _, row in df_pagina.iterrows():
-        exibir_devedor_card(row, from_calendar=False)
+        exibir_devedor_card(row, from_calendar=False, contador=contador)
+
+    precarregar_vizinhas(
+        'acoes', get_devedores_para_acoes_paginated,
+        st.session_state.page_num_acoes, total_pages,
+        lambda p: (st.session_state.db_engine, p, PAGE_SIZE, sort_column,
+                   ascending, filtro_nome))
 
 
 def exibir_calendario_cobrancas_tab():
     st.header("🗓️ Calendário e Agendamentos")
     PAGE_SIZE_CAL = 50
 
-    @st.cache_data(show_spinner="Carregando dados para calendário...", ttl=60)
-    def load_full_data_for_calendar(_db_engine):
-        df = load_devedores_from_db(_db_engine)
+    @st.cache_data(show_spinner="Carregando dados para calendário...",
+                   ttl=60,
+                   max_entries=2)
+    def load_full_data_for_calendar(_db_engine, versao: int):
+        df = load_devedores_from_db(_db_engine, compacto=True)
         return process_dataframe(df)
 
-    df_completo = load_full_data_for_calendar(st.session_state.db_engine)
+    # Recarrega só quando a tabela de devedores muda (em qualquer processo).
+    versao, = versao_tabelas(st.session_state.db_engine,
+                             Devedor.__tablename__)
+    df_completo = load_full_data_for_calendar(st.session_state.db_engine,
+                                              versao)
 
     if df_completo.empty:
         st.info("Nenhum devedor encontrado no banco de dados.")
@@ -326,15 +465,11 @@ def exibir_calendario_cobrancas_tab():
         st.session_state.page_num_cal = max(
             0, min(st.session_state.page_num_cal, total_pages - 1))
 
-        @st.cache_data(show_spinner="Carregando agendamentos...", ttl=60)
-        def cached_get_devedores_dia(s_date, page, page_size):
-            df = get_devedores_para_dia_paginated(st.session_state.db_engine,
-                                                  s_date, page, page_size)
-            return process_dataframe(df)
-
-        df_pagina_cal = cached_get_devedores_dia(
-            st.session_state.selected_date, st.session_state.page_num_cal,
-            PAGE_SIZE_CAL)
+        df_pagina_cal = process_dataframe(
+            get_devedores_para_dia_paginated(st.session_state.db_engine,
+                                             st.session_state.selected_date,
+                                             st.session_state.page_num_cal,
+                                             PAGE_SIZE_CAL))
 
         st.markdown(
             f"Exibindo **{len(df_pagina_cal)}** de **{total_items}** cobrança(s) para **{st.session_state.selected_date.strftime('%d/%m/%Y')}**."
@@ -358,13 +493,74 @@ def exibir_calendario_cobrancas_tab():
             st.session_state.page_num_cal += 1
             st.rerun()
 
+        exibir_reagendamento_em_lote(st.session_state.selected_date)
+
+        contador_cal = st.empty()
+        exibir_contador_acoes(contador_cal)
         st.markdown("---")
         for _, row in df_pagina_cal.iterrows():
-            exibir_devedor_card(row, from_calendar=True)
+            exibir_devedor_card(row, from_calendar=True, contador=contador_cal)
+
+        precarregar_vizinhas(
+            'calendario', get_devedores_para_dia_paginated,
+            st.session_state.page_num_cal, total_pages,
+            lambda p: (st.session_state.db_engine,
+                       st.session_state.selected_date, p, PAGE_SIZE_CAL))
+
+
+def exibir_reagendamento_em_lote(data_origem: date):
+    with st.expander("⚖️ Redistribuir agendamentos deste dia"):
+        st.caption(
+            "Espalha as cobranças do dia selecionado pelos dias úteis seguintes "
+            "a ele (ou a hoje, se o dia já passou), sem fins de semana e "
+            "feriados, respeitando a capacidade diária."
+        )
+        c1, c2, c3, c4 = st.columns(4)
+        capacidade = c1.number_input("Capacidade por dia",
+                                     min_value=1,
+                                     value=50,
+                                     step=5,
+                                     key="lote_capacidade")
+        intervalo_min = c2.number_input("Intervalo mínimo (dias)",
+                                        min_value=0,
+                                        value=1,
+                                        key="lote_intervalo_min")
+        intervalo_max = c3.number_input("Intervalo máximo (dias)",
+                                        min_value=1,
+                                        value=30,
+                                        key="lote_intervalo_max")
+        criterios = {
+            "Sem peso": None,
+            "Peso por fase": "fase",
+            "Peso por valor": "valor"
+        }
+        criterio = c4.selectbox("Peso", list(criterios.keys()),
+                                key="lote_criterio")
+
+        if st.button("Redistribuir",
+                     key="lote_redistribuir",
+                     use_container_width=True):
+            success, msg = reagendar_dia_em_lote_in_db(
+                st.session_state.db_engine,
+                data_origem,
+                capacidade_diaria=capacidade,
+                intervalo_minimo=int(intervalo_min),
+                intervalo_maximo=int(intervalo_max),
+                criterio_peso=criterios[criterio])
+            if success is None:
+                st.toast(msg, icon="⚠️")
+            else:
+                st.toast(msg, icon="✅" if success else "❌")
+            if success is not False:
+                st.rerun()
 
 
 def main():
     st.title("📈 Sistema de Gestão de Cobranças")
+    # A fila do dia é garantida aqui, e não nas consultas: a pré-carga roda
+    # as consultas em segundo plano e não deve escrever.
+    garantir_fila_do_dia(st.session_state.db_engine)
+    atualizar_lista_se_necessario()
     tab1, tab2 = st.tabs(["Ações de Cobrança", "Calendário e Agendamentos"])
 
     with tab1:
@@ -372,6 +568,7 @@ def main():
 
     with tab2:
         exibir_calendario_cobrancas_tab()
+    exibir_perfil_inicializacao()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,86 @@
+"""
+Leitura de planilhas enviadas pelo usuário, com cache pelo conteúdo.
+
+O Streamlit reexecuta a página a cada interação e o arquivo enviado continua
+anexado, então a mesma planilha seria lida de novo a cada clique. Aqui o
+resultado fica em um cache LRU compartilhado pelo processo, indexado pelo
+hash SHA-256 dos bytes e limitado pelo tamanho total dos DataFrames.
+"""
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from compactacao import bytes_em_memoria, compactar_tipos
+
+LIMITE_CACHE_BYTES = 256 * 1024 * 1024
+
+_MOTORES = {'.xlsx': 'openpyxl', '.xls': 'xlrd'}
+
+
+class CachePlanilhas:
+    """LRU de DataFrames limitado pela soma dos tamanhos em memória."""
+
+    def __init__(self, limite_bytes: int = LIMITE_CACHE_BYTES):
+        self.limite_bytes = limite_bytes
+        self._itens = OrderedDict()
+        self._tamanho = 0
+        self._lock = threading.Lock()
+
+    def get(self, chave: str):
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                return None
+            self._itens.move_to_end(chave)
+            return item[0]
+
+    def put(self, chave: str, df: pd.DataFrame):
+        tamanho = bytes_em_memoria(df)
+        with self._lock:
+            if chave in self._itens:
+                self._tamanho -= self._itens.pop(chave)[1]
+            if tamanho > self.limite_bytes:
+                return
+            self._itens[chave] = (df, tamanho)
+            self._tamanho += tamanho
+            while self._tamanho > self.limite_bytes:
+                _, (_, removido) = self._itens.popitem(last=False)
+                self._tamanho -= removido
+
+    def clear(self):
+        with self._lock:
+            self._itens.clear()
+            self._tamanho = 0
+
+
+_cache = CachePlanilhas()
+
+
+def hash_conteudo(conteudo: bytes) -> str:
+    return hashlib.sha256(conteudo).hexdigest()
+
+
+def motor_por_extensao(nome_arquivo: str) -> str:
+    """Motor do pandas para o formato; .xls exige o pacote xlrd."""
+    for extensao, motor in _MOTORES.items():
+        if nome_arquivo.lower().endswith(extensao):
+            return motor
+    raise ValueError(f"Formato de planilha não suportado: {nome_arquivo}")
+
+
+def ler_planilha(conteudo: bytes, nome_arquivo: str) -> pd.DataFrame:
+    """
+    DataFrame compacto da planilha, lido uma única vez por conteúdo.
+    O DataFrame retornado é compartilhado: não deve ser alterado no lugar.
+    """
+    chave = hash_conteudo(conteudo)
+    df = _cache.get(chave)
+    if df is None:
+        df = compactar_tipos(
+            pd.read_excel(io.BytesIO(conteudo),
+                          engine=motor_por_extensao(nome_arquivo)))
+        _cache.put(chave, df)
+    return df
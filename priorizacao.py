@@ -0,0 +1,154 @@
+"""
+Score composto de prioridade de cobrança.
+
+O score (0 a 100) combina valor da dívida, dias em atraso, fase da cobrança e
+dias desde o último contato. Cada fator é normalizado por uma referência fixa,
+de modo que o score de um devedor não depende do restante da carteira e pode
+ser recalculado incrementalmente a cada alteração.
+"""
+from datetime import date
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from database import Devedor, StatusDevedor
+from dialeto import atualizar_em_massa
+
+PESOS_PADRAO: Dict[str, float] = {
+    'valortotal': 0.35,
+    'atraso': 0.30,
+    'fase_cobranca': 0.15,
+    'dias_sem_contato': 0.20,
+}
+
+# Valores a partir dos quais o fator é considerado máximo.
+REFERENCIA_VALOR = 10_000.0
+REFERENCIA_ATRASO = 365
+REFERENCIA_DIAS_SEM_CONTATO = 30
+FASE_MAXIMA = 3
+
+_TAMANHO_LOTE = 900
+
+
+def calcular_scores(valortotal,
+                    atraso,
+                    fase_cobranca,
+                    ultima_cobranca,
+                    hoje: date = None,
+                    pesos: Dict[str, float] = None) -> np.ndarray:
+    """
+    Calcula o score de prioridade de toda a carteira em uma passada vetorizada.
+    Devedores nunca contatados recebem o fator máximo de dias sem contato.
+    """
+    pesos = {**PESOS_PADRAO, **(pesos or {})}
+    hoje = np.datetime64(hoje or date.today(), 'D')
+
+    valor = np.nan_to_num(np.asarray(valortotal, dtype=np.float64))
+    atraso = np.nan_to_num(np.asarray(atraso, dtype=np.float64))
+    fase = np.nan_to_num(np.asarray(fase_cobranca, dtype=np.float64), nan=1.0)
+    ultima = np.asarray(pd.to_datetime(ultima_cobranca, errors='coerce'),
+                        dtype='datetime64[D]')
+
+    dias_sem_contato = (hoje - ultima).astype(np.float64)
+    dias_sem_contato[np.isnat(ultima)] = REFERENCIA_DIAS_SEM_CONTATO
+
+    fatores = np.stack([
+        np.log1p(np.clip(valor, 0, None)) / np.log1p(REFERENCIA_VALOR),
+        atraso / REFERENCIA_ATRASO,
+        (fase - 1) / (FASE_MAXIMA - 1),
+        dias_sem_contato / REFERENCIA_DIAS_SEM_CONTATO,
+    ])
+    np.clip(fatores, 0, 1, out=fatores)
+
+    vetor_pesos = np.array([
+        pesos['valortotal'], pesos['atraso'], pesos['fase_cobranca'],
+        pesos['dias_sem_contato']
+    ])
+    soma_pesos = vetor_pesos.sum()
+    if soma_pesos <= 0:
+        raise ValueError("A soma dos pesos deve ser maior que zero.")
+
+    return (100 * (vetor_pesos @ fatores) / soma_pesos).astype(np.float32)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Índices dos k maiores scores em ordem decrescente, usando seleção
+    parcial (argpartition) em vez de ordenar a carteira inteira.
+    """
+    scores = np.asarray(scores)
+    if k <= 0 or len(scores) == 0:
+        return np.array([], dtype=np.int64)
+    if k >= len(scores):
+        return np.argsort(-scores, kind='stable')
+    candidatos = np.argpartition(-scores, k - 1)[:k]
+    return candidatos[np.argsort(-scores[candidatos], kind='stable')]
+
+
+def _scores_do_frame(df: pd.DataFrame, hoje: date = None,
+                     pesos: Dict[str, float] = None) -> np.ndarray:
+    return calcular_scores(df['valortotal'].to_numpy(),
+                           df['atraso'].to_numpy(),
+                           df['fase_cobranca'].to_numpy(),
+                           df['ultima_cobranca'], hoje, pesos)
+
+
+def _colunas_score():
+    return select(Devedor.id, Devedor.valortotal, Devedor.atraso,
+                  Devedor.fase_cobranca, Devedor.ultima_cobranca)
+
+
+def _pagos_com_score():
+    return update(Devedor).where(Devedor.status == StatusDevedor.PAGO,
+                                 Devedor.score_prioridade.isnot(None))
+
+
+def limpar_scores_pagos(session: Session) -> int:
+    """Tira o score dos devedores pagos que ainda o têm. Não faz commit."""
+    return session.execute(
+        _pagos_com_score().values(score_prioridade=None)).rowcount
+
+
+def atualizar_scores(session: Session,
+                     devedor_ids: List[int] = None,
+                     hoje: date = None) -> int:
+    """
+    Recalcula e grava o score dos devedores em aberto (todos, ou apenas os
+    IDs informados). Devedores pagos ficam sem score. Não faz commit.
+    Para a carteira inteira pela fila de escrita, use lotes de IDs (como
+    `fila_trabalho.materializar_fila_do_dia`): uma operação só seguraria o
+    escritor durante todo o cálculo.
+    """
+    session.flush()
+    pagos = _pagos_com_score()
+    query = _colunas_score().where(Devedor.status != StatusDevedor.PAGO)
+    if devedor_ids is None:
+        limpar_scores_pagos(session)
+        frames = [pd.read_sql(query, session.connection())]
+    else:
+        devedor_ids = list(devedor_ids)
+        for i in range(0, len(devedor_ids), _TAMANHO_LOTE):
+            session.execute(
+                pagos.where(Devedor.id.in_(
+                    devedor_ids[i:i + _TAMANHO_LOTE])).values(
+                        score_prioridade=None))
+        frames = [
+            pd.read_sql(
+                query.where(
+                    Devedor.id.in_(devedor_ids[i:i + _TAMANHO_LOTE])),
+                session.connection())
+            for i in range(0, len(devedor_ids), _TAMANHO_LOTE)
+        ]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if df.empty:
+        return 0
+
+    scores = _scores_do_frame(df, hoje).astype(float)
+    atualizar_em_massa(session, Devedor, [{
+        'id': devedor_id,
+        'score_prioridade': score
+    } for devedor_id, score in zip(df['id'].tolist(), scores.tolist())])
+    return len(df)
@@ -0,0 +1,47 @@
+import pandas as pd
+
+CODIGO_PAIS = "55"
+
+# Prefixo opcional (00 55 / 55 / 0 + código de operadora) seguido do número
+# nacional: DDD de dois dígitos + celular (9 + 8 dígitos) ou fixo (2-5 + 7 dígitos).
+_PADRAO_TELEFONE_BR = (r"^(?:0055|55|0(?:\d{2})?)?"
+                       r"([1-9][1-9](?:9\d{8}|[2-5]\d{7}))$")
+
+
+def normalizar_telefones(telefones: pd.Series) -> pd.DataFrame:
+    """
+    Normaliza uma série de telefones de forma vetorizada.
+
+    Retorna um DataFrame com o mesmo índice e as colunas:
+    - telefone: texto original sem espaços (None quando não há dígitos)
+    - telefone_normalizado: número no formato +55DDNNNNNNNNN (None se inválido)
+    - telefone_valido: True quando o número pôde ser normalizado
+    """
+    texto = telefones.astype("string").str.strip()
+    # Números vindos do Excel como float ("11987654321.0")
+    texto = texto.str.replace(r"\.0$", "", regex=True)
+    digitos = texto.str.replace(r"\D", "", regex=True)
+
+    nacional = digitos.str.extract(_PADRAO_TELEFONE_BR, expand=False)
+    normalizado = CODIGO_PAIS + nacional
+    valido = normalizado.notna()
+
+    sem_digitos = digitos.isna() | (digitos == "")
+    texto = texto.mask(sem_digitos)
+
+    return pd.DataFrame(
+        {
+            "telefone": texto.astype(object).where(texto.notna(), None),
+            "telefone_normalizado": ("+" + normalizado).astype(object).where(
+                valido, None),
+            "telefone_valido": valido.fillna(False).astype(bool),
+        },
+        index=telefones.index)
+
+
+def normalizar_telefone(telefone) -> str | None:
+    """Normaliza um único telefone. Retorna None se o número for inválido."""
+    if telefone is None:
+        return None
+    resultado = normalizar_telefones(pd.Series([telefone]))
+    return resultado.at[0, "telefone_normalizado"]
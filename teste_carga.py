@@ -0,0 +1,329 @@
+"""
+Teste de carga das páginas do Streamlit com sessões simultâneas.
+
+Cada sessão simulada percorre as páginas com o `AppTest` do Streamlit: abre
+`cobrancas.py`, vai para a próxima página, registra uma "Cobrança Feita",
+abre `Devedores.py`, busca, salva uma edição e abre os dois dashboards. Cada
+interação é cronometrada; o relatório traz percentis de latência e taxa de
+erro por interação e, para cada quantidade de sessões, a vazão total (a
+curva de capacidade).
+
+O AppTest usa um Runtime global e não roda scripts simultâneos no mesmo
+processo, então cada sessão roda em um processo próprio, contra o mesmo
+banco. O que o servidor real compartilha entre sessões de um processo não é
+medido (`LIMITACOES`, impresso também no relatório). Uma rodada de
+aquecimento por sessão não entra nas medições, e as sessões começam juntas
+(barreira).
+
+O AppTest não edita `st.data_editor` nem envia arquivos: "salvar edição"
+executa a mesma escrita do botão de salvar (`update_devedor_in_db` com a
+versão lida), e o dashboard de planilha é aberto sem arquivo.
+
+Usa um banco próprio (semeado se estiver vazio), nunca o da aplicação; por
+padrão na pasta temporária do sistema.
+
+Uso headless:
+    python teste_carga.py --sessoes 1 2 4 8 --rodadas 3
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+BANCO_CARGA_PADRAO = "sqlite:///" + os.path.join(tempfile.gettempdir(),
+                                                 'cobrancas_carga_teste.db')
+DEVEDORES_CARGA_PADRAO = 20000
+TIMEOUT_INTERACAO = 120
+
+PAGINAS = {
+    'cobrancas': 'pages/cobrancas.py',
+    'devedores': 'Devedores.py',
+    'dashboard': 'pages/01_dashboard.py',
+    'dashboard_cobrancas': 'pages/04_dashboard_de_cobranças.py',
+}
+PERCENTIS = (50, 90, 99)
+
+LIMITACOES = """\
+Limitações: cada sessão simulada roda em um processo próprio. Não são medidos
+- os caches compartilhados entre sessões do mesmo processo: carteira
+  compartilhada, cache de consultas e pré-carga de páginas vizinhas (cada
+  sessão aquece e usa só o seu);
+- a fila única de escrita do processo (fila_escrita): cada sessão tem a sua,
+  e as escritas concorrem direto no banco.
+As latências de leitura são um limite conservador; as de escrita não refletem
+o agrupamento de commits da fila única."""
+
+
+@dataclass
+class Medicao:
+    sessoes: int
+    sessao: int
+    interacao: str
+    inicio: float
+    segundos: float
+    erro: Optional[str]
+
+
+def semear_banco(engine, total: int = DEVEDORES_CARGA_PADRAO,
+                 semente: int = 42) -> int:
+    """Insere `total` devedores sintéticos se o banco estiver vazio."""
+    from sqlalchemy import func, select
+
+    from database import Devedor, StatusDevedor, unit_of_work
+    from dialeto import inserir_em_massa
+    from estatisticas import invalidar_estatisticas
+    from fila_trabalho import materializar_fila_do_dia
+    from priorizacao import FASE_MAXIMA
+
+    with unit_of_work(engine, somente_leitura=True) as session:
+        if session.execute(select(func.count(Devedor.id))).scalar():
+            return 0
+
+    rng = np.random.default_rng(semente)
+    hoje = datetime.combine(date.today(), datetime.min.time())
+    deslocamentos = rng.integers(-10, 30, total)
+    status = rng.choice([s for s in StatusDevedor], total,
+                        p=[0.1, 0.5, 0.1, 0.3])
+    registros = [{
+        'pessoa': f'CARGA{i:07d}',
+        'nome': f'Devedor Carga {i}',
+        'valortotal': round(float(valor), 2),
+        'atraso': int(atraso),
+        'atraso_referencia': date.today(),
+        'telefone': f'119{i % 100000000:08d}',
+        'telefone_normalizado': f'+55119{i % 100000000:08d}',
+        'telefone_valido': True,
+        'data_cobranca': hoje + timedelta(days=int(deslocamento)),
+        'status': situacao,
+        'data_pagamento': hoje if situacao == StatusDevedor.PAGO else None,
+        'fase_cobranca': int(fase),
+    } for i, (valor, atraso, deslocamento, situacao, fase) in enumerate(
+        zip(rng.gamma(2.0, 800.0, total), rng.integers(0, 400, total),
+            deslocamentos, status, rng.integers(1, FASE_MAXIMA + 1, total)))]
+
+    with unit_of_work(engine) as session:
+        inserir_em_massa(session, Devedor, registros)
+        invalidar_estatisticas(session)
+    materializar_fila_do_dia(engine)
+    return total
+
+
+class SessaoSimulada:
+    """Uma sessão de navegador: percorre o fluxo e registra cada interação."""
+
+    def __init__(self, numero: int, sessoes: int, engine,
+                 timeout: float = TIMEOUT_INTERACAO):
+        self.numero = numero
+        self.sessoes = sessoes
+        self.engine = engine
+        self.timeout = timeout
+        self.medicoes: List[Medicao] = []
+
+    def _medir(self, interacao: str, acao: Callable):
+        instante = time.time()
+        inicio = time.perf_counter()
+        resultado, erro = None, None
+        try:
+            resultado = acao()
+            excecoes = getattr(resultado, 'exception', None)
+            if excecoes:
+                erro = excecoes[0].value
+            elif isinstance(resultado, tuple) and resultado[0] is False:
+                erro = resultado[1]
+        except Exception as e:
+            erro = repr(e)
+        self.medicoes.append(
+            Medicao(self.sessoes, self.numero, interacao, instante,
+                    time.perf_counter() - inicio, erro))
+        return None if erro else resultado
+
+    def _abrir(self, pagina: str):
+        from streamlit.testing.v1 import AppTest
+
+        app = AppTest.from_file(os.path.join(RAIZ, PAGINAS[pagina]),
+                                default_timeout=self.timeout)
+        return app.run()
+
+    def _botao(self, app, prefixo_chave: str = None, rotulo: str = None):
+        botoes = [
+            b for b in app.button
+            if (prefixo_chave and (b.key or '').startswith(prefixo_chave))
+            or (rotulo and b.label.startswith(rotulo))
+        ]
+        if not botoes:
+            raise LookupError(f"Botão {prefixo_chave or rotulo} não encontrado.")
+        # Sessões diferentes agem sobre cards diferentes.
+        return botoes[self.numero % len(botoes)]
+
+    def _salvar_edicao(self, rodada: int):
+        from database import Devedor, unit_of_work
+        from devedores_service import update_devedor_in_db
+
+        with unit_of_work(self.engine, somente_leitura=True) as session:
+            devedor_id, versao, atraso = session.query(
+                Devedor.id, Devedor.versao, Devedor.atraso).order_by(
+                    Devedor.id).offset(self.numero * 100 + rodada).first()
+        return update_devedor_in_db(self.engine,
+                                    devedor_id, {'atraso': atraso + 1},
+                                    versao_esperada=versao)
+
+    def fluxo(self, rodada: int):
+        app = self._medir('cobrancas: abrir', lambda: self._abrir('cobrancas'))
+        if app is not None:
+            app = self._medir(
+                'cobrancas: próxima página',
+                lambda: self._botao(app, rotulo='Próxima').click().run())
+        if app is not None:
+            self._medir(
+                'cobrancas: cobrança feita',
+                lambda: self._botao(app, prefixo_chave='cobranca_feita_').
+                click().run())
+
+        app = self._medir('devedores: abrir', lambda: self._abrir('devedores'))
+        if app is not None:
+            self._medir(
+                'devedores: buscar',
+                lambda: app.text_input(key='search_term_input').input(
+                    f'Carga {self.numero}').run())
+        self._medir('devedores: salvar edição',
+                    lambda: self._salvar_edicao(rodada))
+
+        self._medir('dashboard: abrir', lambda: self._abrir('dashboard'))
+        self._medir('dashboard de cobranças: abrir',
+                    lambda: self._abrir('dashboard_cobrancas'))
+
+
+def _configurar_processo(url: str):
+    # As páginas leem o banco desta variável; precisa valer antes de
+    # qualquer init_db.
+    os.environ['COBRANCAS_DATABASE_URL'] = url
+    # Fora de `streamlit run` cada execução avisa que não há ScriptRunContext.
+    logging.getLogger(
+        'streamlit.runtime.scriptrunner_utils.script_run_context'
+    ).disabled = True
+
+
+def _executar_sessao(numero: int, sessoes: int, rodadas: int, url: str,
+                     barreira, timeout: float) -> List[Medicao]:
+    _configurar_processo(url)
+    from database import init_db
+
+    sessao = SessaoSimulada(numero, sessoes, init_db(url), timeout)
+    sessao.fluxo(rodada=rodadas)  # aquecimento: imports e caches do processo
+    sessao.medicoes.clear()
+    barreira.wait()
+    for rodada in range(rodadas):
+        sessao.fluxo(rodada)
+    return sessao.medicoes
+
+
+def executar_carga(url: str, sessoes: int, rodadas: int,
+                   timeout: float = TIMEOUT_INTERACAO):
+    """(medições, segundos) de `sessoes` sessões simultâneas."""
+    contexto = multiprocessing.get_context('spawn')
+    with contexto.Manager() as gerenciador, ProcessPoolExecutor(
+            max_workers=sessoes, mp_context=contexto) as executor:
+        barreira = gerenciador.Barrier(sessoes)
+        futuros = [
+            executor.submit(_executar_sessao, n, sessoes, rodadas, url,
+                            barreira, timeout) for n in range(sessoes)
+        ]
+        medicoes = [m for futuro in futuros for m in futuro.result()]
+    inicio = min(m.inicio for m in medicoes)
+    fim = max(m.inicio + m.segundos for m in medicoes)
+    return medicoes, fim - inicio
+
+
+def _percentis(grupo: pd.DataFrame) -> pd.Series:
+    segundos = grupo['segundos'].to_numpy()
+    valores = {
+        'interacoes': len(grupo),
+        'erros': int(grupo['erro'].notna().sum()),
+    }
+    valores['taxa_erro_%'] = 100 * valores['erros'] / len(grupo)
+    for p in PERCENTIS:
+        valores[f'p{p}_ms'] = 1000 * np.percentile(segundos, p)
+    valores['max_ms'] = 1000 * segundos.max()
+    return pd.Series(valores)
+
+
+def relatorio_interacoes(medicoes: Sequence[Medicao]) -> pd.DataFrame:
+    """Latência (percentis) e erros por quantidade de sessões e interação."""
+    df = pd.DataFrame([m.__dict__ for m in medicoes])
+    return df.groupby(['sessoes', 'interacao'],
+                      sort=False).apply(_percentis,
+                                        include_groups=False).round(1)
+
+
+def curva_capacidade(medicoes: Sequence[Medicao],
+                     duracoes: dict) -> pd.DataFrame:
+    """Vazão e latência geral para cada quantidade de sessões."""
+    df = pd.DataFrame([m.__dict__ for m in medicoes])
+    curva = df.groupby('sessoes').apply(_percentis,
+                                        include_groups=False)
+    curva['segundos'] = pd.Series(duracoes)
+    curva['interacoes_por_s'] = curva['interacoes'] / curva['segundos']
+    return curva.round(2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sessoes', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='quantidades de sessões simultâneas a testar')
+    parser.add_argument('--rodadas', type=int, default=2,
+                        help='vezes que cada sessão percorre o fluxo')
+    parser.add_argument('--banco', default=BANCO_CARGA_PADRAO,
+                        help='URL do banco de teste (semeado se vazio)')
+    parser.add_argument('--devedores', type=int,
+                        default=DEVEDORES_CARGA_PADRAO,
+                        help='devedores sintéticos na semeadura')
+    parser.add_argument('--csv', help='grava as medições brutas neste arquivo')
+    args = parser.parse_args(argv)
+
+    _configurar_processo(args.banco)
+    from database import init_db
+
+    engine = init_db(args.banco)
+    semeados = semear_banco(engine, args.devedores)
+    if semeados:
+        print(f"Banco semeado com {semeados} devedores.")
+
+    todas: List[Medicao] = []
+    duracoes = {}
+    for sessoes in args.sessoes:
+        medicoes, duracoes[sessoes] = executar_carga(args.banco, sessoes,
+                                                     args.rodadas)
+        todas.extend(medicoes)
+        print(f"{sessoes} sessão(ões): {len(medicoes)} interações em "
+              f"{duracoes[sessoes]:.1f} s")
+
+    with pd.option_context('display.width', 160, 'display.max_rows', None):
+        print("\nLatência por interação")
+        print(relatorio_interacoes(todas).to_string())
+        print("\nCurva de capacidade")
+        print(curva_capacidade(todas, duracoes).to_string())
+    print(f"\n{LIMITACOES}")
+
+    erros = [m for m in todas if m.erro]
+    if erros:
+        print("\nPrimeiros erros")
+        for m in erros[:10]:
+            print(f"  [{m.sessoes}/{m.sessao}] {m.interacao}: {m.erro}")
+
+    if args.csv:
+        pd.DataFrame([m.__dict__ for m in todas]).to_csv(args.csv,
+                                                         index=False)
+
+
+if __name__ == "__main__":
+    main()
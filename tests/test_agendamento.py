@@ -0,0 +1,165 @@
+"""
+Distribuição da carga de reagendamento pelos dias úteis.
+"""
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+from sqlalchemy import select
+from sqlalchemy.orm.exc import StaleDataError
+
+from agendamento import dias_uteis, distribuir_carga
+from database import Devedor, ItemFilaTrabalho, StatusDevedor, unit_of_work
+from devedores_service import (ConflitoVersao, _gravar_reagendamento,
+                               reagendar_dia_em_lote_in_db,
+                               reagendar_em_lote_in_db)
+from fila_trabalho import materializar_fila_do_dia
+
+
+@pytest.fixture(params=['sqlite', 'postgresql'])
+def banco(request):
+    return request.param
+
+
+def _carga(resultado, pesos, dias):
+    agendados = resultado >= 0
+    return np.bincount(resultado[agendados],
+                       weights=np.asarray(pesos, dtype=float)[agendados],
+                       minlength=dias)
+
+
+def test_item_que_nao_cabe_e_pulado():
+    assert distribuir_carga([1, 3, 1], [0], 2).tolist() == [0, -1, 0]
+
+
+def test_sobras_de_dias_anteriores_sao_usadas():
+    resultado = distribuir_carga([2, 2, 1, 1], [0, 0], 3)
+    assert resultado.tolist() == [0, 1, 1, 0]
+    assert _carga(resultado, [2, 2, 1, 1], 2).tolist() == [3, 3]
+
+
+@pytest.mark.parametrize('semente', range(5))
+def test_nunca_passa_da_capacidade(semente):
+    gerador = np.random.default_rng(semente)
+    pesos = gerador.choice([1.0, 2.0, 3.0], size=200)
+    carga_existente = gerador.integers(0, 12, size=10).astype(float)
+    resultado = distribuir_carga(pesos, carga_existente, 20)
+
+    carga = _carga(resultado, pesos, 10) + carga_existente
+    assert (carga <= 20).all()
+    # Nenhum item ficou de fora havendo vaga para ele em algum dia.
+    folga = 20 - carga
+    assert all(pesos[i] > folga.max() for i in np.flatnonzero(resultado < 0))
+
+
+def test_dia_ja_lotado_nao_recebe_itens():
+    resultado = distribuir_carga([1] * 6, [5, 0, 5], 5)
+    assert resultado.tolist() == [1] * 5 + [-1]
+
+
+def test_dias_uteis_pulam_fins_de_semana_e_feriados():
+    # Carnaval de 2025: segunda 3/3 e terça 4/3.
+    dias = dias_uteis(date(2025, 2, 28), date(2025, 3, 6))
+    assert dias.tolist() == [date(2025, 2, 28), date(2025, 3, 5),
+                             date(2025, 3, 6)]
+
+
+def test_dias_uteis_com_feriado_local():
+    dias = dias_uteis(date(2025, 12, 22), date(2025, 12, 26),
+                      feriados=[date(2025, 12, 24)])
+    assert dias.tolist() == [date(2025, 12, 22), date(2025, 12, 23),
+                             date(2025, 12, 26)]
+
+
+@pytest.mark.parametrize('deslocamento', [20, -5])
+def test_redistribuir_dia_nunca_antecipa(engine, deslocamento):
+    hoje = date.today()
+    origem = hoje + timedelta(days=deslocamento)
+    with unit_of_work(engine) as session:
+        session.add_all([
+            Devedor(nome=f'devedor {i}', pessoa=f'P{i}', valortotal=10.0,
+                    atraso=1, status=StatusDevedor.AGENDADO,
+                    data_cobranca=datetime.combine(origem,
+                                                   datetime.min.time()))
+            for i in range(6)
+        ])
+
+    sucesso, _ = reagendar_dia_em_lote_in_db(engine, origem,
+                                             capacidade_diaria=2,
+                                             intervalo_minimo=1,
+                                             intervalo_maximo=10)
+
+    assert sucesso
+    with unit_of_work(engine, somente_leitura=True) as session:
+        datas = [d.date() for (d, ) in session.query(Devedor.data_cobranca)]
+    base = max(origem, hoje)
+    assert len(datas) == 6
+    assert all(base < d <= base + timedelta(days=10) for d in datas)
+
+
+def _devedores(engine):
+    with unit_of_work(engine, somente_leitura=True) as session:
+        return {
+            d.id: d
+            for d in session.execute(
+                select(Devedor.id, Devedor.status, Devedor.versao,
+                       Devedor.data_cobranca, Devedor.score_prioridade))
+        }
+
+
+def test_reagendar_em_lote_grava_datas_e_tira_da_fila(engine):
+    with unit_of_work(engine) as session:
+        session.add_all([
+            Devedor(nome=f'devedor {i}', pessoa=f'P{i}', valortotal=100.0 * i,
+                    atraso=10 * i) for i in range(1, 7)
+        ])
+    materializar_fila_do_dia(engine)
+    antes = _devedores(engine)
+    versoes = {i: d.versao for i, d in antes.items()}
+    with unit_of_work(engine) as session:
+        session.get(Devedor, 6).nome = 'alterado por outro usuário'
+
+    sucesso, mensagem = reagendar_em_lote_in_db(
+        engine, list(antes), capacidade_diaria=100, intervalo_maximo=10,
+        versoes=versoes)
+
+    assert sucesso and '1 ignorado(s)' in mensagem
+    depois = _devedores(engine)
+    hoje = date.today()
+    for i in range(1, 6):
+        assert depois[i].status == StatusDevedor.AGENDADO
+        assert depois[i].versao == antes[i].versao + 1
+        assert hoje < depois[i].data_cobranca.date() <= hoje + timedelta(days=10)
+        assert depois[i].score_prioridade == antes[i].score_prioridade
+    assert depois[6].status == antes[6].status
+    with unit_of_work(engine, somente_leitura=True) as session:
+        fila = session.execute(select(ItemFilaTrabalho.devedor_id)).scalars()
+        assert list(fila) == [6]
+
+
+def test_reagendar_em_lote_so_com_conflitos(engine):
+    with unit_of_work(engine) as session:
+        session.add(Devedor(nome='devedor', pessoa='P1', valortotal=10.0,
+                            atraso=1))
+
+    resultado = reagendar_em_lote_in_db(engine, [1], capacidade_diaria=10,
+                                        versoes={1: 0})
+
+    assert isinstance(resultado, ConflitoVersao)
+    assert _devedores(engine)[1].data_cobranca is None
+
+
+def test_gravacao_com_versao_desatualizada_desfaz_o_lote(engine):
+    with unit_of_work(engine) as session:
+        session.add_all([
+            Devedor(nome=f'devedor {i}', pessoa=f'P{i}', valortotal=10.0,
+                    atraso=1) for i in range(1, 3)
+        ])
+    amanha = datetime.combine(date.today() + timedelta(days=1),
+                              datetime.min.time())
+
+    with pytest.raises(StaleDataError):
+        with unit_of_work(engine) as session:
+            _gravar_reagendamento(session, [1, 2], [1, 0], [amanha, amanha])
+
+    assert {d.data_cobranca for d in _devedores(engine).values()} == {None}
@@ -0,0 +1,236 @@
+"""
+Cache de consultas: chaves por tabela de origem, LRU em bytes, TTL,
+contadores, cálculo único por chave e pré-carga em segundo plano.
+"""
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+import cache_consultas as cache_consultas_mod
+from cache_consultas import (CacheConsultas, Precarregador, cache_consultas,
+                             em_cache)
+from database import Devedor, ExecucaoFilaTrabalho, unit_of_work
+
+
+@em_cache(tabelas=('fila_trabalho', ))
+def _consulta_fila(db_engine, filtro: str = None):
+    return filtro
+
+
+@em_cache(tabelas=('devedores', ))
+def _consulta_devedores(db_engine, filtro: str = None):
+    return filtro
+
+
+def test_escrita_muda_so_as_chaves_da_tabela(engine):
+    fila = _consulta_fila.chave(engine, ' a ')
+    devedores = _consulta_devedores.chave(engine, 'a')
+    with unit_of_work(engine) as session:
+        session.add(Devedor(nome='novo', valortotal=10.0, atraso=1))
+    assert _consulta_fila.chave(engine, 'a') == fila
+    assert _consulta_devedores.chave(engine, 'a') != devedores
+
+
+def test_escrita_sem_alteracao_na_tabela_mantem_chave(engine):
+    devedores = _consulta_devedores.chave(engine)
+    with unit_of_work(engine) as session:
+        session.query(ExecucaoFilaTrabalho).delete()
+    assert _consulta_devedores.chave(engine) == devedores
+
+
+def _cache(monkeypatch, **kwargs):
+    relogio = [0.0]
+    monkeypatch.setattr(cache_consultas_mod, 'time',
+                        SimpleNamespace(monotonic=lambda: relogio[0]))
+    return CacheConsultas(**kwargs), relogio
+
+
+def test_lru_despeja_o_menos_usado_ao_passar_do_limite(monkeypatch):
+    valor = b'x' * 100
+    cache, _ = _cache(monkeypatch, max_bytes=2 * sys.getsizeof(valor) + 10)
+    cache.obter('a', lambda: valor)
+    cache.obter('b', lambda: valor)
+    cache.obter('a', lambda: valor)
+    cache.obter('c', lambda: valor)
+
+    assert cache.contem('a') and cache.contem('c')
+    assert not cache.contem('b')
+    assert cache.estatisticas()['despejos'] == 1
+    assert cache.estatisticas()['bytes'] <= cache.max_bytes
+
+
+def test_item_maior_que_o_limite_nao_fica_no_cache(monkeypatch):
+    cache, _ = _cache(monkeypatch, max_bytes=50)
+    assert cache.obter('grande', lambda: b'x' * 100) == b'x' * 100
+    assert not cache.contem('grande')
+    assert cache.estatisticas()['bytes'] == 0
+
+
+def test_item_expirado_e_recalculado(monkeypatch):
+    cache, relogio = _cache(monkeypatch, ttl=10)
+    calculos = []
+
+    def calcular():
+        calculos.append(relogio[0])
+        return len(calculos)
+
+    assert cache.obter('k', calcular) == 1
+    relogio[0] = 9.9
+    assert cache.obter('k', calcular) == 1
+    relogio[0] = 10.1
+    assert not cache.contem('k')
+    assert cache.obter('k', calcular) == 2
+    assert calculos == [0.0, 10.1]
+
+
+def test_contadores_de_acertos_e_falhas(monkeypatch):
+    cache, _ = _cache(monkeypatch)
+    cache.obter('a', lambda: 1)
+    cache.obter('a', lambda: 1)
+    cache.obter('a', lambda: 1)
+    cache.obter('b', lambda: 2)
+
+    estatisticas = cache.estatisticas()
+    assert (estatisticas['acertos'], estatisticas['falhas']) == (2, 2)
+    assert estatisticas['itens'] == 2
+    assert estatisticas['taxa_acerto'] == 0.5
+
+
+def test_threads_na_mesma_chave_calculam_uma_vez():
+    cache = CacheConsultas()
+    threads = 8
+    largada = threading.Barrier(threads)
+    liberar = threading.Event()
+    calculos = []
+
+    def calcular():
+        calculos.append(1)
+        # Segura o cálculo até todas as threads terem pedido a chave.
+        liberar.wait(timeout=5)
+        return 'valor'
+
+    def pedir():
+        largada.wait(timeout=5)
+        return cache.obter('k', calcular)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futuros = [executor.submit(pedir) for _ in range(threads)]
+        while cache.estatisticas()['acertos'] + cache.estatisticas(
+        )['falhas'] < threads:
+            time.sleep(0.01)
+        liberar.set()
+        resultados = [futuro.result(timeout=5) for futuro in futuros]
+
+    assert resultados == ['valor'] * threads
+    assert len(calculos) == 1
+    assert cache.estatisticas()['falhas'] == 1
+
+
+def test_erro_no_calculo_chega_a_quem_espera_e_nao_fica_no_cache():
+    cache = CacheConsultas()
+
+    def falhar():
+        raise ValueError('consulta falhou')
+
+    with pytest.raises(ValueError):
+        cache.obter('k', falhar)
+    assert not cache.contem('k')
+    assert cache.obter('k', lambda: 'ok') == 'ok'
+
+
+def test_copia_devolvida_nao_altera_o_cache():
+    cache = CacheConsultas()
+    original = pd.DataFrame({'valor': [1.0, 2.0]})
+    primeira = cache.obter('df', lambda: original)
+    primeira.loc[0, 'valor'] = 99.0
+    segunda = cache.obter('df', lambda: None)
+
+    assert segunda is not primeira
+    assert segunda['valor'].tolist() == [1.0, 2.0]
+    assert original['valor'].tolist() == [1.0, 2.0]
+
+
+bloqueio_precarga = threading.Event()
+chamadas_precarga = []
+
+
+@em_cache(tabelas=('devedores', ))
+def _consulta_lenta(db_engine, pagina: int):
+    chamadas_precarga.append(pagina)
+    bloqueio_precarga.wait(timeout=5)
+    return pagina
+
+
+@em_cache(tabelas=('devedores', ))
+def _consulta_instavel(db_engine, pagina: int):
+    chamadas_precarga.append(pagina)
+    if len(chamadas_precarga) == 1:
+        raise RuntimeError('banco indisponível')
+    return pagina
+
+
+@pytest.fixture
+def precarga(engine):
+    bloqueio_precarga.clear()
+    chamadas_precarga.clear()
+    precarregador = Precarregador(cache_consultas, max_threads=1,
+                                  max_pendentes=2)
+    yield precarregador
+    bloqueio_precarga.set()
+    precarregador._executor.shutdown(wait=True)
+
+
+def _aguardar(condicao):
+    limite = time.monotonic() + 5
+    while not condicao():
+        assert time.monotonic() < limite
+        time.sleep(0.01)
+
+
+def test_mudar_de_pagina_cancela_precargas_nao_iniciadas(engine, precarga):
+    assert precarga.agendar('sessao', [(_consulta_lenta, (engine, 1)),
+                                       (_consulta_lenta, (engine, 2))]) == 2
+    _aguardar(lambda: chamadas_precarga == [1])
+
+    # A página 2 ainda esperava a thread livre: sai da fila e não executa.
+    assert precarga.agendar('sessao', [(_consulta_lenta, (engine, 5))]) == 1
+    assert precarga.canceladas == 1
+    bloqueio_precarga.set()
+    _aguardar(lambda: cache_consultas.contem(_consulta_lenta.chave(engine, 5)))
+    assert chamadas_precarga == [1, 5]
+    assert not cache_consultas.contem(_consulta_lenta.chave(engine, 2))
+
+
+def test_fila_de_precarga_cheia_descarta_pedidos(engine, precarga):
+    agendadas = precarga.agendar(
+        'sessao', [(_consulta_lenta, (engine, p)) for p in range(1, 5)])
+
+    assert agendadas == 2
+    assert precarga.descartadas == 2
+    bloqueio_precarga.set()
+    _aguardar(lambda: precarga._pendentes == 0)
+    assert sorted(chamadas_precarga) == [1, 2]
+
+
+def test_chaves_ja_no_cache_nao_sao_agendadas(engine, precarga):
+    bloqueio_precarga.set()
+    _consulta_lenta(engine, 1)
+
+    assert precarga.agendar('sessao', [(_consulta_lenta, (engine, 1))]) == 0
+    assert precarga.agendadas == 0
+    assert chamadas_precarga == [1]
+
+
+def test_precarga_que_falha_nao_fica_no_cache(engine, precarga):
+    assert precarga.agendar('sessao', [(_consulta_instavel, (engine, 3))]) == 1
+    _aguardar(lambda: precarga._pendentes == 0)
+
+    chave = _consulta_instavel.chave(engine, 3)
+    assert not cache_consultas.contem(chave)
+    assert _consulta_instavel(engine, 3) == 3
+    assert chamadas_precarga == [3, 3]
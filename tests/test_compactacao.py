@@ -0,0 +1,94 @@
+"""
+Tipos compactos da carteira sem perda nos valores exportados e filtrados, e
+quanto a compactação economiza de memória.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from carteira import CarteiraCompartilhada, FiltroCarteira
+from compactacao import bytes_em_memoria, compactar_tipos, relatorio_memoria
+from database import Devedor, init_db, unit_of_work
+from devedores_service import load_devedores_from_db
+from priorizacao import FASE_MAXIMA
+from teste_carga import semear_banco
+
+VALORES = [1234.57, 0.1, 99999.99, 150000.03]
+
+
+@pytest.fixture
+def engine(engine):
+    with unit_of_work(engine) as session:
+        session.add_all([
+            Devedor(nome=f'devedor {i}', pessoa=f'P{i}', valortotal=valor,
+                    atraso=i) for i, valor in enumerate(VALORES)
+        ])
+    return engine
+
+
+def test_carteira_compacta_mantem_centavos(engine):
+    df = load_devedores_from_db(engine, compacto=True)
+    assert df['valortotal'].dtype == 'float64'
+    assert sorted(df['valortotal'].tolist()) == sorted(VALORES)
+
+
+def test_filtro_de_valor_inclui_as_bordas(engine):
+    carteira = CarteiraCompartilhada(
+        load_devedores_from_db(engine, compacto=True), 1)
+    posicoes = carteira.filtrar(FiltroCarteira(valor=(1234.57, 99999.99)))
+    assert sorted(carteira.df['valortotal'].iloc[posicoes]) == [
+        1234.57, 99999.99
+    ]
+
+
+def test_busca_por_telefone_em_qualquer_formato(engine):
+    with unit_of_work(engine) as session:
+        devedor = session.query(Devedor).filter_by(pessoa='P1').one()
+        devedor.telefone_normalizado = '+5511987654321'
+    carteira = CarteiraCompartilhada(
+        load_devedores_from_db(engine, compacto=True), 1)
+    for termo in ['(11) 98765-4321', '+55 11 98765 4321', '011987654321']:
+        posicoes = carteira.filtrar(FiltroCarteira(termo=termo))
+        assert carteira.df['pessoa'].iloc[posicoes].tolist() == ['P1']
+
+
+def _planilha_realista(linhas: int = 20000) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'pessoa': [f'P{i:06d}' for i in range(linhas)],
+        'nome': [f'Devedor {i}' for i in range(linhas)],
+        'valortotal': np.round(rng.gamma(2.0, 800.0, linhas), 2),
+        'atraso': rng.integers(0, 400, linhas),
+        'fase_cobranca': rng.integers(1, 4, linhas),
+        'status': rng.choice(['Pendente', 'Agendado', 'Pago', 'Em Aberto'],
+                             linhas).astype(object),
+        'telefone': [f'(11) 9{i % 10000:04d}-{i % 7919:04d}'
+                     for i in range(linhas)],
+    })
+
+
+def test_planilha_compacta_ocupa_um_terco_da_memoria():
+    original = _planilha_realista()
+    compacto = compactar_tipos(original)
+
+    assert bytes_em_memoria(original) >= 3 * bytes_em_memoria(compacto)
+    pd.testing.assert_frame_equal(compacto.astype(object),
+                                  original.astype(object))
+
+
+def test_relatorio_compara_cada_coluna(tmp_path):
+    engine = init_db(f"sqlite:///{tmp_path / 'carga.db'}")
+    semear_banco(engine, 5000)
+    original = load_devedores_from_db(engine)
+    compacto = load_devedores_from_db(engine, compacto=True)
+
+    relatorio = relatorio_memoria(original, compacto).set_index('coluna')
+
+    # A carga usa as mesmas fases que a interface e o score.
+    assert set(original['fase_cobranca']) == set(range(1, FASE_MAXIMA + 1))
+    assert set(relatorio.index) == set(original.columns)
+    assert relatorio['bytes_antes'].sum() == original.memory_usage(
+        deep=True, index=False).sum()
+    assert relatorio.loc['status', 'tipo_depois'] == 'category'
+    assert relatorio.loc['valortotal', 'reducao'] == 1.0
+    assert bytes_em_memoria(original) >= 2.5 * bytes_em_memoria(compacto)
@@ -0,0 +1,94 @@
+"""
+Baixas da conciliação de pagamentos: reenvio do arquivo, pagamentos parciais
+e lotes por pessoa.
+"""
+from functools import partial
+
+import pandas as pd
+import pytest
+
+import conciliacao
+from conciliacao import _lotes_por_pessoa, conciliar_arquivo_pagamentos
+from database import (Devedor, PagamentoConciliado, StatusDevedor,
+                      unit_of_work)
+
+
+@pytest.fixture
+def engine(engine):
+    with unit_of_work(engine) as session:
+        session.add_all([
+            Devedor(nome='devedor 1', pessoa='P1', valortotal=1000.0,
+                    atraso=30),
+            Devedor(nome='devedor 2', pessoa='P2', valortotal=250.0,
+                    atraso=10),
+        ])
+    return engine
+
+
+@pytest.fixture
+def arquivo(tmp_path):
+    caminho = tmp_path / 'pagamentos.csv'
+    caminho.write_text('pessoa;valor;data_pagamento\n'
+                       'P1;400,50;2025-06-02\n'
+                       'P2;250,00;2025-06-03\n', encoding='utf-8')
+    return str(caminho)
+
+
+def _devedor(engine, pessoa):
+    with unit_of_work(engine, somente_leitura=True) as session:
+        devedor = session.query(Devedor).filter_by(pessoa=pessoa).one()
+        return devedor.valortotal, devedor.status, devedor.versao
+
+
+def test_pagamento_parcial_abate_sem_quitar(engine, arquivo):
+    resultado = conciliar_arquivo_pagamentos(engine, arquivo)
+    assert resultado[0]
+    assert (resultado.quitados, resultado.parciais) == (1, 1)
+
+    valortotal, status, _ = _devedor(engine, 'P1')
+    assert valortotal == pytest.approx(599.50)
+    assert status != StatusDevedor.PAGO
+    assert _devedor(engine, 'P2')[1] == StatusDevedor.PAGO
+
+
+def test_mesmo_arquivo_duas_vezes_nao_abate_de_novo(engine, arquivo):
+    conciliar_arquivo_pagamentos(engine, arquivo)
+    antes = _devedor(engine, 'P1')
+
+    resultado = conciliar_arquivo_pagamentos(engine, arquivo)
+    assert resultado[0]
+    assert (resultado.quitados, resultado.parciais) == (0, 0)
+    assert resultado.nao_conciliados['motivo'].tolist() == [
+        'já conciliado', 'já conciliado'
+    ]
+    assert _devedor(engine, 'P1') == antes
+    with unit_of_work(engine, somente_leitura=True) as session:
+        assert session.query(PagamentoConciliado).count() == 2
+
+
+def test_lotes_nao_separam_pagamentos_da_mesma_pessoa():
+    pagamentos = pd.DataFrame({'chave': ['B', 'A', 'B', 'C', 'A', 'B', 'D']})
+    lotes = list(_lotes_por_pessoa(pagamentos, tamanho=2))
+
+    assert [sorted(lote['chave']) for lote in lotes] == [
+        ['A', 'A'], ['B', 'B', 'B'], ['C', 'D']
+    ]
+    assert sorted(pd.concat(lotes).index) == list(range(7))
+
+
+def test_conciliacao_em_lotes_soma_pagamentos_da_pessoa(engine, tmp_path,
+                                                        monkeypatch):
+    monkeypatch.setattr(conciliacao, '_lotes_por_pessoa',
+                        partial(_lotes_por_pessoa, tamanho=1))
+    caminho = tmp_path / 'parcelas.csv'
+    caminho.write_text('pessoa;valor;data_pagamento\n'
+                       'P1;600,00;2025-06-02\n'
+                       'P2;100,00;2025-06-02\n'
+                       'P1;400,00;2025-06-05\n', encoding='utf-8')
+
+    resultado = conciliar_arquivo_pagamentos(engine, str(caminho))
+
+    assert resultado[0], resultado[1]
+    assert (resultado.quitados, resultado.parciais) == (1, 1)
+    assert _devedor(engine, 'P1')[1] == StatusDevedor.PAGO
+    assert _devedor(engine, 'P2')[0] == pytest.approx(150.0)
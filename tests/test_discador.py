@@ -0,0 +1,52 @@
+"""
+Arquivos do discador gerados a partir de arquivos temporários.
+"""
+import csv
+import io
+import zipfile
+
+import pytest
+
+from database import Devedor, unit_of_work
+from discador import COLUNAS_DISCADOR, gerar_arquivo_discador
+
+
+@pytest.fixture
+def engine(engine):
+    with unit_of_work(engine) as session:
+        session.add_all([
+            Devedor(nome=f'devedor {i}', pessoa=f'P{i}', valortotal=100.0 * i,
+                    atraso=10 * i, telefone=f'11 98765-432{i}',
+                    telefone_normalizado=f'+551198765432{i}',
+                    telefone_valido=True) for i in range(1, 8)
+        ])
+    return engine
+
+
+def _linhas(conteudo: bytes):
+    return list(csv.reader(io.StringIO(conteudo.decode('utf-8'))))
+
+
+def test_um_agente_gera_csv_completo(engine):
+    conteudo, nome, mime, total = gerar_arquivo_discador(engine)
+    linhas = _linhas(conteudo)
+    assert nome.endswith('.csv') and mime == 'text/csv'
+    assert total == 7
+    assert linhas[0] == COLUNAS_DISCADOR
+    assert [linha[0] for linha in linhas[1:]] == [
+        f'devedor {i}' for i in range(7, 0, -1)
+    ]
+
+
+def test_agentes_recebem_as_mesmas_linhas_em_rodizio(engine):
+    csv_unico = _linhas(gerar_arquivo_discador(engine)[0])[1:]
+    conteudo, nome, mime, total = gerar_arquivo_discador(engine, agentes=3)
+    assert nome.endswith('.zip') and total == 7
+    with zipfile.ZipFile(io.BytesIO(conteudo)) as arquivo_zip:
+        por_agente = [
+            _linhas(arquivo_zip.read(nome_csv))[1:]
+            for nome_csv in sorted(arquivo_zip.namelist())
+        ]
+    assert [len(linhas) for linhas in por_agente] == [3, 2, 2]
+    assert por_agente[0] == csv_unico[0::3]
+    assert por_agente[1] == csv_unico[1::3]
@@ -0,0 +1,87 @@
+"""
+Edições da grade de devedores (Devedores.py) até o banco, com os tipos
+compactos da carteira compartilhada.
+"""
+import os
+import tempfile
+
+import pytest
+import streamlit as st
+
+# Devedores.py abre o banco padrão ao ser importado: um temporário, nunca o
+# cobrancas.db da raiz.
+os.environ['COBRANCAS_DATABASE_URL'] = 'sqlite:///' + os.path.join(
+    tempfile.mkdtemp(), 'padrao.db')
+
+import Devedores  # noqa: E402
+from carteira import CarteiraCompartilhada
+from database import Devedor, StatusDevedor, unit_of_work
+from devedores_service import (ConflitoVersao, load_devedores_from_db,
+                               remover_devedor_from_db, update_devedor_in_db)
+
+
+@pytest.fixture
+def engine(engine):
+    with unit_of_work(engine) as session:
+        session.add_all([
+            Devedor(nome=f'devedor {i}', pessoa=f'P{i}', valortotal=10.0 * i,
+                    atraso=i) for i in range(1, 4)
+        ])
+    st.session_state.db_engine = engine
+    st.session_state.should_reload_df = False
+    yield engine
+    del st.session_state.db_engine
+
+
+def _pagina(engine):
+    carteira = CarteiraCompartilhada(
+        load_devedores_from_db(engine, compacto=True), 1)
+    return carteira.linhas(carteira.filtrar(Devedores.FiltroCarteira()))
+
+
+def _status(engine):
+    with unit_of_work(engine, somente_leitura=True) as session:
+        return {
+            d.pessoa: (d.status, d.versao)
+            for d in session.query(Devedor)
+        }
+
+
+def test_edicao_de_status_chega_ao_banco(engine):
+    original = _pagina(engine)
+    editado = original.copy()
+    linha = editado.index[editado['pessoa'] == 'P2'][0]
+    editado.loc[linha, 'status'] = StatusDevedor.AGENDADO.value
+
+    Devedores.process_table_edits(editado, original)
+
+    status = _status(engine)
+    assert status['P2'] == (StatusDevedor.AGENDADO, 2)
+    assert status['P1'] == (StatusDevedor.PENDENTE, 1)
+    assert st.session_state.should_reload_df
+
+
+def test_edicao_sobre_versao_antiga_nao_grava(engine):
+    original = _pagina(engine)
+    devedor_id = int(original.loc[original['pessoa'] == 'P1', 'id'].iloc[0])
+    update_devedor_in_db(engine, devedor_id, {'nome': 'outro usuário'})
+
+    editado = original.copy()
+    linha = editado.index[editado['pessoa'] == 'P1'][0]
+    editado.loc[linha, 'status'] = StatusDevedor.PAGO.value
+    Devedores.process_table_edits(editado, original)
+
+    assert _status(engine)['P1'] == (StatusDevedor.PENDENTE, 2)
+
+
+def test_exclusao_sobre_versao_antiga_nao_remove(engine):
+    original = _pagina(engine)
+    linha = original[original['pessoa'] == 'P3'].iloc[0]
+    devedor_id, versao = int(linha['id']), int(linha['versao'])
+    update_devedor_in_db(engine, devedor_id, {'nome': 'outro usuário'})
+
+    resultado = remover_devedor_from_db(engine, devedor_id,
+                                        versao_esperada=versao)
+
+    assert isinstance(resultado, ConflitoVersao)
+    assert 'P3' in _status(engine)
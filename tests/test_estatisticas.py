@@ -0,0 +1,130 @@
+"""
+Manutenção incremental do catálogo de estatísticas e versões das tabelas.
+"""
+import numpy as np
+import pytest
+from sqlalchemy import update
+
+import database
+from database import Devedor, VersaoTabela, unit_of_work, versao_tabelas
+from estatisticas import (CatalogoEstatisticas, EstatisticaColuna,
+                          catalogo_estatisticas)
+
+
+@pytest.fixture
+def engine(engine):
+    with unit_of_work(engine) as session:
+        session.add_all([
+            Devedor(nome=f'devedor {i}', pessoa=f'P{i}', valortotal=100.0 * i,
+                    atraso=i) for i in range(1, 6)
+        ])
+    return engine
+
+
+def test_remover_extremo_desatualiza_faixa():
+    estatistica = EstatisticaColuna(np.array([1.0, 1.0, 2.0, 3.0]))
+    estatistica.remover(1.0)
+    assert not estatistica.extremo_removido
+    estatistica.remover(1.0)
+    assert estatistica.extremo_removido
+
+
+def test_adicionar_novo_extremo_recomeca_contagem():
+    estatistica = EstatisticaColuna(np.array([1.0, 2.0, 3.0]))
+    estatistica.adicionar(5.0)
+    estatistica.remover(3.0)
+    assert not estatistica.extremo_removido
+    assert estatistica.maximo == 5.0
+    estatistica.remover(5.0)
+    assert estatistica.extremo_removido
+
+
+def test_catalogo_reconstroi_ao_remover_o_maximo(engine):
+    catalogo = catalogo_estatisticas(engine)
+    assert catalogo.faixa('valortotal') == (100.0, 500.0)
+    with unit_of_work(engine) as session:
+        session.query(Devedor).filter_by(pessoa='P5').one().valortotal = 50.0
+    assert catalogo.faixa('valortotal') == (50.0, 400.0)
+
+
+def test_commit_do_processo_avanca_versao(engine):
+    antes = versao_tabelas(engine, 'devedores', 'fila_trabalho')
+    with unit_of_work(engine) as session:
+        session.query(Devedor).filter_by(pessoa='P1').one().nome = 'novo'
+    depois = versao_tabelas(engine, 'devedores', 'fila_trabalho')
+    assert depois == (antes[0] + 1, antes[1])
+
+
+def test_catalogo_aplica_commit_do_processo_sem_reconstruir(engine):
+    catalogo = catalogo_estatisticas(engine)
+    assert catalogo.resumo('valortotal')['soma'] == 1500.0
+    with unit_of_work(engine) as session:
+        session.query(Devedor).filter_by(pessoa='P2').one().valortotal = 250.0
+    assert not catalogo._obsoleto
+    assert catalogo.resumo('valortotal')['soma'] == 1550.0
+
+
+def test_catalogo_ve_commit_de_outro_processo(engine, monkeypatch):
+    monkeypatch.setattr(database, 'VALIDADE_VERSOES', 0.0)
+    catalogo = CatalogoEstatisticas(engine)
+    assert catalogo.total() == 5
+
+    # Outro processo: escrita e versão gravadas sem passar por esta sessão.
+    versoes = VersaoTabela.__table__
+    with engine.begin() as conn:
+        conn.execute(
+            Devedor.__table__.insert(), {
+                'nome': 'externo',
+                'pessoa': 'P9',
+                'valortotal': 900.0,
+                'atraso': 9,
+                'status': 'PENDENTE',
+                'fase_cobranca': 1
+            })
+        conn.execute(
+            update(versoes).where(versoes.c.tabela == 'devedores').values(
+                versao=versoes.c.versao + 1))
+
+    assert catalogo.total() == 6
+    assert catalogo.faixa('valortotal') == (100.0, 900.0)
+
+
+def test_reconstrucao_antes_da_versao_nao_conta_o_commit_duas_vezes(
+        engine, monkeypatch):
+    catalogo = catalogo_estatisticas(engine)
+    assert catalogo.resumo('valortotal')['soma'] == 1500.0
+    incrementar = database._incrementar_versoes
+
+    def reconstruir_e_incrementar(engine, tabelas):
+        # Outra thread lê o catálogo entre o commit dos dados e a versão.
+        catalogo.reconstruir()
+        return incrementar(engine, tabelas)
+
+    monkeypatch.setattr(database, '_incrementar_versoes',
+                        reconstruir_e_incrementar)
+    with unit_of_work(engine) as session:
+        session.query(Devedor).filter_by(pessoa='P2').one().valortotal = 250.0
+    monkeypatch.undo()
+
+    assert catalogo.resumo('valortotal')['soma'] == 1550.0
+
+
+def test_savepoints_do_grupo_incrementam_a_versao_uma_vez(engine):
+    antes, = versao_tabelas(engine, 'devedores')
+    with unit_of_work(engine) as session:
+        for pessoa in ('P1', 'P2', 'P3'):
+            with session.begin_nested():
+                session.query(Devedor).filter_by(
+                    pessoa=pessoa).one().atraso += 1
+    assert versao_tabelas(engine, 'devedores') == (antes + 1, )
+
+
+def test_falha_ao_incrementar_versao_nao_desfaz_o_commit(engine, monkeypatch):
+    def falhar(engine, tabelas):
+        raise RuntimeError('banco ocupado')
+
+    monkeypatch.setattr(database, '_incrementar_versoes', falhar)
+    with unit_of_work(engine) as session:
+        session.query(Devedor).filter_by(pessoa='P1').one().nome = 'novo'
+    with unit_of_work(engine, somente_leitura=True) as session:
+        assert session.query(Devedor).filter_by(nome='novo').count() == 1
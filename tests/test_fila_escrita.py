@@ -0,0 +1,106 @@
+"""
+Isolamento das operações de um grupo na fila de escrita e o que quem chamou
+recebe quando a espera passa do limite.
+"""
+import threading
+
+import pytest
+
+import devedores_service
+import fila_escrita as fila_escrita_mod
+from database import Devedor, unit_of_work
+from devedores_service import ResultadoIncerto, update_devedor_in_db
+from fila_escrita import EscritaIncerta, FilaEscrita
+
+
+@pytest.fixture
+def engine(engine):
+    with unit_of_work(engine) as session:
+        session.add(Devedor(nome='existente', pessoa='P1', valortotal=1.0,
+                            atraso=1))
+    return engine
+
+
+execucoes = []
+
+
+def _adicionar(session, pessoa):
+    # Sem flush: a violação de unicidade só aparece no commit do savepoint.
+    execucoes.append(pessoa)
+    session.add(Devedor(nome=pessoa, pessoa=pessoa, valortotal=1.0, atraso=1))
+    return True, pessoa
+
+
+def test_erro_no_flush_do_savepoint_afeta_so_a_operacao(engine):
+    fila = FilaEscrita(engine, intervalo=0.5)
+    futuros = [
+        fila.submeter(_adicionar, 'P2'),
+        fila.submeter(_adicionar, 'P1'),
+        fila.submeter(_adicionar, 'P3'),
+    ]
+
+    assert futuros[0].result(timeout=10) == (True, 'P2')
+    with pytest.raises(Exception):
+        futuros[1].result(timeout=10)
+    assert futuros[2].result(timeout=10) == (True, 'P3')
+    with unit_of_work(engine, somente_leitura=True) as session:
+        pessoas = sorted(p for (p, ) in session.query(Devedor.pessoa))
+    assert pessoas == ['P1', 'P2', 'P3']
+    # O grupo não foi desfeito e refeito operação por operação.
+    assert execucoes == ['P2', 'P1', 'P3']
+
+
+def _pessoas(engine):
+    with unit_of_work(engine, somente_leitura=True) as session:
+        return sorted(p for (p, ) in session.query(Devedor.pessoa))
+
+
+def _adicionar_depois(session, pessoa, liberar):
+    liberar.wait(timeout=10)
+    return _adicionar(session, pessoa)
+
+
+def test_timeout_na_fila_cancela_a_operacao(engine, monkeypatch):
+    fila = FilaEscrita(engine, intervalo=0)
+    liberar = threading.Event()
+    ocupada = fila.submeter(_adicionar_depois, 'P2', liberar)
+    monkeypatch.setattr(fila_escrita_mod, 'TIMEOUT_ESCRITA', 0.2)
+
+    with pytest.raises(TimeoutError) as erro:
+        fila.executar(_adicionar, 'P3')
+    assert not isinstance(erro.value, EscritaIncerta)
+
+    liberar.set()
+    assert ocupada.result(timeout=10) == (True, 'P2')
+    # A operação cancelada não é executada quando o escritor fica livre.
+    fila.submeter(_adicionar, 'P4').result(timeout=10)
+    assert _pessoas(engine) == ['P1', 'P2', 'P4']
+
+
+def test_timeout_em_execucao_tem_resultado_incerto(engine, monkeypatch):
+    fila = FilaEscrita(engine, intervalo=0)
+    liberar = threading.Event()
+    monkeypatch.setattr(fila_escrita_mod, 'TIMEOUT_ESCRITA', 0.2)
+
+    with pytest.raises(EscritaIncerta):
+        fila.executar(_adicionar_depois, 'P2', liberar)
+
+    # A escrita continua e é gravada depois do timeout.
+    liberar.set()
+    fila.submeter(_adicionar, 'P3').result(timeout=10)
+    assert _pessoas(engine) == ['P1', 'P2', 'P3']
+
+
+def test_servico_com_escrita_incerta_nao_informa_falha(engine, monkeypatch):
+
+    class FilaLenta:
+
+        def executar(self, func, *args, **kwargs):
+            raise EscritaIncerta('escrita ainda em andamento')
+
+    monkeypatch.setattr(devedores_service, 'fila_escrita',
+                        lambda engine: FilaLenta())
+
+    resultado = update_devedor_in_db(engine, 1, {'nome': 'novo'})
+    assert isinstance(resultado, ResultadoIncerto)
+    assert resultado[0] is None
@@ -0,0 +1,179 @@
+"""
+Materialização da fila de trabalho em lotes, posição dos devedores após
+atualizações incrementais e ranking da carteira pelo score salvo.
+"""
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import select, update
+
+import fila_trabalho
+from database import (Devedor, ItemFilaTrabalho, StatusDevedor, init_db,
+                      unit_of_work)
+from devedores_service import (get_devedores_por_score_count,
+                               get_devedores_por_score_paginated,
+                               marcar_como_pago_in_db)
+from fila_trabalho import atualizar_fila, materializar_fila_do_dia
+from priorizacao import calcular_scores
+
+HOJE = date(2025, 6, 10)
+
+
+@pytest.fixture
+def engine(engine):
+    with unit_of_work(engine) as session:
+        session.add_all([
+            Devedor(nome=f'devedor {i}', pessoa=f'P{i}', valortotal=100.0 * i,
+                    atraso=10 * i, atraso_referencia=HOJE)
+            for i in range(1, 9)
+        ])
+    materializar_fila_do_dia(engine, HOJE)
+    return engine
+
+
+def _fila(engine):
+    with unit_of_work(engine, somente_leitura=True) as session:
+        return session.execute(
+            select(ItemFilaTrabalho.devedor_id, ItemFilaTrabalho.prioridade,
+                   ItemFilaTrabalho.score_prioridade).order_by(
+                       ItemFilaTrabalho.prioridade)).all()
+
+
+def _definir_scores(engine, scores):
+    with unit_of_work(engine) as session:
+        for devedor_id, score in scores.items():
+            session.execute(
+                update(Devedor).where(Devedor.id == devedor_id).values(
+                    score_prioridade=score))
+        atualizar_fila(session, list(scores), HOJE)
+
+
+def _em_ordem_de_score(fila):
+    prioridades = [item.prioridade for item in fila]
+    chaves = [(-(item.score_prioridade or -1), item.devedor_id) for item in fila]
+    return (prioridades == sorted(set(prioridades))
+            and chaves == sorted(chaves))
+
+
+def test_devedor_alterado_volta_na_posicao_do_score(engine):
+    fila = _fila(engine)
+    ultimo = fila[-1].devedor_id
+    _definir_scores(engine, {ultimo: fila[0].score_prioridade + 1})
+
+    fila = _fila(engine)
+    assert fila[0].devedor_id == ultimo
+    assert _em_ordem_de_score(fila)
+
+
+def test_lote_no_meio_da_fila(engine):
+    fila = _fila(engine)
+    meio = (fila[3].score_prioridade + fila[4].score_prioridade) / 2
+    _definir_scores(engine, {
+        fila[0].devedor_id: meio,
+        fila[-1].devedor_id: meio,
+        fila[5].devedor_id:
+        (fila[1].score_prioridade + fila[2].score_prioridade) / 2,
+    })
+
+    nova = _fila(engine)
+    assert len(nova) == len(fila)
+    assert _em_ordem_de_score(nova)
+    # Os itens antes do primeiro reposicionado não mudam.
+    assert nova[0].devedor_id == fila[1].devedor_id
+    assert nova[0].prioridade == fila[1].prioridade
+    assert nova[1].devedor_id == fila[5].devedor_id
+
+
+def test_materializacao_em_lotes_envelhece_e_pontua_todos(tmp_path,
+                                                          monkeypatch):
+    engine = init_db(f"sqlite:///{tmp_path / 'lotes.db'}")
+    with unit_of_work(engine) as session:
+        session.add_all([
+            Devedor(nome=f'devedor {i}', pessoa=f'P{i}', valortotal=100.0 * i,
+                    atraso=10 * i, atraso_referencia=HOJE - timedelta(days=2))
+            for i in range(1, 8)
+        ] + [
+            Devedor(nome='pago', pessoa='PAGO', valortotal=1.0, atraso=1,
+                    status=StatusDevedor.PAGO, score_prioridade=50.0)
+        ])
+    operacoes = []
+    escrever = fila_trabalho.escrever
+
+    def registrar(db_object, func, *args):
+        operacoes.append(func.__name__)
+        return escrever(db_object, func, *args)
+
+    monkeypatch.setattr(fila_trabalho, 'escrever', registrar)
+
+    assert materializar_fila_do_dia(engine, HOJE, tamanho_lote=3) == 7
+
+    # Três lotes (3 + 3 + 1 em aberto), cada um uma operação da fila.
+    assert operacoes == (['_preparar_lote'] * 3 + ['_iniciar_fila'] +
+                         ['_gravar_lote_fila'] * 3 + ['_concluir_fila'])
+    with unit_of_work(engine, somente_leitura=True) as session:
+        devedores = session.execute(
+            select(Devedor.status, Devedor.valortotal, Devedor.atraso,
+                   Devedor.fase_cobranca, Devedor.ultima_cobranca,
+                   Devedor.score_prioridade).order_by(Devedor.id)).all()
+    abertos = [d for d in devedores if d.status != StatusDevedor.PAGO]
+    assert [d.atraso for d in abertos] == [10 * i + 2 for i in range(1, 8)]
+    esperados = calcular_scores([d.valortotal for d in abertos],
+                                [d.atraso for d in abertos],
+                                [d.fase_cobranca for d in abertos],
+                                [d.ultima_cobranca for d in abertos], HOJE)
+    assert [d.score_prioridade for d in abertos] == pytest.approx(
+        esperados.tolist())
+    assert devedores[-1].score_prioridade is None
+    assert _em_ordem_de_score(_fila(engine))
+
+
+def test_recriacao_em_lotes_remove_itens_que_nao_exigem_mais_acao(engine):
+    fila = _fila(engine)
+    pago = fila[2].devedor_id
+    with unit_of_work(engine) as session:
+        session.execute(
+            update(Devedor).where(Devedor.id == pago).values(
+                status=StatusDevedor.PAGO))
+
+    amanha = HOJE + timedelta(days=1)
+    assert materializar_fila_do_dia(engine, amanha, tamanho_lote=3) == 7
+
+    nova = _fila(engine)
+    assert pago not in {item.devedor_id for item in nova}
+    assert [item.prioridade for item in nova] == list(range(1, 8))
+    assert _em_ordem_de_score(nova)
+
+
+def test_ranking_por_score_pagina_os_devedores_em_aberto(engine):
+    assert marcar_como_pago_in_db(engine, 8)[0]
+    with unit_of_work(engine, somente_leitura=True) as session:
+        esperado = [
+            devedor_id for devedor_id, _ in sorted(
+                session.execute(
+                    select(Devedor.id, Devedor.score_prioridade).where(
+                        Devedor.status != StatusDevedor.PAGO)).all(),
+                key=lambda d: (-d[1], d[0]))
+        ]
+
+    paginas = [
+        get_devedores_por_score_paginated(engine, pagina, 3)['id'].tolist()
+        for pagina in range(3)
+    ]
+    assert get_devedores_por_score_count(engine) == 7
+    assert [len(p) for p in paginas] == [3, 3, 1]
+    assert sum(paginas, []) == esperado
+
+
+def test_ranking_por_score_percorre_o_indice(engine):
+    consulta = select(Devedor.id).where(
+        Devedor.score_prioridade.isnot(None)).order_by(
+            Devedor.score_prioridade.desc(), Devedor.id).limit(3).offset(3)
+    with engine.connect() as conn:
+        plano = [
+            linha[-1] for linha in conn.exec_driver_sql(
+                'EXPLAIN QUERY PLAN ' + str(
+                    consulta.compile(compile_kwargs={'literal_binds': True})))
+        ]
+    assert any('ix_devedores_score_prioridade_id' in p for p in plano)
+    # A ordem vem do índice: sem ordenação à parte.
+    assert not any('ORDER BY' in p for p in plano)
@@ -0,0 +1,176 @@
+"""
+Importação de planilhas de devedores pela tabela de staging.
+"""
+import io
+from datetime import date
+
+import pandas as pd
+import pytest
+from sqlalchemy import func, select
+
+import devedores_service
+
+from carteira import CarteiraCompartilhada, FiltroCarteira
+from database import Devedor, ItemFilaTrabalho, unit_of_work
+from devedores_service import (buscar_devedores_por_telefone,
+                               import_excel_to_db, load_devedores_from_db)
+from fila_trabalho import materializar_fila_do_dia
+
+
+@pytest.fixture
+def engine(engine):
+    with unit_of_work(engine) as session:
+        session.add_all([
+            Devedor(nome=f'antigo {i}', pessoa=f'A{i}', valortotal=100.0 * i,
+                    atraso=10 * i, atraso_referencia=date.today())
+            for i in range(1, 6)
+        ])
+    materializar_fila_do_dia(engine)
+    return engine
+
+
+def _planilha(linhas) -> io.BytesIO:
+    arquivo = io.BytesIO()
+    pd.DataFrame(linhas).to_excel(arquivo, index=False)
+    arquivo.seek(0)
+    return arquivo
+
+
+def _fila(engine):
+    with unit_of_work(engine, somente_leitura=True) as session:
+        return session.execute(
+            select(ItemFilaTrabalho.pessoa, ItemFilaTrabalho.prioridade,
+                   ItemFilaTrabalho.score_prioridade).order_by(
+                       ItemFilaTrabalho.prioridade)).all()
+
+
+def test_importacao_pontua_e_enfileira_so_os_novos(engine):
+    antes = {item.pessoa: item for item in _fila(engine)}
+    resultado = import_excel_to_db(engine, _planilha([
+        {'pessoa': 'A1', 'nome': 'repetido', 'valortotal': 1.0, 'atraso': 1},
+        {'pessoa': 'N1', 'nome': 'novo 1', 'valortotal': 9000.0, 'atraso': 300},
+        {'pessoa': 'N2', 'nome': 'novo 2', 'valortotal': 50.0, 'atraso': 2},
+    ]))
+
+    assert resultado[0], resultado[1]
+    assert 'Adicionados: 2' in resultado[1]
+    fila = _fila(engine)
+    assert [item.pessoa for item in fila][0] == 'N1'
+    assert {'N1', 'N2'} <= {item.pessoa for item in fila}
+    assert all(item.score_prioridade is not None for item in fila)
+    # Scores dos devedores que já existiam não são recalculados.
+    for item in fila:
+        if item.pessoa in antes:
+            assert item.score_prioridade == antes[item.pessoa].score_prioridade
+    chaves = [(-item.score_prioridade, item.prioridade) for item in fila]
+    assert chaves == sorted(chaves)
+
+
+def test_importacao_normaliza_telefones_em_varios_formatos(engine):
+    resultado = import_excel_to_db(engine, _planilha([
+        {'pessoa': 'T1', 'nome': 'celular formatado', 'valortotal': 1.0,
+         'atraso': 1, 'telefone': '(11) 98765-4321'},
+        {'pessoa': 'T2', 'nome': 'celular numérico', 'valortotal': 1.0,
+         'atraso': 1, 'telefone': 5521987654322},
+        {'pessoa': 'T3', 'nome': 'fixo', 'valortotal': 1.0,
+         'atraso': 1, 'telefone': '(21) 3456-7890'},
+        {'pessoa': 'T4', 'nome': 'inválido', 'valortotal': 1.0,
+         'atraso': 1, 'telefone': '123-45'},
+        {'pessoa': 'T5', 'nome': 'sem telefone', 'valortotal': 1.0,
+         'atraso': 1, 'telefone': None},
+    ]))
+    assert resultado[0], resultado[1]
+
+    with unit_of_work(engine, somente_leitura=True) as session:
+        gravados = {
+            pessoa: (normalizado, valido)
+            for pessoa, normalizado, valido in session.execute(
+                select(Devedor.pessoa, Devedor.telefone_normalizado,
+                       Devedor.telefone_valido).where(
+                           Devedor.pessoa.like('T%')))
+        }
+    assert gravados == {
+        'T1': ('+5511987654321', True),
+        'T2': ('+5521987654322', True),
+        'T3': ('+552134567890', True),
+        'T4': (None, False),
+        'T5': (None, False),
+    }
+
+    carteira = CarteiraCompartilhada(
+        load_devedores_from_db(engine, compacto=True), 1)
+    for termo, pessoa in [('+55 11 98765 4321', 'T1'),
+                          ('(21) 98765-4322', 'T2'),
+                          ('+55 21 3456 7890', 'T3')]:
+        posicoes = carteira.filtrar(FiltroCarteira(termo=termo))
+        assert carteira.df['pessoa'].iloc[posicoes].tolist() == [pessoa]
+        assert buscar_devedores_por_telefone(
+            engine, termo)['pessoa'].tolist() == [pessoa]
+    assert buscar_devedores_por_telefone(engine, '123-45').empty
+
+
+def test_busca_por_telefone_usa_o_indice(engine):
+    consulta = select(Devedor.id).where(
+        Devedor.telefone_normalizado == '+5511987654321')
+    with engine.connect() as conn:
+        plano = ' '.join(
+            linha[-1] for linha in conn.exec_driver_sql(
+                'EXPLAIN QUERY PLAN ' + str(
+                    consulta.compile(compile_kwargs={'literal_binds': True}))))
+    assert 'ix_devedores_telefone_normalizado' in plano
+
+
+def _novos(n):
+    return [{'pessoa': f'L{i}', 'nome': f'lote {i}', 'valortotal': 10.0 * i,
+             'atraso': i} for i in range(1, n + 1)]
+
+
+def _total_devedores(engine):
+    with unit_of_work(engine, somente_leitura=True) as session:
+        return session.execute(select(func.count(Devedor.id))).scalar()
+
+
+def test_importacao_em_lotes(engine, monkeypatch):
+    monkeypatch.setattr(devedores_service, 'LINHAS_POR_OPERACAO', 2)
+    lotes = []
+    gravar = devedores_service._gravar_importacao
+
+    def registrar(session, colunas, registros):
+        lotes.append(len(registros))
+        return gravar(session, colunas, registros)
+
+    monkeypatch.setattr(devedores_service, '_gravar_importacao', registrar)
+
+    resultado = import_excel_to_db(engine, _planilha(_novos(5)))
+
+    assert resultado[0], resultado[1]
+    assert 'Adicionados: 5' in resultado[1]
+    assert lotes == [2, 2, 1]
+    assert _total_devedores(engine) == 10
+
+
+def test_importacao_interrompida_informa_o_que_foi_gravado(engine,
+                                                          monkeypatch):
+    monkeypatch.setattr(devedores_service, 'LINHAS_POR_OPERACAO', 2)
+    gravar = devedores_service._gravar_importacao
+    chamadas = []
+
+    def falhar_no_segundo(session, colunas, registros):
+        chamadas.append(1)
+        if len(chamadas) == 2:
+            raise RuntimeError('disco cheio')
+        return gravar(session, colunas, registros)
+
+    monkeypatch.setattr(devedores_service, '_gravar_importacao',
+                        falhar_no_segundo)
+    resultado = import_excel_to_db(engine, _planilha(_novos(5)))
+
+    assert resultado[0] is None
+    assert 'Adicionados antes da interrupção: 2' in resultado[1]
+    assert _total_devedores(engine) == 7
+
+    # Reimportar completa sem duplicar os já gravados.
+    monkeypatch.setattr(devedores_service, '_gravar_importacao', gravar)
+    resultado = import_excel_to_db(engine, _planilha(_novos(5)))
+    assert 'Adicionados: 3' in resultado[1]
+    assert _total_devedores(engine) == 10
@@ -0,0 +1,116 @@
+"""
+Migração de bancos SQLite anteriores ao AUTOINCREMENT em `devedores` e de
+índices que deixaram de ser usados.
+"""
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import MetaData, create_engine, select
+from sqlalchemy.schema import CreateTable
+
+from database import (INDICES_REMOVIDOS, Base, Devedor, DevedorArquivado,
+                      ExecucaoFilaTrabalho, ItemFilaTrabalho,
+                      PagamentoConciliado, StatusDevedor, init_db,
+                      unit_of_work)
+
+ARQUIVADO_EM = datetime(2025, 5, 1)
+
+
+def _devedor(id, pessoa, **extras):
+    return {
+        'id': id, 'pessoa': pessoa, 'nome': f'devedor {pessoa}',
+        'valortotal': 100.0 * id, 'atraso': id, 'status': 'PENDENTE',
+        'fase_cobranca': 1, 'versao': 1, **extras
+    }
+
+
+def _pagamento(devedor_id, pessoa, conciliado_em):
+    return {
+        'pessoa': pessoa, 'valor': 10.0, 'data_pagamento': conciliado_em,
+        'ocorrencia': 1, 'devedor_id': devedor_id,
+        'conciliado_em': conciliado_em
+    }
+
+
+@pytest.fixture
+def url(tmp_path):
+    """Banco antigo: o id 3 foi arquivado e reutilizado por P4."""
+    url = f"sqlite:///{tmp_path / 'antigo.db'}"
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    antiga = Devedor.__table__.to_metadata(MetaData())
+    antiga.dialect_options['sqlite']['autoincrement'] = False
+    with engine.begin() as conn:
+        conn.exec_driver_sql('DROP TABLE devedores')
+        conn.execute(CreateTable(antiga))
+        conn.execute(antiga.insert(), [
+            _devedor(1, 'P1'), _devedor(2, 'P2'), _devedor(3, 'P4')
+        ])
+        conn.execute(DevedorArquivado.__table__.insert(), [
+            _devedor(3, 'P3', status='PAGO', arquivado_em=ARQUIVADO_EM)
+        ])
+        conn.execute(PagamentoConciliado.__table__.insert(), [
+            _pagamento(3, 'P3', datetime(2025, 4, 1)),
+            _pagamento(3, 'P4', datetime(2025, 6, 1)),
+            _pagamento(1, 'P1', datetime(2025, 6, 1)),
+        ])
+        conn.execute(ItemFilaTrabalho.__table__.insert(), [{
+            'devedor_id': devedor_id, 'data_referencia': date(2025, 6, 2),
+            'prioridade': devedor_id, 'nome': 'x', 'valortotal': 1.0,
+            'atraso': 1, 'status': 'PENDENTE', 'fase_cobranca': 1
+        } for devedor_id in (1, 3)])
+        conn.execute(ExecucaoFilaTrabalho.__table__.insert(), {
+            'data_referencia': date(2025, 6, 2),
+            'gerada_em': datetime(2025, 6, 2),
+            'total': 2
+        })
+    engine.dispose()
+    return url
+
+
+def test_id_reutilizado_leva_referencias_para_o_id_novo(url):
+    engine = init_db(url)
+    with unit_of_work(engine, somente_leitura=True) as session:
+        ids = dict(session.execute(select(Devedor.pessoa, Devedor.id)).all())
+        pagamentos = dict(
+            session.execute(
+                select(PagamentoConciliado.pessoa,
+                       PagamentoConciliado.devedor_id)).all())
+        fila = session.execute(
+            select(ItemFilaTrabalho.devedor_id).order_by(
+                ItemFilaTrabalho.devedor_id)).scalars().all()
+        execucoes = session.query(ExecucaoFilaTrabalho).count()
+
+    assert ids == {'P1': 1, 'P2': 2, 'P4': 4}
+    # O pagamento anterior ao arquivamento continua com o devedor arquivado.
+    assert pagamentos == {'P3': 3, 'P4': 4, 'P1': 1}
+    assert fila == [1, 4]
+    assert execucoes == 0
+
+
+def test_novos_devedores_nao_reutilizam_ids(url):
+    engine = init_db(url)
+    with unit_of_work(engine) as session:
+        novo = Devedor(nome='novo', pessoa='P5', valortotal=1.0, atraso=1,
+                       status=StatusDevedor.PENDENTE)
+        session.add(novo)
+        session.flush()
+        assert novo.id == 5
+
+
+def test_indices_sem_uso_sao_removidos(url):
+    engine = create_engine(url)
+    with engine.begin() as conn:
+        conn.exec_driver_sql('CREATE INDEX ix_devedores_score_prioridade '
+                             'ON devedores (score_prioridade)')
+    engine.dispose()
+
+    engine = init_db(url)
+    with engine.connect() as conn:
+        indices = set(
+            conn.exec_driver_sql("SELECT name FROM sqlite_master "
+                                 "WHERE type = 'index'").scalars())
+    assert {'ix_devedores_pessoa_normalizada',
+            'ix_devedores_telefone_normalizado',
+            'ix_devedores_score_prioridade_id'} <= indices
+    assert not indices & set(INDICES_REMOVIDOS)
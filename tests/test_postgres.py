@@ -0,0 +1,310 @@
+"""
+Caminhos da aplicação que dependem do dialeto, rodando no PostgreSQL:
+migração do esquema, importação por staging, conciliação, visão histórica e
+renumeração da fila de trabalho.
+
+Usa o banco descartável de COBRANCAS_TEST_POSTGRES_URL (ver conftest.py);
+sem a variável, os testes são pulados. Cada teste recria o schema `public`.
+"""
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, inspect, select, update
+
+import database
+from arquivamento import arquivar_pagos
+from conciliacao import conciliar_pagamentos
+from database import (Base, Devedor, ItemFilaTrabalho, PagamentoConciliado,
+                      StatusDevedor, VersaoTabela, devedores_historico,
+                      init_db, unit_of_work, versao_tabelas)
+from devedores_service import (get_devedores_por_score_paginated,
+                               import_excel_to_db)
+from fila_trabalho import atualizar_fila, materializar_fila_do_dia
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get('COBRANCAS_TEST_POSTGRES_URL'),
+    reason='COBRANCAS_TEST_POSTGRES_URL não definida')
+
+
+@pytest.fixture
+def banco():
+    return 'postgresql'
+
+
+def _indices(engine, tabela):
+    with engine.connect() as conn:
+        return set(
+            conn.exec_driver_sql(
+                'SELECT indexname FROM pg_indexes WHERE tablename = %(t)s',
+                {'t': tabela}).scalars())
+
+
+def test_init_db_migra_banco_antigo(postgres_url):
+    antigo = create_engine(postgres_url)
+    Base.metadata.create_all(antigo)
+    with antigo.begin() as conn:
+        conn.exec_driver_sql('DROP INDEX ix_devedores_pessoa_normalizada')
+        conn.exec_driver_sql('ALTER TABLE devedores DROP COLUMN versao')
+        conn.exec_driver_sql('ALTER TABLE devedores DROP COLUMN telefone_valido')
+        conn.exec_driver_sql('CREATE INDEX ix_devedores_score_prioridade '
+                             'ON devedores (score_prioridade)')
+        conn.exec_driver_sql(
+            "INSERT INTO devedores (pessoa, nome, valortotal, atraso, status, "
+            "fase_cobranca) VALUES ('P1', 'antigo', 10, 1, 'PENDENTE', 1)")
+    antigo.dispose()
+
+    engine = init_db(postgres_url)
+    colunas = {c['name'] for c in inspect(engine).get_columns('devedores')}
+    assert {'versao', 'telefone_valido'} <= colunas
+    indices = _indices(engine, 'devedores')
+    assert {'ix_devedores_pessoa_normalizada',
+            'ix_devedores_telefone_normalizado'} <= indices
+    assert 'ix_devedores_score_prioridade' not in indices
+    with unit_of_work(engine, somente_leitura=True) as session:
+        assert session.execute(select(Devedor.versao)).scalar() == 1
+
+    # Rodar a migração de novo não tenta recriar o que já existe.
+    database._migrar_schema(engine)
+    database._criar_visao_historico(engine)
+
+
+def _planilha(linhas) -> io.BytesIO:
+    arquivo = io.BytesIO()
+    pd.DataFrame(linhas).to_excel(arquivo, index=False)
+    arquivo.seek(0)
+    return arquivo
+
+
+def test_importacao_via_staging(engine):
+    with unit_of_work(engine) as session:
+        session.add(Devedor(nome='existente', pessoa='A1', valortotal=1.0,
+                            atraso=1, atraso_referencia=date.today()))
+    materializar_fila_do_dia(engine)
+
+    resultado = import_excel_to_db(engine, _planilha([
+        {'pessoa': ' a1 ', 'nome': 'repetido', 'valortotal': 1.0,
+         'atraso': 1, 'status': None},
+        {'pessoa': 'N1', 'nome': 'novo 1', 'valortotal': 900.0,
+         'atraso': 30, 'status': None},
+        {'pessoa': 'N2', 'nome': 'novo 2', 'valortotal': 50.0, 'atraso': 2,
+         'status': 'AGENDADO'},
+    ]))
+
+    assert resultado[0], resultado[1]
+    assert 'Adicionados: 2' in resultado[1]
+    with unit_of_work(engine, somente_leitura=True) as session:
+        status = dict(
+            session.execute(select(Devedor.pessoa, Devedor.status)).all())
+        na_fila = set(
+            session.execute(select(ItemFilaTrabalho.pessoa)).scalars())
+    assert status == {
+        'A1': StatusDevedor.PENDENTE,
+        'N1': StatusDevedor.PENDENTE,
+        'N2': StatusDevedor.AGENDADO,
+    }
+    # N2 está agendado sem data para hoje: não exige ação.
+    assert na_fila == {'A1', 'N1'}
+
+
+def _pagamentos(linhas):
+    return pd.DataFrame(linhas, columns=['pessoa', 'valor', 'data_pagamento'])
+
+
+def test_conciliacao_baixa_e_nao_repete(engine):
+    with unit_of_work(engine) as session:
+        session.add_all([
+            Devedor(nome='devedor 1', pessoa='P1', valortotal=1000.0,
+                    atraso=30),
+            Devedor(nome='devedor 2', pessoa='P2', valortotal=250.0,
+                    atraso=10),
+        ])
+    arquivo = _pagamentos([
+        ('p1', '400,50', '2025-06-02'),
+        ('P2', '200,00', '2025-06-03'),
+        ('P2', '50,00', '2025-06-04'),
+        ('P9', '10,00', '2025-06-04'),
+    ])
+
+    resultado = conciliar_pagamentos(engine, arquivo, 'hash')
+    assert resultado[0], resultado[1]
+    assert (resultado.quitados, resultado.parciais) == (1, 1)
+    assert resultado.nao_conciliados['motivo'].tolist() == [
+        'pessoa não encontrada na carteira'
+    ]
+
+    reenvio = conciliar_pagamentos(engine, arquivo, 'hash')
+    assert (reenvio.quitados, reenvio.parciais) == (0, 0)
+
+    with unit_of_work(engine, somente_leitura=True) as session:
+        devedores = {
+            d.pessoa: d
+            for d in session.execute(
+                select(Devedor.pessoa, Devedor.valortotal, Devedor.status,
+                       Devedor.data_pagamento, Devedor.versao))
+        }
+        conciliados = session.query(PagamentoConciliado).count()
+    assert devedores['P1'].valortotal == pytest.approx(599.50)
+    assert devedores['P1'].status == StatusDevedor.PENDENTE
+    assert devedores['P2'].status == StatusDevedor.PAGO
+    assert devedores['P2'].data_pagamento == datetime(2025, 6, 4)
+    assert devedores['P2'].versao == 2
+    assert conciliados == 3
+
+
+def test_visao_historico_une_ativos_e_arquivados(engine):
+    pago_em = datetime.now() - timedelta(days=200)
+    with unit_of_work(engine) as session:
+        session.add_all([
+            Devedor(nome='ativo', pessoa='P1', valortotal=10.0, atraso=1),
+            Devedor(nome='pago', pessoa='P2', valortotal=20.0, atraso=2,
+                    status=StatusDevedor.PAGO, data_pagamento=pago_em),
+        ])
+
+    assert arquivar_pagos(engine, dias=90) == 1
+
+    with unit_of_work(engine, somente_leitura=True) as session:
+        historico = session.execute(
+            select(devedores_historico.c.pessoa, devedores_historico.c.status,
+                   devedores_historico.c.arquivado).order_by(
+                       devedores_historico.c.pessoa)).all()
+    assert [tuple(linha) for linha in historico] == [
+        ('P1', 'PENDENTE', 0),
+        ('P2', 'PAGO', 1),
+    ]
+
+
+def test_fila_renumerada_apos_atualizacao(engine):
+    hoje = date(2025, 6, 10)
+    with unit_of_work(engine) as session:
+        session.add_all([
+            Devedor(nome=f'devedor {i}', pessoa=f'P{i}', valortotal=100.0 * i,
+                    atraso=10 * i, atraso_referencia=hoje)
+            for i in range(1, 9)
+        ])
+    materializar_fila_do_dia(engine, hoje, tamanho_lote=3)
+
+    def fila():
+        with unit_of_work(engine, somente_leitura=True) as session:
+            return session.execute(
+                select(ItemFilaTrabalho.devedor_id, ItemFilaTrabalho.prioridade,
+                       ItemFilaTrabalho.score_prioridade).order_by(
+                           ItemFilaTrabalho.prioridade)).all()
+
+    antes = fila()
+    assert [item.prioridade for item in antes] == list(range(1, 9))
+    ultimo = antes[-1].devedor_id
+    with unit_of_work(engine) as session:
+        session.execute(
+            update(Devedor).where(Devedor.id == ultimo).values(
+                score_prioridade=antes[0].score_prioridade + 1))
+        atualizar_fila(session, [ultimo], hoje)
+
+    depois = fila()
+    assert depois[0].devedor_id == ultimo
+    assert [item.prioridade for item in depois] == list(range(1, 9))
+    chaves = [(-item.score_prioridade, item.devedor_id) for item in depois]
+    assert chaves == sorted(chaves)
+
+
+def test_ranking_por_score_usa_o_indice_parcial(engine):
+    with unit_of_work(engine) as session:
+        session.add_all([
+            Devedor(nome=f'devedor {i}', pessoa=f'P{i}', valortotal=100.0 * i,
+                    atraso=i, score_prioridade=None if i % 4 == 0 else i % 5)
+            for i in range(1, 13)
+        ])
+
+    paginas = sum([
+        get_devedores_por_score_paginated(engine, pagina, 4)['id'].tolist()
+        for pagina in range(3)
+    ], [])
+    with unit_of_work(engine, somente_leitura=True) as session:
+        esperado = session.execute(
+            select(Devedor.id).where(Devedor.score_prioridade.isnot(None))
+            .order_by(Devedor.score_prioridade.desc(),
+                      Devedor.id)).scalars().all()
+    assert paginas == esperado
+
+    with engine.connect() as conn:
+        # Tabela pequena: sem desligar a varredura o planejador a prefere.
+        conn.exec_driver_sql('SET enable_seqscan = off')
+        plano = '\n'.join(conn.exec_driver_sql(
+            'EXPLAIN SELECT id FROM devedores '
+            'WHERE score_prioridade IS NOT NULL '
+            'ORDER BY score_prioridade DESC, id LIMIT 4').scalars())
+    assert 'ix_devedores_score_prioridade_id' in plano
+    assert 'Sort' not in plano
+
+
+def _versao_no_banco(engine):
+    versoes = VersaoTabela.__table__
+    with engine.connect() as conn:
+        return conn.execute(
+            select(versoes.c.versao).where(
+                versoes.c.tabela == 'devedores')).scalar()
+
+
+def test_commit_nao_espera_a_linha_de_versoes(engine):
+    with unit_of_work(engine) as session:
+        session.add(Devedor(nome='devedor', pessoa='P1', valortotal=1.0,
+                            atraso=1))
+    antes = _versao_no_banco(engine)
+
+    versoes = VersaoTabela.__table__
+    with engine.connect() as bloqueio:
+        # Outro escritor segurando a linha de versão de `devedores`.
+        bloqueio.execute(
+            select(versoes.c.versao).where(
+                versoes.c.tabela == 'devedores').with_for_update())
+
+        def editar():
+            with unit_of_work(engine) as session:
+                session.query(Devedor).filter_by(
+                    pessoa='P1').one().nome = 'editado'
+
+        escritor = threading.Thread(target=editar)
+        escritor.start()
+        limite = time.monotonic() + 5
+        visivel = False
+        while not visivel and time.monotonic() < limite:
+            with unit_of_work(engine, somente_leitura=True) as session:
+                visivel = session.query(Devedor).filter_by(
+                    nome='editado').count() == 1
+            time.sleep(0.05)
+        # Os dados já foram confirmados; só a versão espera a linha.
+        assert visivel
+        assert escritor.is_alive()
+        bloqueio.rollback()
+    escritor.join(5)
+
+    assert not escritor.is_alive()
+    assert _versao_no_banco(engine) == antes + 1
+
+
+def test_escritores_simultaneos_incrementam_uma_versao_por_commit(engine):
+    with unit_of_work(engine) as session:
+        session.add_all([
+            Devedor(nome=f'devedor {i}', pessoa=f'P{i}', valortotal=1.0,
+                    atraso=0) for i in range(8)
+        ])
+    antes = _versao_no_banco(engine)
+
+    def escrever_varias_vezes(i):
+        for _ in range(10):
+            with unit_of_work(engine) as session:
+                session.query(Devedor).filter_by(
+                    pessoa=f'P{i}').one().atraso += 1
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(escrever_varias_vezes, range(8)))
+
+    assert _versao_no_banco(engine) == antes + 80
+    assert versao_tabelas(engine, 'devedores') == (antes + 80, )
+    with unit_of_work(engine, somente_leitura=True) as session:
+        assert set(session.execute(select(Devedor.atraso)).scalars()) == {10}
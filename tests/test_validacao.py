@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+from validacao import PRIMEIRA_LINHA_DADOS, validar_devedores, validar_pagamentos
+
+
+def _devedores(**colunas):
+    base = {
+        'pessoa': ['P1', 'P2'],
+        'nome': ['Ana', 'Bruno'],
+        'valortotal': [100.0, 200.0],
+        'atraso': [1, 2],
+    }
+    base.update(colunas)
+    return pd.DataFrame(base)
+
+
+def _motivos(rejeitadas):
+    return dict(zip(rejeitadas['linha'], rejeitadas['motivo']))
+
+
+def test_devedores_validos_passam_com_tipos_convertidos():
+    validos, rejeitadas = validar_devedores(
+        _devedores(pessoa=[' p1 ', 'P2'], valortotal=['1.234,56', '1.234'],
+                   atraso=['3', 4.0], status=['Pendente', 'pago']))
+
+    assert rejeitadas.empty
+    assert validos['pessoa'].tolist() == ['p1', 'P2']
+    assert validos['valortotal'].tolist() == [1234.56, 1234.0]
+    assert validos['atraso'].tolist() == [3, 4]
+    assert validos['status'].tolist() == ['EM_ABERTO', 'PAGO']
+
+
+def test_devedores_rejeitados_trazem_linha_e_todos_os_motivos():
+    validos, rejeitadas = validar_devedores(
+        _devedores(nome=[None, 'Bruno'], valortotal=['abc', -5],
+                   atraso=[1.5, 2]))
+
+    assert validos.empty
+    motivos = _motivos(rejeitadas)
+    assert motivos[PRIMEIRA_LINHA_DADOS] == (
+        'nome vazio; valortotal não numérico; atraso não inteiro')
+    assert motivos[PRIMEIRA_LINHA_DADOS + 1] == 'valortotal negativo'
+
+
+def test_devedores_pessoa_repetida_so_rejeita_a_segunda():
+    validos, rejeitadas = validar_devedores(_devedores(pessoa=['P1', 'p1 ']))
+
+    assert validos['pessoa'].tolist() == ['P1']
+    assert _motivos(rejeitadas) == {
+        PRIMEIRA_LINHA_DADOS + 1: 'pessoa repetida no arquivo'
+    }
+
+
+def test_devedores_status_desconhecido():
+    _, rejeitadas = validar_devedores(_devedores(status=['QUITADO', None]))
+
+    assert _motivos(rejeitadas) == {
+        PRIMEIRA_LINHA_DADOS: 'status desconhecido'
+    }
+
+
+def test_devedores_datas_misturadas_na_mesma_coluna():
+    validos, rejeitadas = validar_devedores(
+        _devedores(data_cobranca=['01/02/2025', '2025-02-03']))
+
+    assert rejeitadas.empty
+    assert validos['data_cobranca'].tolist() == [
+        pd.Timestamp(2025, 2, 1), pd.Timestamp(2025, 2, 3)
+    ]
+
+
+def _pagamentos(**colunas):
+    base = {
+        'pessoa': ['P1', 'P2', 'P3'],
+        'valor': ['10,50', '1.234', 20],
+        'data_pagamento': ['01/02/2025', '2025-02-03',
+                           datetime(2025, 2, 4)],
+    }
+    base.update(colunas)
+    return pd.DataFrame(base)
+
+
+def test_pagamentos_validos_com_formatos_misturados():
+    validos, rejeitadas = validar_pagamentos(_pagamentos())
+
+    assert rejeitadas.empty
+    assert validos['valor'].tolist() == [10.5, 1234.0, 20.0]
+    assert validos['data_pagamento'].tolist() == [
+        pd.Timestamp(2025, 2, 1), pd.Timestamp(2025, 2, 3),
+        pd.Timestamp(2025, 2, 4)
+    ]
+
+
+@pytest.mark.parametrize('coluna, valor, motivo', [
+    ('pessoa', '  ', 'pessoa vazia'),
+    ('valor', 'abc', 'valor não numérico'),
+    ('valor', None, 'valor vazio'),
+    ('valor', '0', 'valor não positivo'),
+    ('data_pagamento', '31/02/2025', 'data_pagamento inválida'),
+    ('data_pagamento', None, 'data_pagamento vazia'),
+    ('data_pagamento', datetime.now() + timedelta(days=2),
+     'data_pagamento no futuro'),
+])
+def test_pagamentos_rejeitados(coluna, valor, motivo):
+    df = _pagamentos()
+    df[coluna] = df[coluna].astype(object)
+    df.at[1, coluna] = valor
+
+    validos, rejeitadas = validar_pagamentos(df)
+
+    assert validos.index.tolist() == [0, 2]
+    assert _motivos(rejeitadas) == {PRIMEIRA_LINHA_DADOS + 1: motivo}
@@ -0,0 +1,177 @@
+"""
+Validação vetorizada das linhas de planilhas de importação e de arquivos de
+pagamentos.
+
+Todas as regras são aplicadas à planilha inteira de uma vez (pandas), sem
+inserir ou testar linha a linha: cada regra marca as linhas que viola, e
+cada linha rejeitada sai com todos os motivos. As válidas seguem, já com os
+tipos convertidos, para a inserção em massa.
+"""
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from database import StatusDevedor
+
+COLUNAS_DATA = ('data_cobranca', 'ultima_cobranca', 'data_pagamento')
+STATUS_VALIDOS = frozenset(s.value for s in StatusDevedor)
+# A linha 1 da planilha é o cabeçalho.
+PRIMEIRA_LINHA_DADOS = 2
+
+
+def _texto(serie: pd.Series) -> pd.Series:
+    """Texto sem espaços nas pontas; nulos e vazios viram NA."""
+    texto = serie.astype('string').str.strip()
+    return texto.mask(texto == '')
+
+
+# Só grupos de milhar com ponto, sem decimais: 1.234 / 12.345.678
+_MILHAR_COM_PONTO = r'^[+-]?\d{1,3}(?:\.\d{3})+$'
+
+
+def _numero(serie: pd.Series) -> pd.Series:
+    """
+    Números; texto no formato brasileiro (1.234,56 e 1.234) também é aceito.
+    O separador decimal é o último que aparece: 1,234.56 é lido como 1234.56.
+    """
+    if serie.dtype == object:
+        texto = serie.astype('string').str.strip()
+        brasileiro = ((texto.str.rfind(',') > texto.str.rfind('.'))
+                      | texto.str.match(_MILHAR_COM_PONTO)).fillna(False)
+        texto = texto.where(
+            brasileiro, texto.str.replace(',', '', regex=False)).where(
+                ~brasileiro,
+                texto.str.replace('.', '', regex=False).str.replace(
+                    ',', '.', regex=False))
+        serie = texto.astype(object).where(texto.notna(), None)
+    return pd.to_numeric(serie, errors='coerce')
+
+
+_DATA_ISO = r'^\d{4}-\d{2}-\d{2}'
+
+
+def _datas(serie: pd.Series) -> pd.Series:
+    """
+    Datas de uma coluna que pode misturar células de data do Excel, texto
+    ISO (2025-02-03) e texto brasileiro (03/02/2025): cada grupo é
+    convertido com o seu formato, e não com o inferido da primeira linha.
+    """
+    datas = pd.Series(pd.NaT, index=serie.index, dtype='datetime64[ns]')
+    texto = serie.map(lambda v: v if isinstance(v, str) else None).astype(
+        'string').str.strip()
+    ja_data = texto.isna() & serie.notna()
+    iso = texto.str.match(_DATA_ISO).fillna(False)
+    outros = texto.notna() & ~iso
+    if ja_data.any():
+        datas[ja_data] = pd.to_datetime(serie[ja_data].astype(object),
+                                        errors='coerce')
+    if iso.any():
+        datas[iso] = pd.to_datetime(texto[iso].astype(object),
+                                    errors='coerce', format='ISO8601')
+    if outros.any():
+        datas[outros] = pd.to_datetime(texto[outros].astype(object),
+                                       errors='coerce', format='mixed',
+                                       dayfirst=True)
+    return datas
+
+
+def validar_devedores(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Separa a planilha em (válidas, rejeitadas).
+
+    As válidas têm `pessoa`/`nome` limpos, `valortotal` float, `atraso`
+    inteiro, datas convertidas e `status` como valor de StatusDevedor (ou
+    ausente). As rejeitadas são as linhas originais com `linha` (número na
+    planilha) e `motivo`.
+    """
+    df = df.reset_index(drop=True)
+    validos = df.copy()
+    motivos = pd.DataFrame(index=df.index)
+
+    validos['pessoa'] = _texto(df['pessoa'])
+    motivos['pessoa vazia'] = validos['pessoa'].isna()
+
+    validos['nome'] = _texto(df['nome'])
+    motivos['nome vazio'] = validos['nome'].isna()
+
+    validos['valortotal'] = _numero(df['valortotal'])
+    motivos['valortotal não numérico'] = (validos['valortotal'].isna()
+                                          & df['valortotal'].notna())
+    motivos['valortotal vazio'] = df['valortotal'].isna()
+    motivos['valortotal negativo'] = validos['valortotal'] < 0
+
+    atraso = _numero(df['atraso'])
+    motivos['atraso não numérico'] = atraso.isna() & df['atraso'].notna()
+    motivos['atraso vazio'] = df['atraso'].isna()
+    motivos['atraso não inteiro'] = atraso.notna() & (atraso % 1 != 0)
+    motivos['atraso negativo'] = atraso < 0
+
+    for coluna in COLUNAS_DATA:
+        if coluna not in df.columns:
+            continue
+        datas = _datas(df[coluna])
+        preenchida = _texto(df[coluna].astype(object)).notna()
+        motivos[f'{coluna} inválida'] = datas.isna() & preenchida
+        validos[coluna] = datas.astype(object).where(datas.notna(), None)
+
+    if 'status' in df.columns:
+        # "Pendente" das planilhas antigas equivale a EM_ABERTO.
+        status = _texto(df['status']).replace(
+            'Pendente', StatusDevedor.EM_ABERTO.value).str.upper()
+        motivos['status desconhecido'] = status.notna() & ~status.isin(
+            STATUS_VALIDOS)
+        validos['status'] = status.astype(object).where(status.notna(), None)
+
+    # Só repete quem já tem uma linha válida antes com a mesma pessoa.
+    chave = validos['pessoa'].str.upper().mask(motivos.any(axis=1))
+    motivos['pessoa repetida no arquivo'] = chave.notna() & chave.duplicated()
+
+    validos, rejeitadas = _separar(df, validos, motivos)
+    validos['atraso'] = atraso[validos.index].astype(np.int64)
+    return validos, rejeitadas
+
+
+def validar_pagamentos(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Separa um arquivo de pagamentos (pessoa, valor, data_pagamento) em
+    (válidas, rejeitadas), como `validar_devedores`.
+
+    As válidas têm `pessoa` limpa, `valor` float positivo e `data_pagamento`
+    datetime, que não pode estar no futuro.
+    """
+    df = df.reset_index(drop=True)
+    validos = df.copy()
+    motivos = pd.DataFrame(index=df.index)
+
+    validos['pessoa'] = _texto(df['pessoa'])
+    motivos['pessoa vazia'] = validos['pessoa'].isna()
+
+    validos['valor'] = _numero(df['valor'])
+    motivos['valor não numérico'] = validos['valor'].isna() & df['valor'].notna()
+    motivos['valor vazio'] = df['valor'].isna()
+    motivos['valor não positivo'] = validos['valor'] <= 0
+
+    datas = _datas(df['data_pagamento'])
+    preenchida = _texto(df['data_pagamento'].astype(object)).notna()
+    motivos['data_pagamento inválida'] = datas.isna() & preenchida
+    motivos['data_pagamento vazia'] = ~preenchida
+    motivos['data_pagamento no futuro'] = datas > pd.Timestamp.now()
+    validos['data_pagamento'] = datas
+
+    return _separar(df, validos, motivos)
+
+
+def _separar(df: pd.DataFrame, validos: pd.DataFrame,
+             motivos: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """(válidas, rejeitadas com `linha` e `motivo`) a partir das regras violadas."""
+    rejeitada = motivos.any(axis=1).to_numpy()
+    validos = validos[~rejeitada].copy()
+
+    rejeitadas = df[rejeitada].copy()
+    rejeitadas.insert(0, 'linha', df.index[rejeitada] + PRIMEIRA_LINHA_DADOS)
+    motivo = pd.Series('', index=rejeitadas.index, dtype=object)
+    for regra, violada in motivos[rejeitada].items():
+        motivo = motivo.where(~violada, motivo + '; ' + regra)
+    rejeitadas['motivo'] = motivo.str[2:]
+    return validos, rejeitadas